@@ -0,0 +1,220 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+from core_logic import generate_system_prompt, generate_structured_system_prompt, stream_agent_request, OUTPUT_EVENT_TOKEN, OUTPUT_EVENT_TURN_DONE, TOOL_RESULT_TOKEN_BUDGET
+from response_cache import ResponseCache, DEFAULT_TTL
+
+# Headless runner for large prompt files.
+#
+# Reads a JSONL stream of {"id", "model", "prompt", "target_url", "enabled_tools"} records,
+# runs each through generate_system_prompt and the Ollama request on a worker pool, and
+# appends one result line per record to the output JSONL as soon as it finishes. The input
+# is read lazily with a bounded number of records in flight, so file size does not matter.
+# Re-running with the same output file skips records that already completed (checkpoint).
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+DEFAULT_WORKERS = 4
+
+
+def iter_records(input_file):
+    """
+    Yields (record_id, record, error) for each non-blank line. The id is the record's "id"
+    field if present, else its 1-based line number; `error` is set for unparseable lines.
+    """
+    for line_number, line in enumerate(input_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON on line {line_number}: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, f"Line {line_number} is not a JSON object"
+            continue
+        yield record.get("id", line_number), record, None
+
+
+def load_completed_ids(output_path: str) -> set:
+    """
+    Ids of the records that already have a successful result in `output_path`.
+    """
+    completed = set()
+    try:
+        with open(output_path, encoding="utf-8") as output_file:
+            for line in output_file:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # A partially written last line from an interrupted run
+                if isinstance(result, dict) and "error" not in result:
+                    completed.add(result.get("id"))
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def run_record(record_id, record: dict, ollama_url: str, default_model: str = None, executor=None, tool_token_budget: int = TOOL_RESULT_TOKEN_BUDGET, cache=None, structured: bool = False, prefetcher=None) -> dict:
+    """
+    Runs one record and returns its result line (never raises).
+    """
+    started = time.perf_counter()
+    model = record.get("model") or default_model
+    result = {"id": record_id, "model": model}
+    if not model or not record.get("prompt"):
+        result["error"] = "Record needs a 'prompt' and a 'model' (or --model)."
+        return result
+
+    record_span = tracing.NOOP_SPAN
+    prompt_built = None
+    first_token = None
+    final = None
+    try:
+        # Everything that depends on the record's contents runs in here, so a malformed record becomes an error line
+        record_span = tracing.span("batch_record", start=started, record_id=str(record_id), model=str(model))
+        enabled_tools = record.get("enabled_tools") or []
+        if not isinstance(enabled_tools, list) or not all(isinstance(tool, str) for tool in enabled_tools):
+            raise ValueError("'enabled_tools' must be a list of tool names")
+        with tracing.span("prompt_build", parent=record_span) as build_span:
+            system_prompt = generate_structured_system_prompt(enabled_tools) if structured else generate_system_prompt(enabled_tools)
+            if build_span:
+                build_span.set(prompt_bytes=len(system_prompt.encode("utf-8")))
+        prompt_built = time.perf_counter()
+        for output_event in stream_agent_request(
+                record.get("ollama_url") or ollama_url, model, record["prompt"], record.get("target_url") or None,
+                enabled_tools, executor=executor, system_prompt=system_prompt, span=record_span, tool_token_budget=tool_token_budget, cache=cache, structured=structured, prefetcher=prefetcher):
+            if output_event.kind == OUTPUT_EVENT_TOKEN and first_token is None:
+                first_token = time.perf_counter()
+            elif output_event.kind == OUTPUT_EVENT_TURN_DONE:
+                final = output_event.payload
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        record_span.set(error=type(e).__name__)
+    finished = time.perf_counter()
+    record_span.end(finished)
+
+    if final is not None:
+        raw_model_output, parsed = final
+        data = parsed.json_block.data if parsed.json_block is not None else None
+        if isinstance(data, dict):
+            result["tool_used"] = data.get("tool_used")
+            result["summary"] = data.get("summary")
+            result["user_facing_answer"] = data.get("user_facing_answer")
+        else:
+            result["tool_used"] = None
+            result["summary"] = None
+            result["user_facing_answer"] = raw_model_output.strip()
+        result["tool_calls"] = [{"tool": call.tool, "url": call.url} for call in parsed.tool_calls]
+    result["timings"] = {
+        "prompt_build_ms": round((prompt_built - started) * 1000, 3) if prompt_built is not None else None,
+        "ttft_ms": round((first_token - prompt_built) * 1000, 3) if first_token is not None else None,
+        "total_ms": round((finished - started) * 1000, 3),
+    }
+    return result
+
+
+def run_batch(input_file, output_path: str, ollama_url: str = DEFAULT_OLLAMA_URL, workers: int = DEFAULT_WORKERS, default_model: str = None, executor=None, resume: bool = True, tool_token_budget: int = TOOL_RESULT_TOKEN_BUDGET, cache=None, structured: bool = False, prefetcher=None) -> dict:
+    """
+    Processes every record of `input_file` (an iterable of lines) and appends results to `output_path`.
+    Returns counts of the records written, skipped and failed. With a response_cache.ResponseCache
+    as `cache`, records repeating a prompt are answered from it or share one generation.
+    `structured` requests schema-constrained output (see structured_output); a prefetch.Prefetcher
+    loads each record's target URL while the model generates.
+    """
+    completed = load_completed_ids(output_path) if resume else set()
+    counts = {"written": 0, "skipped": 0, "failed": 0}
+    write_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(workers * 2) # Bounds how far reading runs ahead of the workers
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as output_file, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dogma-batch") as pool:
+
+        def write_result(result: dict):
+            line = json.dumps(result, ensure_ascii=False) + "\n"
+            with write_lock:
+                output_file.write(line)
+                output_file.flush() # Every finished record is checkpointed immediately
+                counts["written"] += 1
+                if "error" in result:
+                    counts["failed"] += 1
+
+        def process(record_id, record):
+            try:
+                try:
+                    result = run_record(record_id, record, ollama_url, default_model, executor, tool_token_budget, cache, structured, prefetcher)
+                except Exception as e:
+                    # Not expected, but an exception here would be swallowed by the pool and the record silently lost
+                    result = {"id": record_id, "error": f"{type(e).__name__}: {e}"}
+                write_result(result)
+            finally:
+                in_flight.release()
+
+        for record_id, record, error in iter_records(input_file):
+            if record_id in completed:
+                counts["skipped"] += 1
+                continue
+            if error is not None:
+                write_result({"id": record_id, "error": error})
+                continue
+            in_flight.acquire()
+            pool.submit(process, record_id, record)
+    return counts
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of agent prompts against Ollama.")
+    parser.add_argument("input", help="Input JSONL file ('-' for stdin)")
+    parser.add_argument("output", help="Output JSONL file; results are appended and completed ids are skipped on re-run")
+    parser.add_argument("--ollama-url", default=DEFAULT_OLLAMA_URL, help=f"Ollama server URL, or several comma-separated URLs to spread the load (default: {DEFAULT_OLLAMA_URL})")
+    parser.add_argument("--model", help="Model for records without a 'model' field")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Concurrent requests (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--run-tools", action="store_true", help="Execute tool calls and feed the results back to the model")
+    parser.add_argument("--prefetch", action="store_true", help="With --run-tools, load each record's target URL while the model generates")
+    parser.add_argument("--tool-token-budget", type=int, default=TOOL_RESULT_TOKEN_BUDGET, help=f"Tokens of page content fed back to the model per turn (default: {TOOL_RESULT_TOKEN_BUDGET})")
+    parser.add_argument("--structured", action="store_true", help="Constrain responses to the JSON output schema instead of a fenced JSON block")
+    parser.add_argument("--no-cache", action="store_true", help="Generate every record, even if it repeats an earlier one")
+    parser.add_argument("--cache-db", help="Keep generated responses in this SQLite file for later runs")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL, help=f"Seconds a cached response is reused (default: {DEFAULT_TTL})")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite the output file instead of resuming")
+    parser.add_argument("--trace-log", help="Append tracing spans to this JSONL file")
+    parser.add_argument("--metrics-file", help="Write Prometheus metrics of the traced spans to this textfile")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level (default: WARNING)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    tracing.configure(args.trace_log, args.metrics_file)
+
+    executor = None
+    if args.run_tools:
+        from page_cache import PageCache
+        from tool_executor import ToolExecutor
+        executor = ToolExecutor(cache=PageCache())
+    prefetcher = None
+    if executor is not None and args.prefetch:
+        from prefetch import Prefetcher
+        prefetcher = Prefetcher(executor)
+    cache = None if args.no_cache else ResponseCache(args.cache_db, ttl=args.cache_ttl)
+    input_file = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        counts = run_batch(input_file, args.output, args.ollama_url, args.workers, args.model, executor, resume=not args.no_resume, tool_token_budget=args.tool_token_budget, cache=cache, structured=args.structured, prefetcher=prefetcher)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if executor is not None:
+            executor.close()
+        if cache is not None:
+            cache.close()
+        tracing.configure() # Flushes the metrics file and closes the trace log
+    if prefetcher is not None:
+        stats = prefetcher.stats()
+        print(f"Prefetched {stats['started']} tool runs: {stats['hit_rate']:.0%} used, {stats['waste_rate']:.0%} wasted.", file=sys.stderr)
+    print(f"Wrote {counts['written']} results ({counts['failed']} failed), skipped {counts['skipped']} completed records.", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,383 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core_logic import StreamingOutputParser, ToolCall, stream_ollama_request, generate_system_prompt
+from mock_ollama import MockOllamaConfig, MockOllamaServer, mock_response_text, split_tokens
+from output_view import OutputView
+from tool_executor import Page, ToolExecutor
+
+# Latency and throughput benchmarks for the request path.
+#
+# Runs batches of streamed requests at several concurrency levels against the bundled mock
+# Ollama server (or a real one with --ollama-url) and reports time to first token, tokens/s
+# and end-to-end latency percentiles, plus the overhead of the streaming output parser and
+# of tool dispatch and the import time of the headless modules. With --output-view it also measures the cost of rendering streamed
+# output in the Tk output area, which needs a display. Results are written as JSON;
+# --compare prints the change against an earlier result file so regressions can be
+# tracked between commits.
+
+DEFAULT_CONCURRENCY = [1, 4, 16]
+DEFAULT_REQUESTS_PER_LEVEL = 32
+DEFAULT_OUTPUT = "benchmark_results.json"
+RESULT_FORMAT_VERSION = 1
+MOCK_MODEL = "mock:latest"
+BENCHMARK_PROMPT = "Summarize the page in two sentences."
+OUTPUT_VIEW_SIZES = [16_000, 128_000, 1_000_000]  # Characters streamed into the output area
+OUTPUT_VIEW_TOKEN_CHARS = 64
+OUTPUT_VIEW_TOKENS_PER_FRAME = 16
+HEADLESS_MODULES = ["core_logic", "batch_runner", "session", "response_cache"]
+STARTUP_BUDGET_MS = 100  # Import time of each headless module in a fresh interpreter
+GUI_AND_BROWSER_MODULES = ("tkinter", "playwright", "browser_use", "asyncio")  # Must not be loaded by headless imports
+TOOL_PAGE_HTML = "<html><head><title>Bench</title></head><body>" + "<p>Paragraph of benchmark text.</p>" * 200 + "</body></html>"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    Linearly interpolated percentile of `values` (fraction between 0 and 1).
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.5), 3),
+        "p90": round(percentile(values, 0.9), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def _timed_request(ollama_url: str, model: str, system_prompt: str) -> dict:
+    started = time.perf_counter()
+    first_token = None
+    tokens = []
+    parse_seconds = 0.0
+    parser = StreamingOutputParser()
+    for token in stream_ollama_request(ollama_url, model, system_prompt, BENCHMARK_PROMPT):
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now
+        tokens.append(token)
+        parser.feed(token)
+        parse_seconds += time.perf_counter() - now
+    parse_started = time.perf_counter()
+    parser.close()
+    finished = time.perf_counter()
+    parse_seconds += finished - parse_started
+    generation = finished - first_token if first_token is not None else 0.0
+    return {
+        "ttft_ms": (first_token - started) * 1000 if first_token is not None else None,
+        "latency_ms": (finished - started) * 1000,
+        "tokens": len(tokens),
+        "tokens_per_second": (len(tokens) - 1) / generation if len(tokens) > 1 and generation > 0 else None,
+        "parse_ms": parse_seconds * 1000,
+    }
+
+
+def bench_requests(ollama_url: str, model: str, concurrency: int, requests: int) -> dict:
+    """
+    Runs `requests` streamed requests with `concurrency` in flight and summarizes their timings.
+    """
+    system_prompt = generate_system_prompt(["Browser Use"])
+    errors = []
+    samples = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(_timed_request, ollama_url, model, system_prompt) for _ in range(requests)]
+        for future in futures:
+            try:
+                samples.append(future.result())
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+    wall = time.perf_counter() - started
+    total_tokens = sum(sample["tokens"] for sample in samples)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_s": round(wall, 3),
+        "requests_per_second": round(len(samples) / wall, 3) if wall > 0 else None,
+        "aggregate_tokens_per_second": round(total_tokens / wall, 3) if wall > 0 else None,
+        "ttft_ms": summarize([s["ttft_ms"] for s in samples if s["ttft_ms"] is not None]),
+        "latency_ms": summarize([s["latency_ms"] for s in samples]),
+        "tokens_per_second": summarize([s["tokens_per_second"] for s in samples if s["tokens_per_second"] is not None]),
+        "parse_ms": summarize([s["parse_ms"] for s in samples]),
+    }
+
+
+def bench_parser(iterations: int = 200, answer_tokens: int = 256) -> dict:
+    """
+    Cost of feeding a typical response through StreamingOutputParser token by token.
+    """
+    tokens = split_tokens(mock_response_text(BENCHMARK_PROMPT, answer_tokens))
+    per_response = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        parser = StreamingOutputParser()
+        for token in tokens:
+            parser.feed(token)
+        parser.close()
+        per_response.append((time.perf_counter() - started) * 1000)
+    mean_ms = sum(per_response) / len(per_response)
+    return {
+        "tokens_per_response": len(tokens),
+        "response_ms": summarize(per_response),
+        "per_token_us": round(mean_ms * 1000 / len(tokens), 3),
+    }
+
+
+class _StaticFetcher:
+    # Serves one in-memory page so only the dispatch and extraction overhead is measured
+    def fetch(self, url: str, headers: dict = None) -> Page:
+        return Page(url, 200, TOOL_PAGE_HTML, {})
+
+    def close(self):
+        pass
+
+
+def bench_tool_dispatch(concurrency: int, calls: int) -> dict:
+    """
+    Submit-to-result latency of ToolExecutor calls against an in-memory page.
+    """
+    executor = ToolExecutor(fetcher=_StaticFetcher(), max_workers=concurrency, per_host_limit=concurrency)
+    try:
+        started = time.perf_counter()
+        latencies = [None] * calls
+        futures = []
+        for index in range(calls):
+            tool_call = ToolCall("Browser Use", f"https://bench{index % concurrency}.invalid/page")
+            submitted_at = time.perf_counter()
+            future = executor.submit(tool_call)
+            # Includes the time spent queued behind other calls
+            future.add_done_callback(lambda _, index=index, submitted_at=submitted_at: latencies.__setitem__(index, (time.perf_counter() - submitted_at) * 1000))
+            futures.append(future)
+        errors = sum(not future.result().ok for future in futures)
+        wall = time.perf_counter() - started
+        while None in latencies: # Callbacks run just after result() is released
+            time.sleep(0.001)
+    finally:
+        executor.close()
+    return {
+        "concurrency": concurrency,
+        "calls": calls,
+        "errors": errors,
+        "calls_per_second": round(calls / wall, 3) if wall > 0 else None,
+        "call_ms": summarize(latencies),
+    }
+
+
+def _replace_all(widget, text: str):
+    # The former update_output_area: the whole text is deleted and reinserted on every update
+    widget.config(state="normal")
+    widget.delete("1.0", "end")
+    widget.insert("end", text)
+    widget.config(state="disabled")
+
+
+def bench_output_view(sizes: list[int] = None) -> dict:
+    """
+    Render cost of streaming `sizes` characters into a Tk text widget, one frame per
+    OUTPUT_VIEW_TOKENS_PER_FRAME tokens: full redraw per frame versus OutputView appends.
+    """
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return {"error": f"No display available: {e}"}
+    root.withdraw()
+    results = []
+    try:
+        token = "x" * (OUTPUT_VIEW_TOKEN_CHARS - 1) + "\n"
+        for size in sizes or OUTPUT_VIEW_SIZES:
+            frames = max(1, size // (OUTPUT_VIEW_TOKEN_CHARS * OUTPUT_VIEW_TOKENS_PER_FRAME))
+            frame_text = token * OUTPUT_VIEW_TOKENS_PER_FRAME
+            timings = {}
+            for approach in ("full_redraw", "output_view"):
+                widget = tk.Text(root)
+                view = OutputView(widget)
+                streamed = []
+                frame_ms = []
+                for _ in range(frames):
+                    started = time.perf_counter()
+                    if approach == "full_redraw":
+                        streamed.append(frame_text)
+                        _replace_all(widget, "".join(streamed))
+                    else:
+                        view.append(frame_text)
+                        view.flush()
+                    root.update_idletasks()
+                    frame_ms.append((time.perf_counter() - started) * 1000)
+                timings[approach] = {"total_ms": round(sum(frame_ms), 3), "frame_ms": summarize(frame_ms)}
+                view.close()
+                widget.destroy()
+            results.append({"chars": frames * len(frame_text), "frames": frames, **timings})
+    finally:
+        root.destroy()
+    return {"sizes": results}
+
+
+_IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+print((time.perf_counter() - started) * 1000)
+print(" ".join(name for name in {unwanted!r} if name in sys.modules))
+"""
+
+
+def bench_import_time(modules: list[str] = None, runs: int = 5) -> list[dict]:
+    """
+    Time to import each of `modules` in a fresh interpreter (median of `runs`), and which GUI or
+    browser modules the import pulled in.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in modules or HEADLESS_MODULES:
+        timings = []
+        loaded = []
+        for _ in range(runs):
+            probe = _IMPORT_PROBE.format(module=module, unwanted=GUI_AND_BROWSER_MODULES)
+            output = subprocess.run([sys.executable, "-c", probe], cwd=directory, capture_output=True, text=True, check=True).stdout.split("\n")
+            timings.append(float(output[0]))
+            loaded = output[1].split()
+        results.append({"module": module, "import_ms": round(percentile(timings, 0.5), 3), "unwanted_modules": loaded})
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(ollama_url: str = None, model: str = MOCK_MODEL, concurrency_levels: list[int] = None,
+                   requests_per_level: int = DEFAULT_REQUESTS_PER_LEVEL, mock_config: MockOllamaConfig = None, output_view: bool = False) -> dict:
+    """
+    Runs all benchmarks and returns the results. Without `ollama_url` a mock server is started
+    with `mock_config` for the duration of the run. `output_view` adds bench_output_view().
+    """
+    concurrency_levels = concurrency_levels or DEFAULT_CONCURRENCY
+    mock_server = None
+    if ollama_url is None:
+        mock_config = mock_config or MockOllamaConfig(models=[model])
+        mock_server = MockOllamaServer(mock_config).start()
+        ollama_url = mock_server.url
+    try:
+        levels = [bench_requests(ollama_url, model, concurrency, requests_per_level) for concurrency in concurrency_levels]
+    finally:
+        if mock_server is not None:
+            mock_server.stop()
+
+    config = {"ollama_url": ollama_url if mock_server is None else "mock", "model": model, "requests_per_level": requests_per_level}
+    if mock_server is not None:
+        config["mock"] = {key: getattr(mock_config, key) for key in ("tokens_per_second", "ttft", "jitter", "failure_rate", "drop_rate", "answer_tokens")}
+    results = {
+        "version": RESULT_FORMAT_VERSION,
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": config,
+        "levels": levels,
+        "parser": bench_parser(),
+        "tool_dispatch": [bench_tool_dispatch(concurrency, requests_per_level) for concurrency in concurrency_levels],
+        "import_time": bench_import_time(),
+    }
+    if output_view:
+        results["output_view"] = bench_output_view()
+    return results
+
+
+def compare_results(baseline: dict, current: dict) -> list[str]:
+    """
+    Lines describing the change of the main metrics from `baseline` to `current`.
+    """
+    def change(name, old, new):
+        if old is None or new is None:
+            return f"{name}: {old} -> {new}"
+        percent = (new - old) / old * 100 if old else 0.0
+        return f"{name}: {old:.3f} -> {new:.3f} ({percent:+.1f}%)"
+
+    lines = [f"Baseline {baseline.get('commit')} vs current {current.get('commit')}"]
+    old_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    for level in current.get("levels", []):
+        old = old_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        for metric in ("ttft_ms", "latency_ms"):
+            for stat in ("p50", "p99"):
+                lines.append(change(f"c={level['concurrency']} {metric} {stat}", old[metric].get(stat), level[metric].get(stat)))
+        lines.append(change(f"c={level['concurrency']} aggregate tokens/s", old.get("aggregate_tokens_per_second"), level.get("aggregate_tokens_per_second")))
+    if "parser" in baseline:
+        lines.append(change("parser us/token", baseline["parser"]["per_token_us"], current["parser"]["per_token_us"]))
+    old_imports = {entry["module"]: entry for entry in baseline.get("import_time", [])}
+    for entry in current.get("import_time", []):
+        if entry["module"] in old_imports:
+            lines.append(change(f"import {entry['module']} ms", old_imports[entry["module"]]["import_ms"], entry["import_ms"]))
+    return lines
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Ollama request path.")
+    parser.add_argument("--ollama-url", help="Benchmark a real Ollama server instead of the bundled mock")
+    parser.add_argument("--model", default=MOCK_MODEL)
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)), help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS_PER_LEVEL, help="Requests per concurrency level")
+    parser.add_argument("--tps", type=float, default=200.0, help="Mock tokens per second per request")
+    parser.add_argument("--ttft", type=float, default=0.05, help="Mock seconds to first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Mock per-token jitter fraction")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Mock probability of an HTTP 500")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"Result file (default: {DEFAULT_OUTPUT})")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--output-view", action="store_true", help="Also benchmark rendering in the Tk output area (needs a display)")
+    args = parser.parse_args(argv)
+
+    mock_config = MockOllamaConfig(args.tps, args.ttft, args.jitter, args.failure_rate, models=[args.model], seed=0)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = run_benchmarks(args.ollama_url, args.model, levels, args.requests, mock_config, args.output_view)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    for level in results["levels"]:
+        print(f"c={level['concurrency']:<3} ttft p50 {level['ttft_ms'].get('p50')} ms, latency p50/p99 "
+              f"{level['latency_ms'].get('p50')}/{level['latency_ms'].get('p99')} ms, "
+              f"{level['aggregate_tokens_per_second']} tok/s, {level['errors']} errors")
+    print(f"parser: {results['parser']['per_token_us']} us/token")
+    for dispatch in results["tool_dispatch"]:
+        print(f"tool dispatch c={dispatch['concurrency']:<3} p50 {dispatch['call_ms'].get('p50')} ms, {dispatch['calls_per_second']} calls/s")
+    for entry in results["import_time"]:
+        over = " (over budget)" if entry["import_ms"] > STARTUP_BUDGET_MS else ""
+        unwanted = f", loads {', '.join(entry['unwanted_modules'])}" if entry["unwanted_modules"] else ""
+        print(f"import {entry['module']}: {entry['import_ms']} ms{over}{unwanted}")
+    if "output_view" in results:
+        if "error" in results["output_view"]:
+            print(f"output view: {results['output_view']['error']}")
+        for size in results["output_view"].get("sizes", []):
+            print(f"output view {size['chars']} chars: full redraw {size['full_redraw']['total_ms']} ms "
+                  f"(worst frame {size['full_redraw']['frame_ms']['max']} ms), appends {size['output_view']['total_ms']} ms "
+                  f"(worst frame {size['output_view']['frame_ms']['max']} ms)")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            print("\n".join(compare_results(json.load(baseline_file), results)))
+    print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
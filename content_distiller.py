@@ -0,0 +1,351 @@
+import heapq
+import math
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+# Reduction of page content to what fits the model's context.
+#
+# Prompt evaluation time grows with every token fed back to the model, so tool output is
+# distilled before it is sent: HTML is converted to text blocks with boilerplate (scripts,
+# navigation, headers/footers, sidebars, cookie banners, link lists) removed, the blocks are
+# grouped into chunks of about `chunk_tokens` tokens, and only the chunks that score best
+# against the user prompt (BM25) are kept, up to a token budget, in their original order.
+#
+# ContentDistiller is fed incrementally: blocks are chunked and scored as they complete and
+# only a bounded set of candidate chunks is retained, so a large page never has to be held
+# in memory as a whole. Token counts are estimated from characters per token, per model family.
+
+DEFAULT_TOKEN_BUDGET = 2000
+DEFAULT_CHUNK_TOKENS = 200
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# Approximate characters per token of English text for the tokenizers of common model families
+MODEL_CHARS_PER_TOKEN = {
+    "llama2": 3.6,
+    "llama3": 4.2,
+    "llama": 4.2,
+    "mistral": 3.7,
+    "mixtral": 3.7,
+    "qwen": 4.0,
+    "gemma": 4.2,
+    "phi": 3.8,
+    "deepseek": 4.0,
+}
+CANDIDATE_CHUNK_FACTOR = 4  # Candidates retained while streaming, relative to the chunks that fit the budget
+GAP_MARKER = "[...]"
+BM25_K1 = 1.2
+BM25_B = 0.75
+LINK_DENSITY_LIMIT = 0.5  # Blocks whose text is mostly link text are navigation
+LINK_LIST_MAX_WORDS = 40  # ...unless they are long enough to be real content
+
+_STOPWORDS = frozenset("""
+a about an and are as at be by can do does for from how i in is it me my of on or please should so
+tell than that the their them then there these this to was what when where which who why will with
+would you your
+""".split())
+_WORD_PATTERN = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+Chunk = namedtuple("Chunk", ["index", "text", "tokens", "score"])
+Distilled = namedtuple("Distilled", ["text", "chunks", "total_chunks", "total_tokens", "kept_tokens"])
+
+
+def chars_per_token(model: str = None) -> float:
+    name = (model or "").lower().split("/")[-1]
+    for family, ratio in MODEL_CHARS_PER_TOKEN.items():
+        if name.startswith(family):
+            return ratio
+    return DEFAULT_CHARS_PER_TOKEN
+
+
+def estimate_tokens(text: str, model: str = None) -> int:
+    """
+    Approximate token count of `text` for `model`, without running its tokenizer.
+    """
+    return math.ceil(len(text) / chars_per_token(model))
+
+
+def query_terms(query: str) -> set:
+    return {word for word in _WORD_PATTERN.findall(query.lower()) if len(word) > 1 and word not in _STOPWORDS}
+
+
+class _BlockExtractor(HTMLParser):
+    """
+    Incremental HTML to text converter that yields the text of content blocks and drops boilerplate.
+    """
+    _SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "nav", "footer", "aside", "form", "button", "select"}
+    _VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+    _CONTENT_TAGS = {"article", "main"}
+    _HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    _BLOCK_TAGS = {"p", "div", "br", "li", "tr", "td", "th", "section", "article", "main", "header", "table", "ul", "ol",
+                   "dl", "dt", "dd", "pre", "blockquote", "figcaption", "hr"} | _HEADING_TAGS
+    _BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "menu", "menubar"}
+    # Whole id/class tokens only ("share-price" is content), with a few common compound forms
+    _BOILERPLATE_ATTRIBUTE = re.compile(
+        r"(?:^|\s)(?:(?:site|main|global|top|social|cookie)[_-])?"
+        r"(nav|navbar|navigation|menu|footer|sidebar|cookies?|consent|banner|breadcrumbs?|share|sharing|social|advert|ads|promo|newsletter|related|popup|modal)"
+        r"(?:[_-](?:bar|banner|links|buttons|notice|widget|wrapper|container))?(?=\s|$)")
+    # Elements whose end tag may be omitted, and the start tags that implicitly close them
+    _IMPLIED_END_TAGS = {
+        "p": _BLOCK_TAGS - {"br"},
+        "li": {"li"}, "dt": {"dt", "dd"}, "dd": {"dt", "dd"}, "tr": {"tr"}, "td": {"td", "th", "tr"}, "th": {"td", "th", "tr"},
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []  # Completed blocks, taken by the caller
+        self._parts = []
+        self._link_chars = 0
+        self._link_depth = 0
+        self._heading = False
+        self._in_title = False
+        self._content_depth = 0
+        self._skipping = []  # The boilerplate element being skipped and the elements open inside it
+
+    def _is_boilerplate(self, tag: str, attrs: dict) -> bool:
+        if tag in self._SKIPPED_TAGS:
+            return True
+        if tag == "header" and not self._content_depth:
+            return True # Page header; headers inside an article hold its title
+        if tag in ("html", "body", "main", "article"):
+            return False
+        if (attrs.get("role") or "").lower() in self._BOILERPLATE_ROLES:
+            return True
+        if attrs.get("aria-hidden") == "true":
+            return True
+        marker = f"{attrs.get('id') or ''} {attrs.get('class') or ''}".lower()
+        return bool(self._BOILERPLATE_ATTRIBUTE.search(marker))
+
+    def handle_starttag(self, tag, attrs):
+        if self._skipping:
+            closing = self._IMPLIED_END_TAGS.get(self._skipping[0], ())
+            if tag not in closing or (len(self._skipping) > 1 and self._skipping[0] != "p"):
+                if tag not in self._VOID_TAGS:
+                    self._skipping.append(tag)
+                return
+            self._skipping = []  # `tag` implicitly ends the skipped element and is content again
+        if tag not in self._VOID_TAGS and self._is_boilerplate(tag, dict(attrs)):
+            self._flush()
+            self._skipping = [tag]
+            return
+        if tag in self._CONTENT_TAGS:
+            self._content_depth += 1
+        if tag == "title":
+            self._flush()
+            self._in_title = True
+        elif tag in self._BLOCK_TAGS:
+            self._flush()
+            self._heading = tag in self._HEADING_TAGS
+        elif tag == "a":
+            self._link_depth += 1
+
+    def handle_endtag(self, tag):
+        if self._skipping:
+            if tag in self._skipping:
+                # Also closes whatever was left open inside it
+                del self._skipping[len(self._skipping) - 1 - self._skipping[::-1].index(tag):]
+                return
+            if self._skipping[0] not in self._IMPLIED_END_TAGS:
+                return  # Stray end tag inside the skipped element
+            self._skipping = []  # Its parent ends, so the skipped element does too
+        if tag in self._CONTENT_TAGS:
+            self._content_depth = max(0, self._content_depth - 1)
+        if tag == "title":
+            self._flush()
+            self._in_title = False
+        elif tag in self._BLOCK_TAGS:
+            self._flush()
+        elif tag == "a":
+            self._link_depth = max(0, self._link_depth - 1)
+
+    def handle_data(self, data):
+        if self._skipping:
+            return
+        self._parts.append(data)
+        if self._link_depth:
+            self._link_chars += len(data.strip())
+
+    def _flush(self):
+        text = " ".join("".join(self._parts).split())
+        keep_short = self._heading or self._in_title
+        link_chars = self._link_chars
+        self._parts = []
+        self._link_chars = 0
+        self._heading = False
+        if not text:
+            return
+        if not keep_short and link_chars > LINK_DENSITY_LIMIT * len(text) and text.count(" ") < LINK_LIST_MAX_WORDS:
+            return # A menu or list of links
+        self.blocks.append(text)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+class ContentDistiller:
+    """
+    Streams content through extraction, chunking and relevance ranking. feed() it pieces of
+    HTML (or plain text with `html=False`), then close() returns the Distilled result.
+    """
+    def __init__(self, query: str = "", token_budget: int = DEFAULT_TOKEN_BUDGET, model: str = None, chunk_tokens: int = DEFAULT_CHUNK_TOKENS, html: bool = True):
+        self.token_budget = token_budget
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self._chars_per_token = chars_per_token(model)
+        self._terms = query_terms(query)
+        self._extractor = _BlockExtractor() if html else None
+        self._text_tail = ""  # Incomplete last line of plain-text input
+        self._chunk_parts = []
+        self._chunk_part_tokens = 0
+        self._chunk_count = 0
+        self._total_tokens = 0
+        self._total_words = 0
+        self._document_frequency = dict.fromkeys(self._terms, 0)
+        self._max_candidates = max(CANDIDATE_CHUNK_FACTOR, CANDIDATE_CHUNK_FACTOR * token_budget // max(1, chunk_tokens))
+        self._candidates = []  # Min-heap of (provisional score, -index, Chunk, term frequencies, word count)
+
+    def _tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self._chars_per_token)
+
+    def feed(self, data: str):
+        if self._extractor is not None:
+            self._extractor.feed(data)
+            blocks, self._extractor.blocks = self._extractor.blocks, []
+        else:
+            lines = (self._text_tail + data).split("\n")
+            self._text_tail = lines.pop()
+            blocks = [line.strip() for line in lines if line.strip()]
+        for block in blocks:
+            self._add_block(block)
+
+    def _add_block(self, text: str):
+        tokens = self._tokens(text)
+        if tokens > self.chunk_tokens:
+            for piece in self._split_block(text):
+                self._add_block(piece)
+            return
+        if self._chunk_parts and self._chunk_part_tokens + tokens > self.chunk_tokens:
+            self._emit_chunk()
+        self._chunk_parts.append(text)
+        self._chunk_part_tokens += tokens
+
+    def _split_block(self, text: str):
+        # Sentence boundaries first; sentences that are still too long are cut at a word boundary
+        max_chars = int(self.chunk_tokens * self._chars_per_token)
+        piece = ""
+        for sentence in _SENTENCE_END.split(text):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                if piece:
+                    yield piece
+                    piece = ""
+                yield sentence[:cut]
+                sentence = sentence[cut:].lstrip()
+            if piece and len(piece) + 1 + len(sentence) > max_chars:
+                yield piece
+                piece = ""
+            piece = f"{piece} {sentence}" if piece else sentence
+        if piece:
+            yield piece
+
+    def _emit_chunk(self):
+        text = "\n".join(self._chunk_parts)
+        tokens = self._tokens(text)
+        self._chunk_parts = []
+        self._chunk_part_tokens = 0
+        index = self._chunk_count
+        self._chunk_count += 1
+        self._total_tokens += tokens
+
+        words = _WORD_PATTERN.findall(text.lower())
+        self._total_words += len(words)
+        frequencies = {}
+        if self._terms:
+            for word in words:
+                if word in self._terms:
+                    frequencies[word] = frequencies.get(word, 0) + 1
+            for term in frequencies:
+                self._document_frequency[term] += 1
+        # Provisional score: BM25 term saturation without IDF, which is only known at the end
+        average_words = self._total_words / self._chunk_count
+        score = sum(self._saturate(frequency, len(words), average_words) for frequency in frequencies.values())
+        entry = (score, -index, Chunk(index, text, tokens, score), frequencies, len(words))
+        if len(self._candidates) < self._max_candidates:
+            heapq.heappush(self._candidates, entry)
+        elif entry[:2] > self._candidates[0][:2]:
+            heapq.heapreplace(self._candidates, entry)
+
+    @staticmethod
+    def _saturate(frequency: int, words: int, average_words: float) -> float:
+        return frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * words / max(1.0, average_words)))
+
+    def close(self) -> Distilled:
+        if self._extractor is not None:
+            self._extractor.close()
+            blocks, self._extractor.blocks = self._extractor.blocks, []
+        else:
+            blocks = [self._text_tail.strip()] if self._text_tail.strip() else []
+            self._text_tail = ""
+        for block in blocks:
+            self._add_block(block)
+        if self._chunk_parts:
+            self._emit_chunk()
+
+        count = self._chunk_count
+        average_words = self._total_words / count if count else 1.0
+        idf = {term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5)) for term, frequency in self._document_frequency.items()}
+        ranked = []
+        for _, _, chunk, frequencies, words in self._candidates:
+            score = sum(idf[term] * self._saturate(frequency, words, average_words) for term, frequency in frequencies.items())
+            ranked.append(chunk._replace(score=round(score, 4)))
+        ranked.sort(key=lambda chunk: (-chunk.score, chunk.index))
+
+        kept = []
+        kept_tokens = 0
+        for chunk in ranked:
+            if kept_tokens + chunk.tokens <= self.token_budget:
+                kept.append(chunk)
+                kept_tokens += chunk.tokens
+        if not kept and ranked:
+            # Budget smaller than one chunk: the best chunk, cut to the budget
+            best = ranked[0]
+            text = best.text[:int(self.token_budget * self._chars_per_token)]
+            kept = [best._replace(text=text, tokens=self._tokens(text))]
+            kept_tokens = kept[0].tokens
+        kept.sort(key=lambda chunk: chunk.index)
+
+        parts = []
+        for position, chunk in enumerate(kept):
+            if position and chunk.index != kept[position - 1].index + 1:
+                parts.append(GAP_MARKER)
+            parts.append(chunk.text)
+        return Distilled("\n\n".join(parts), kept, count, self._total_tokens, kept_tokens)
+
+
+def distill(content: str, query: str = "", token_budget: int = DEFAULT_TOKEN_BUDGET, model: str = None, html: bool = True, chunk_tokens: int = DEFAULT_CHUNK_TOKENS) -> Distilled:
+    """
+    Distills `content` (HTML, or plain text with `html=False`) for `query` within `token_budget`.
+    """
+    return distill_stream([content], query, token_budget, model, html, chunk_tokens)
+
+
+def distill_stream(pieces, query: str = "", token_budget: int = DEFAULT_TOKEN_BUDGET, model: str = None, html: bool = True, chunk_tokens: int = DEFAULT_CHUNK_TOKENS) -> Distilled:
+    """
+    Like distill(), for content arriving as an iterable of pieces (e.g. a response read in blocks).
+    """
+    distiller = ContentDistiller(query, token_budget, model, chunk_tokens, html)
+    for piece in pieces:
+        distiller.feed(piece)
+    return distiller.close()
+
+
+def html_to_text(html: str) -> str:
+    """
+    The text content of `html` without boilerplate, one block per line.
+    """
+    extractor = _BlockExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return "\n".join(extractor.blocks)
@@ -1,3 +1,20 @@
+import json
+import logging
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+import tracing
+from structured_output import generate_structured_system_prompt, output_schema, response_validator
+from tool_registry import known_tools
+
+# The Ollama client, the server pool and the content distiller are imported where they are
+# first used, so the prompt and parsing functions load without the network stack.
+
+logger = logging.getLogger(__name__)
+
+SIMULATED_CHUNK_SIZE = 16  # Characters per chunk when streaming a simulated response.
+
 # Preferred JSON output structure for tool usage:
 # {
 #   "tool_used": "Browser Use" | "SmartScrapeAI",
@@ -23,22 +40,8 @@ def generate_system_prompt(enabled_tools: list[str]) -> str:
                             "Do not attempt to use a tool if the user's request does not require it or if a previous tool use failed for that target.")
         prompt_parts.append("Tool usage instructions:")
 
-    tool_descriptions = {
-        "Browser Use": (
-            "  - **Browser Use**: Accesses a given URL and returns its textual content. "
-            "Useful for fetching information from web pages. "
-            "To use, issue a command in the format: `[TOOL_CALL: Browser Use, URL: <url_to_visit>]`"
-        ),
-        "SmartScrapeAI": (
-            "  - **SmartScrapeAI**: Extracts structured information from a webpage based on a user's query. "
-            "Use this when the user asks for specific data points from a URL. "
-            "To use, issue a command in the format: `[TOOL_CALL: SmartScrapeAI, URL: <url_for_scraping>]`"
-        )
-    }
-
-    for tool_name in enabled_tools:
-        if tool_name in tool_descriptions:
-            prompt_parts.append(tool_descriptions[tool_name])
+    for tool in known_tools(enabled_tools):
+        prompt_parts.append(f"  - **{tool.name}**: {tool.description} To use, issue a command in the format: `{tool.usage}`")
 
     prompt_parts.append(
         "\nWhen you use a tool, you MUST report the outcome of the tool's operation. "
@@ -69,30 +72,76 @@ def generate_system_prompt(enabled_tools: list[str]) -> str:
     )
     return "\n\n".join(prompt_parts)
 
-if __name__ == '__main__':
-    # Example usage:
-    print("---- Example 1: No tools ----")
-    print(generate_system_prompt([]))
-    print("\n---- Example 2: Browser Use only ----")
-    print(generate_system_prompt(["Browser Use"]))
-    print("\n---- Example 3: Both tools ----")
-    print(generate_system_prompt(["Browser Use", "SmartScrapeAI"]))
-    print("\n---- Example 4: Unknown tool (should be ignored by prompt) ----")
-    print(generate_system_prompt(["Browser Use", "ImaginaryTool"]))
+def build_user_content(user_prompt: str, target_url: str = None) -> str:
+    """
+    The user turn of an agent request. The target URL is passed along so the model can use it in tool calls.
+    """
+    if target_url:
+        return f"{user_prompt}\n\nTarget URL: {target_url}"
+    return user_prompt
+
+def build_chat_messages(system_prompt: str, user_prompt: str, target_url: str = None, history: list[dict] = None) -> list[dict]:
+    """
+    Builds the /api/chat message list for an agent request, after the earlier
+    messages of the conversation (`history`), if any.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        *(history or ()),
+        {"role": "user", "content": build_user_content(user_prompt, target_url)},
+    ]
 
-def execute_ollama_request(ollama_url: str, model_name: str, system_prompt: str, user_prompt: str, target_url: str = None, enabled_tools: list[str] = None) -> str:
+def get_ollama_backend(ollama_url: str):
+    """
+    Returns the client for `ollama_url`, or a routed server pool when it lists several
+    comma-separated servers. Both provide chat(), generate() and list_models().
+    """
+    from ollama_client import get_client
+    from server_pool import get_server_pool, parse_server_urls
+    urls = parse_server_urls(ollama_url)
+    if len(urls) > 1:
+        return get_server_pool(urls)
+    return get_client(ollama_url)
+
+def stream_ollama_request(ollama_url: str, model_name: str, system_prompt: str, user_prompt: str, target_url: str = None, enabled_tools: list[str] = None, simulate: bool = False, keep_alive=None):
+    """
+    Sends a chat request to an Ollama-compatible LLM and yields the response text as it is generated.
+    The connection to `ollama_url` is taken from a shared keep-alive pool.
+    `keep_alive`, if given, sets how long the server keeps the model loaded afterwards.
+    With `simulate=True` no request is made and a canned response is streamed instead.
+    """
+    if simulate:
+        response_text = simulate_ollama_request(ollama_url, model_name, system_prompt, user_prompt, target_url, enabled_tools)
+        for start in range(0, len(response_text), SIMULATED_CHUNK_SIZE):
+            yield response_text[start:start + SIMULATED_CHUNK_SIZE]
+        return
+
+    logger.debug("Executing Ollama request: url=%s model=%s target_url=%s tools=%s", ollama_url, model_name, target_url, enabled_tools)
+
+    from ollama_client import iter_text
+    client = get_ollama_backend(ollama_url)
+    extra = {"keep_alive": keep_alive} if keep_alive is not None else {}
+    events = client.chat(model_name, build_chat_messages(system_prompt, user_prompt, target_url), **extra)
+    try:
+        yield from iter_text(events)
+    finally:
+        events.close()
+
+def execute_ollama_request(ollama_url: str, model_name: str, system_prompt: str, user_prompt: str, target_url: str = None, enabled_tools: list[str] = None, simulate: bool = False, keep_alive=None) -> str:
+    """
+    Sends a request to an Ollama-compatible LLM and returns the complete response text.
+    Thin wrapper that drains `stream_ollama_request`.
+    """
+    return "".join(stream_ollama_request(ollama_url, model_name, system_prompt, user_prompt, target_url, enabled_tools, simulate=simulate, keep_alive=keep_alive))
+
+def simulate_ollama_request(ollama_url: str, model_name: str, system_prompt: str, user_prompt: str, target_url: str = None, enabled_tools: list[str] = None) -> str:
     """
     Simulates a request to an Ollama-compatible LLM.
-    In a real implementation, this would involve an HTTP request.
-    For now, it returns a hardcoded response based on enabled tools.
+    Returns a hardcoded response based on enabled tools; useful for demos and tests without a server.
     """
-    print(f"\nExecuting Ollama request (mock):")
-    print(f"  Ollama URL: {ollama_url}")
-    print(f"  Model: {model_name}")
-    print(f"  System Prompt (first 100 chars): {system_prompt[:100]}...")
-    print(f"  User Prompt: {user_prompt}")
-    print(f"  Target URL: {target_url}")
-    print(f"  Enabled Tools: {enabled_tools}")
+    logger.debug("Executing Ollama request (mock): url=%s model=%s target_url=%s tools=%s", ollama_url, model_name, target_url, enabled_tools)
+    logger.debug("System prompt (first 100 chars): %.100s...", system_prompt)
+    logger.debug("User prompt: %s", user_prompt)
 
     mock_json_output = ""
     tool_used_in_mock = None
@@ -148,5 +197,544 @@ def execute_ollama_request(ollama_url: str, model_name: str, system_prompt: str,
             f"This concludes my simulated response based on the general query."
         )
     
-    print(f"  Mock Response (first 100 chars): {response_text[:100]}...")
+    logger.debug("Mock response (first 100 chars): %.100s...", response_text)
     return response_text
+
+# Markers of the output format requested by generate_system_prompt
+JSON_BLOCK_START_MARKER = "```json\n"
+JSON_BLOCK_END_MARKER = "\n```"
+TOOL_CALL_MARKER = "[TOOL_CALL:"
+MAX_TOOL_CALL_LENGTH = 2048  # Longer "[TOOL_CALL:" fragments are treated as plain text.
+
+# Kinds of OutputEvent emitted by StreamingOutputParser
+OUTPUT_EVENT_TOOL_CALL = "tool_call"
+OUTPUT_EVENT_JSON_BLOCK = "json_block"
+OUTPUT_EVENT_ANSWER_DELTA = "answer_delta"
+
+OutputEvent = namedtuple("OutputEvent", ["kind", "payload"])
+ToolCall = namedtuple("ToolCall", ["tool", "url"])
+JsonBlock = namedtuple("JsonBlock", ["json_string", "data", "error"])  # `error` is None when the block parsed
+ParsedOutput = namedtuple("ParsedOutput", ["tool_calls", "json_block"])  # `json_block` is the first complete block
+
+_OUTPUT_MARKERS = re.compile(re.escape(TOOL_CALL_MARKER) + "|" + re.escape(JSON_BLOCK_START_MARKER))
+_TOOL_CALL_END = re.compile(r"[\]\n]")
+_TOOL_CALL_PATTERN = re.compile(r"\s*(?P<tool>[^,]+?)\s*(?:,\s*URL\s*:\s*(?P<url>.*?))?\s*\Z")
+_JSON_STRUCTURE = re.compile(r'["{}\[\]:,]')
+_JSON_STRING_SPECIAL = re.compile(r'["\\]')
+_JSON_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class _AnswerExtractor:
+    """
+    Scans JSON text as it arrives and returns the decoded characters of the top-level
+    "user_facing_answer" string value, so the answer can be shown before the block is complete.
+    """
+    KEY = "user_facing_answer"
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._in_answer = False
+        self._capture = []  # Leading characters of the current string, to recognise the key
+        self._capture_len = 0
+        self._last_string = None
+        self._pending_key = None
+        self._carry = ""  # An escape sequence split across chunks
+        self._done = False
+
+    def feed(self, text: str) -> str:
+        text = self._carry + text
+        self._carry = ""
+        out = []
+        pos = 0
+        while pos < len(text):
+            if self._in_string:
+                match = _JSON_STRING_SPECIAL.search(text, pos)
+                end = match.start() if match else len(text)
+                if end > pos:
+                    self._string_chars(text[pos:end], out)
+                if match is None:
+                    break
+                if text[end] == '"':
+                    self._end_string()
+                    pos = end + 1
+                else:
+                    escape_length = _json_escape_length(text, end)
+                    if escape_length is None:
+                        self._carry = text[end:]
+                        break
+                    self._string_chars(_decode_json_escape(text[end:end + escape_length]), out)
+                    pos = end + escape_length
+            else:
+                match = _JSON_STRUCTURE.search(text, pos)
+                if match is None:
+                    break
+                char = match.group()
+                pos = match.end()
+                if char == '"':
+                    self._start_string()
+                elif char == ":":
+                    self._pending_key = self._last_string
+                else:
+                    if char in "{[":
+                        self._depth += 1
+                    elif char in "}]":
+                        self._depth -= 1
+                    self._pending_key = None
+                    self._last_string = None
+        return "".join(out)
+
+    def _start_string(self):
+        self._in_string = True
+        self._in_answer = not self._done and self._depth == 1 and self._pending_key == self.KEY
+        self._pending_key = None
+        self._capture = []
+        self._capture_len = 0
+
+    def _string_chars(self, chars: str, out: list):
+        if self._in_answer:
+            out.append(chars)
+        elif self._capture_len <= len(self.KEY):
+            # Only strings no longer than the key can be the key; the rest is skipped
+            self._capture.append(chars[:len(self.KEY) + 1])
+            self._capture_len += len(chars)
+
+    def _end_string(self):
+        self._in_string = False
+        if self._in_answer:
+            self._in_answer = False
+            self._done = True
+        self._last_string = "".join(self._capture) if self._capture_len <= len(self.KEY) else None
+
+
+def _json_escape_length(text: str, start: int):
+    # Length of the escape sequence at text[start] ("\\"), or None if it is not complete yet
+    if start + 1 >= len(text):
+        return None
+    if text[start + 1] != "u":
+        return 2
+    if start + 6 > len(text):
+        return None
+    if "d800" <= text[start + 2:start + 6].lower() <= "dbff":
+        # High surrogate: decode it together with the low surrogate that should follow
+        if start + 12 > len(text):
+            return None
+        if text[start + 6:start + 8] == "\\u":
+            return 12
+    return 6
+
+
+def _decode_json_escape(escape: str) -> str:
+    if escape[1] != "u":
+        return _JSON_SIMPLE_ESCAPES.get(escape[1], escape[1])
+    try:
+        return json.loads(f'"{escape}"')
+    except json.JSONDecodeError:
+        return ""
+
+
+class StreamingOutputParser:
+    """
+    Chunk-fed parser for model output. Detects `[TOOL_CALL: <tool>, URL: <url>]` directives and the
+    fenced ```json block while tokens are still arriving, and reports them as OutputEvents:
+    a ToolCall as soon as its closing bracket arrives, the JsonBlock once its closing fence arrives,
+    and `user_facing_answer` text deltas while the block is being generated.
+
+    Each character is scanned once; only a marker-sized tail is held back between chunks.
+    """
+    _TEXT, _TOOL_CALL, _JSON = range(3)
+
+    def __init__(self):
+        self._state = self._TEXT
+        self._tail = ""
+        self._directive = []
+        self._directive_len = 0
+        self._json_parts = []
+        self._answer = None
+        self.tool_calls = []
+        self.json_block = None
+
+    def feed(self, chunk: str) -> list[OutputEvent]:
+        events = []
+        data = self._tail + chunk
+        self._tail = ""
+        pos = 0
+        while pos < len(data):
+            if self._state == self._TEXT:
+                pos = self._scan_text(data, pos)
+            elif self._state == self._TOOL_CALL:
+                pos = self._scan_tool_call(data, pos, events)
+            else:
+                pos = self._scan_json(data, pos, events)
+        return events
+
+    def close(self) -> list[OutputEvent]:
+        """
+        Flushes the held-back tail at the end of the stream. An unterminated JSON block or
+        directive is not reported.
+        """
+        events = []
+        if self._state == self._JSON and self._tail:
+            delta = self._answer.feed(self._tail)
+            if delta:
+                events.append(OutputEvent(OUTPUT_EVENT_ANSWER_DELTA, delta))
+        self._tail = ""
+        return events
+
+    def result(self) -> ParsedOutput:
+        return ParsedOutput(list(self.tool_calls), self.json_block)
+
+    def _scan_text(self, data: str, pos: int) -> int:
+        match = _OUTPUT_MARKERS.search(data, pos)
+        if match is None:
+            # Hold back a tail that may be the beginning of a marker split across chunks
+            keep_from = max(pos, len(data) - len(TOOL_CALL_MARKER) + 1)
+            self._tail = data[keep_from:]
+            return len(data)
+        if match.group() == TOOL_CALL_MARKER:
+            self._state = self._TOOL_CALL
+            self._directive = []
+            self._directive_len = 0
+        else:
+            self._state = self._JSON
+            self._json_parts = []
+            self._answer = _AnswerExtractor()
+        return match.end()
+
+    def _scan_tool_call(self, data: str, pos: int, events: list) -> int:
+        match = _TOOL_CALL_END.search(data, pos)
+        if match is None:
+            self._directive.append(data[pos:])
+            self._directive_len += len(data) - pos
+            if self._directive_len > MAX_TOOL_CALL_LENGTH:
+                self._state = self._TEXT
+            return len(data)
+
+        self._state = self._TEXT
+        if match.group() == "\n":
+            return match.start() # Directives are single-line; this was plain text
+        self._directive.append(data[pos:match.start()])
+        directive = "".join(self._directive)
+        parsed = _TOOL_CALL_PATTERN.match(directive) if len(directive) <= MAX_TOOL_CALL_LENGTH else None
+        if parsed:
+            tool_call = ToolCall(parsed.group("tool"), parsed.group("url") or None)
+            self.tool_calls.append(tool_call)
+            events.append(OutputEvent(OUTPUT_EVENT_TOOL_CALL, tool_call))
+        return match.end()
+
+    def _scan_json(self, data: str, pos: int, events: list) -> int:
+        end = data.find(JSON_BLOCK_END_MARKER, pos)
+        if end == -1:
+            # Hold back a tail that may be the beginning of the closing fence
+            cut = max(pos, len(data) - len(JSON_BLOCK_END_MARKER) + 1)
+            self._tail = data[cut:]
+            self._json_content(data[pos:cut], events)
+            return len(data)
+
+        self._json_content(data[pos:end], events)
+        json_string = "".join(self._json_parts).strip()
+        self._json_parts = []
+        try:
+            block = JsonBlock(json_string, json.loads(json_string), None)
+        except json.JSONDecodeError as e:
+            block = JsonBlock(json_string, None, str(e))
+        if self.json_block is None:
+            self.json_block = block
+        events.append(OutputEvent(OUTPUT_EVENT_JSON_BLOCK, block))
+        self._state = self._TEXT
+        return end + len(JSON_BLOCK_END_MARKER)
+
+    def _json_content(self, content: str, events: list):
+        if not content:
+            return
+        self._json_parts.append(content)
+        delta = self._answer.feed(content)
+        if delta:
+            events.append(OutputEvent(OUTPUT_EVENT_ANSWER_DELTA, delta))
+
+
+class StructuredOutputParser:
+    """
+    Parser for schema-constrained output (see structured_output), with the interface of
+    StreamingOutputParser. The whole response is the JSON object: `user_facing_answer` deltas
+    are reported while it arrives, and on close the object is validated and reported as the
+    JsonBlock, preceded by a ToolCall if it requests a tool without answering yet.
+    """
+    def __init__(self, enabled_tools: list[str] = None):
+        self._validate = response_validator(tuple(enabled_tools or ()))
+        self._parts = []
+        self._answer = _AnswerExtractor()
+        self.tool_calls = []
+        self.json_block = None
+
+    def feed(self, chunk: str) -> list[OutputEvent]:
+        self._parts.append(chunk)
+        delta = self._answer.feed(chunk)
+        return [OutputEvent(OUTPUT_EVENT_ANSWER_DELTA, delta)] if delta else []
+
+    def close(self) -> list[OutputEvent]:
+        json_string = "".join(self._parts).strip()
+        self._parts = []
+        if not json_string:
+            return []
+        try:
+            data = json.loads(json_string)
+        except json.JSONDecodeError as e:
+            self.json_block = JsonBlock(json_string, None, str(e))
+            return [OutputEvent(OUTPUT_EVENT_JSON_BLOCK, self.json_block)]
+        errors = self._validate(data)
+        if errors:
+            self.json_block = JsonBlock(json_string, None, "; ".join(errors))
+            return [OutputEvent(OUTPUT_EVENT_JSON_BLOCK, self.json_block)]
+        events = []
+        self.json_block = JsonBlock(json_string, data, None)
+        if data["tool_used"] and not data["user_facing_answer"].strip():
+            tool_call = ToolCall(data["tool_used"], (data.get("tool_input") or {}).get("url") or None)
+            self.tool_calls.append(tool_call)
+            events.append(OutputEvent(OUTPUT_EVENT_TOOL_CALL, tool_call))
+        events.append(OutputEvent(OUTPUT_EVENT_JSON_BLOCK, self.json_block))
+        return events
+
+    def result(self) -> ParsedOutput:
+        return ParsedOutput(list(self.tool_calls), self.json_block)
+
+
+def parse_model_output(raw_model_output: str) -> ParsedOutput:
+    """
+    Parses a complete model response with StreamingOutputParser.
+    """
+    parser = StreamingOutputParser()
+    parser.feed(raw_model_output.strip() if raw_model_output else "")
+    parser.close()
+    return parser.result()
+
+
+# Kinds of OutputEvent emitted by stream_agent_request in addition to the parser's
+OUTPUT_EVENT_TOKEN = "token"
+OUTPUT_EVENT_TOOL_RESULT = "tool_result"
+OUTPUT_EVENT_FOLLOW_UP = "follow_up"  # A follow-up model turn with tool results starts; payload is a FollowUp
+OUTPUT_EVENT_TURN_DONE = "turn_done"  # Payload is (raw_model_output, ParsedOutput) of the final turn
+
+FollowUp = namedtuple("FollowUp", ["round", "messages"])  # `messages`: the tool-calling assistant turn and the tool results message sent after it
+
+MAX_TOOL_ROUNDS = 2  # Follow-up turns that may still trigger tool calls
+TOOL_RESULT_TOKEN_BUDGET = 2000  # Estimated tokens of page content fed back to the model per turn, shared by its results
+
+
+def format_tool_results(results, query: str = "", model: str = None, token_budget: int = TOOL_RESULT_TOKEN_BUDGET, structured: bool = False, final: bool = False) -> str:
+    """
+    Renders tool results (tool_executor.ToolResult) as the user turn of a follow-up request.
+    Page text is reduced to the passages most relevant to `query` that fit `token_budget`
+    (see content_distiller) after the extracted data, which is truncated if it alone exceeds
+    its result's share. With `structured`, the closing instruction asks for the JSON
+    object of structured_output instead of a fenced block. With `final`, the model is told that
+    no more tools can be used.
+    """
+    from content_distiller import chars_per_token, distill, estimate_tokens
+    budget = token_budget // max(1, sum(1 for result in results if result.ok))
+    parts = ["Tool results:"]
+    for result in results:
+        if result.ok:
+            data = json.dumps(result.data, ensure_ascii=False) if result.data else ""
+            max_data_chars = int(budget * chars_per_token(model))
+            if len(data) > max_data_chars:
+                data = data[:max_data_chars] + " [truncated]"
+            distilled = distill(result.text, query, max(0, budget - estimate_tokens(data, model)), model, html=False)
+            text = distilled.text
+            if len(distilled.chunks) < distilled.total_chunks:
+                text += f"\n[Showing the {len(distilled.chunks)} of {distilled.total_chunks} passages most relevant to the request]"
+            part = f"[{result.tool}] {result.url}\n{text}"
+            if data:
+                part += f"\nExtracted data: {data}"
+        else:
+            part = f"[{result.tool}] {result.url}\nThe tool failed: {result.error}"
+        parts.append(part)
+    if structured:
+        parts.append(
+            "Using these results, answer the original request. Reply with the JSON object as instructed, with the "
+            "complete answer in \"user_facing_answer\". Do not repeat tool calls that already have results."
+        )
+    else:
+        parts.append(
+            "Using these results, answer the original request. Report the outcome in the JSON block as instructed, "
+            "followed by your conversational answer. Do not repeat tool calls that already have results."
+        )
+    if final:
+        parts[-1] += " The tool budget of this request is exhausted: no more tools can be used, answer with these results."
+    return "\n\n".join(parts)
+
+
+def build_follow_up_messages(messages: list[dict], assistant_output: str, results, query: str = "", model: str = None, token_budget: int = TOOL_RESULT_TOKEN_BUDGET, structured: bool = False, final: bool = False) -> list[dict]:
+    return messages + [
+        {"role": "assistant", "content": assistant_output},
+        {"role": "user", "content": format_tool_results(results, query, model, token_budget, structured, final)},
+    ]
+
+
+def _start_tool_call(output_event: OutputEvent, pending: dict, executor, enabled_tools: list[str], target_url: str, request_span, prefetch=None):
+    # Submits a parsed tool call unless the same call already runs in this turn, or takes its prefetched result
+    tool_call = ToolCall(output_event.payload.tool, output_event.payload.url or target_url)
+    if tool_call in pending:
+        return
+    future = prefetch.claim(tool_call) if prefetch is not None else None
+    tool_span = tracing.span("tool", parent=request_span, tool=tool_call.tool, url=tool_call.url, prefetched=future is not None)
+    pending[tool_call] = future if future is not None else executor.submit(tool_call, allowed_tools=enabled_tools)
+    if tool_span:
+        pending[tool_call].add_done_callback(lambda future: _end_tool_span(tool_span, future))
+
+
+def _wait_for_results(futures: list, cancel=None) -> list:
+    # The results of `futures` in order. With `cancel` (an execution_engine.TaskContext) the
+    # wait ends as soon as the task is cancelled: the futures are cancelled and TaskCancelled raised.
+    if cancel is None:
+        return [future.result() for future in futures]
+    cancelled = Future()
+    remove_cancel_hook = cancel.add_cancel_callback(lambda: cancelled.set_result(None))
+    try:
+        not_done = set(futures)
+        while not_done and not cancelled.done():
+            not_done = wait(not_done | {cancelled}, return_when=FIRST_COMPLETED).not_done - {cancelled}
+    finally:
+        remove_cancel_hook()
+    if cancelled.done():
+        for future in futures:
+            future.cancel()
+        cancel.check_cancelled()
+    return [future.result() for future in futures]
+
+
+def _end_tool_span(tool_span, future):
+    if future.cancelled():
+        tool_span.end(error="cancelled")
+        return
+    if future.exception() is not None:
+        tool_span.end(error=type(future.exception()).__name__)
+        return
+    result = future.result()
+    tool_span.end(ok=result.ok, run_ms=round(result.elapsed * 1000, 3), result_bytes=len(result.text.encode("utf-8")))
+
+
+def stream_agent_request(ollama_url: str, model_name: str, user_prompt: str, target_url: str = None, enabled_tools: list[str] = None, executor=None, system_prompt: str = None, keep_alive=None, span=None, tool_token_budget: int = TOOL_RESULT_TOKEN_BUDGET, history: list[dict] = None, cache=None, structured: bool = False, prefetcher=None, cancel=None):
+    """
+    Runs one agent request: streams the model output, starts each tool call on `executor`
+    (a tool_executor.ToolExecutor) as soon as it is parsed, and feeds the tool results back
+    in a follow-up turn, distilled to `tool_token_budget` tokens. `keep_alive` is passed
+    with every model request; `history` holds earlier messages of the conversation.
+    With a response_cache.ResponseCache as `cache`, identical requests are answered from it
+    or share one generation. With `structured`, the response is constrained to the JSON schema
+    of structured_output instead of carrying a fenced JSON block. With a prefetch.Prefetcher,
+    `target_url` is loaded for the enabled tools while the model generates. Cancelling
+    `cancel` (an execution_engine.TaskContext) aborts the model request or the wait for tool
+    results in progress. The request is traced as an "agent_request" span under `span`, if given.
+    Yields OutputEvents; the last one is OUTPUT_EVENT_TURN_DONE.
+    """
+    enabled_tools = enabled_tools or []
+    schema = output_schema(enabled_tools) if structured else None
+    new_parser = (lambda: StructuredOutputParser(enabled_tools)) if structured else StreamingOutputParser
+    if cache is not None:
+        if system_prompt is None:
+            system_prompt = generate_structured_system_prompt(enabled_tools) if structured else generate_system_prompt(enabled_tools)
+        key = cache.cache_key(model_name, system_prompt, user_prompt, target_url, history, schema,
+                              run_tools=executor is not None, tool_token_budget=tool_token_budget)
+        yield from cache.stream(key, model_name, lambda flight_cancel: stream_agent_request(
+            ollama_url, model_name, user_prompt, target_url, enabled_tools, executor, system_prompt,
+            keep_alive, span, tool_token_budget, history, structured=structured, prefetcher=prefetcher, cancel=flight_cancel),
+            span=span, new_parser=new_parser, cancel=cancel)
+        return
+    request_span = tracing.span("agent_request", parent=span, model=model_name, tools=",".join(enabled_tools))
+    traced = bool(request_span)
+    prefetch = None
+    try:
+        if prefetcher is not None and executor is not None:
+            # Started first so the page loads while the prompt is sent and the model generates
+            prefetch = prefetcher.start(target_url, enabled_tools)
+        if system_prompt is None:
+            with tracing.span("prompt_build", parent=request_span) as build_span:
+                system_prompt = generate_structured_system_prompt(enabled_tools) if structured else generate_system_prompt(enabled_tools)
+                if build_span:
+                    build_span.set(prompt_bytes=len(system_prompt.encode("utf-8")))
+        from ollama_client import iter_text
+        messages = build_chat_messages(system_prompt, user_prompt, target_url, history)
+        client = get_ollama_backend(ollama_url)
+        extra = {"keep_alive": keep_alive} if keep_alive is not None else {}
+        if schema is not None:
+            extra["format"] = schema
+
+        for tool_round in range(MAX_TOOL_ROUNDS + 1):
+            parser = new_parser()
+            if schema is not None and tool_round == MAX_TOOL_ROUNDS:
+                # No tool call can run in the last turn, so its schema does not offer any
+                parser = StructuredOutputParser([])
+                extra["format"] = output_schema([])
+            chunks = []
+            pending = {}  # (tool, url) -> Future[ToolResult]; identical calls in a turn run once
+            turn_span = tracing.span("model_turn", parent=request_span, round=tool_round)
+            requested_at = time.perf_counter()
+            first_token_at = None
+            parse_seconds = 0.0
+            events = client.chat(model_name, messages, span=turn_span, cancel=cancel, **extra)
+            try:
+                for token in iter_text(events):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        tracing.span("ttft", parent=turn_span, start=requested_at).end(first_token_at)
+                    chunks.append(token)
+                    yield OutputEvent(OUTPUT_EVENT_TOKEN, token)
+                    if traced:
+                        feed_started = time.perf_counter()
+                        output_events = parser.feed(token)
+                        parse_seconds += time.perf_counter() - feed_started
+                    else:
+                        output_events = parser.feed(token)
+                    for output_event in output_events:
+                        if output_event.kind == OUTPUT_EVENT_TOOL_CALL and executor is not None and tool_round < MAX_TOOL_ROUNDS:
+                            _start_tool_call(output_event, pending, executor, enabled_tools, target_url, request_span, prefetch)
+                        yield output_event
+            finally:
+                events.close()
+                if traced:
+                    if first_token_at is not None:
+                        raw_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+                        tracing.span("generation", parent=turn_span, start=first_token_at).end(
+                            chunks=len(chunks), output_bytes=raw_bytes, parse_ms=round(parse_seconds * 1000, 3))
+                    turn_span.end(tool_calls=len(pending))
+            for output_event in parser.close():
+                # Structured responses only request their tool once the object is complete
+                if output_event.kind == OUTPUT_EVENT_TOOL_CALL and executor is not None and tool_round < MAX_TOOL_ROUNDS:
+                    _start_tool_call(output_event, pending, executor, enabled_tools, target_url, request_span, prefetch)
+                yield output_event
+
+            raw_model_output = "".join(chunks)
+            if not pending:
+                yield OutputEvent(OUTPUT_EVENT_TURN_DONE, (raw_model_output, parser.result()))
+                return
+            results = _wait_for_results(list(pending.values()), cancel)
+            for result in results:
+                yield OutputEvent(OUTPUT_EVENT_TOOL_RESULT, result)
+            with tracing.span("distill", parent=request_span) as distill_span:
+                messages = build_follow_up_messages(messages, raw_model_output, results, user_prompt, model_name, tool_token_budget, structured,
+                                                    final=tool_round + 1 == MAX_TOOL_ROUNDS)
+                if distill_span:
+                    distill_span.set(input_bytes=sum(len(result.text.encode("utf-8")) for result in results),
+                                     output_bytes=len(messages[-1]["content"].encode("utf-8")))
+            yield OutputEvent(OUTPUT_EVENT_FOLLOW_UP, FollowUp(tool_round + 1, messages[-2:]))
+    except BaseException as e:
+        request_span.set(error=type(e).__name__)
+        raise
+    finally:
+        if prefetch is not None:
+            prefetch.release()
+            request_span.set(prefetch_hits=prefetch.hits)
+        request_span.end()
+
+
+if __name__ == '__main__':
+    # Example usage:
+    print("---- Example 1: No tools ----")
+    print(generate_system_prompt([]))
+    print("\n---- Example 2: Browser Use only ----")
+    print(generate_system_prompt(["Browser Use"]))
+    print("\n---- Example 3: Both tools ----")
+    print(generate_system_prompt(["Browser Use", "SmartScrapeAI"]))
+    print("\n---- Example 4: Unknown tool (should be ignored by prompt) ----")
+    print(generate_system_prompt(["Browser Use", "ImaginaryTool"]))
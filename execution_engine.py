@@ -0,0 +1,214 @@
+import itertools
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Background execution for work that must not run on the Tk event thread.
+#
+# Jobs run on a bounded worker pool and report back through a thread-safe queue of
+# TaskEvents, which the UI drains from an `after()` callback. A job receives a
+# TaskContext as its first argument to emit partial results and observe cancellation.
+# Cancellation is checked between the items a job iterates over; code that blocks for
+# longer (waiting for a model's first token, or for tool results) registers a cancel
+# callback that unblocks it, e.g. by shutting down the socket it is reading from.
+
+DEFAULT_MAX_CONCURRENT = 4
+
+# Event kinds emitted by the engine itself; jobs may emit any other kind (e.g. "token").
+EVENT_STARTED = "started"
+EVENT_RESULT = "result"
+EVENT_ERROR = "error"
+EVENT_CANCELLED = "cancelled"
+TERMINAL_EVENTS = (EVENT_RESULT, EVENT_ERROR, EVENT_CANCELLED)
+
+TaskEvent = namedtuple("TaskEvent", ["task_id", "kind", "payload"])
+
+
+class TaskCancelled(Exception):
+    """
+    Raised inside a job when its task has been cancelled.
+    """
+
+
+class TaskContext:
+    """
+    Handed to a running job: emits events for its task and exposes cancellation.
+    """
+    def __init__(self, task_id: int, events: queue.Queue):
+        self.task_id = task_id
+        self._events = events
+        self._cancel_event = threading.Event()
+        self._cancel_callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._cancel_event.is_set():
+                return
+            self._cancel_event.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass # A failing hook must not keep the others from running
+
+    def add_cancel_callback(self, callback):
+        """
+        Calls `callback()` (on the cancelling thread, so it must be quick) when the task is
+        cancelled, or right away if it already is. Returns a function that unregisters it.
+        """
+        with self._lock:
+            if not self._cancel_event.is_set():
+                self._cancel_callbacks.append(callback)
+                return lambda: self._remove_cancel_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_cancel_callback(self, callback):
+        with self._lock:
+            if callback in self._cancel_callbacks:
+                self._cancel_callbacks.remove(callback)
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise TaskCancelled(f"Task {self.task_id} was cancelled.")
+
+    def emit(self, kind: str, payload=None):
+        self._events.put(TaskEvent(self.task_id, kind, payload))
+
+    def iterate(self, iterable):
+        """
+        Yields from `iterable` until the task is cancelled. On cancellation the iterable is
+        closed (for a token stream this drops the HTTP connection and stops generation).
+        """
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                self.check_cancelled()
+                yield item
+            self.check_cancelled()
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+
+class TaskHandle:
+    """
+    Returned by `ExecutionEngine.submit`; used to cancel or wait on a task.
+    """
+    def __init__(self, context: TaskContext, future):
+        self.context = context
+        self.future = future
+
+    @property
+    def task_id(self) -> int:
+        return self.context.task_id
+
+    def cancel(self):
+        self.context.cancel()
+        if self.future.cancel():
+            # Never started: the worker will not run, so report the cancellation here.
+            self.context.emit(EVENT_CANCELLED)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout)
+
+
+class ExecutionEngine:
+    """
+    Runs jobs on up to `max_concurrent` worker threads; further submissions queue.
+    """
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT):
+        self.events = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="dogma-worker")
+        self._ids = itertools.count(1)
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> TaskHandle:
+        """
+        Schedules `fn(context, *args, **kwargs)`. Its return value is emitted as a "result" event.
+        """
+        context = TaskContext(next(self._ids), self.events)
+        with self._lock:
+            # Registered under the lock so a task finishing immediately cannot be forgotten before it is tracked.
+            future = self._executor.submit(self._run, context, fn, args, kwargs)
+            handle = TaskHandle(context, future)
+            self._handles[context.task_id] = handle
+        future.add_done_callback(lambda _: self._forget(context.task_id))
+        return handle
+
+    def _run(self, context: TaskContext, fn, args, kwargs):
+        if context.cancelled:
+            context.emit(EVENT_CANCELLED)
+            return None
+        context.emit(EVENT_STARTED)
+        try:
+            result = fn(context, *args, **kwargs)
+        except TaskCancelled:
+            context.emit(EVENT_CANCELLED)
+            return None
+        except Exception as e:
+            if context.cancelled:
+                # Cancellation closed the underlying connection; report it as such, not as a failure.
+                context.emit(EVENT_CANCELLED)
+            else:
+                context.emit(EVENT_ERROR, e)
+            return None
+        if context.cancelled:
+            context.emit(EVENT_CANCELLED)
+            return None
+        context.emit(EVENT_RESULT, result)
+        return result
+
+    def _forget(self, task_id: int):
+        with self._lock:
+            self._handles.pop(task_id, None)
+
+    @property
+    def active_count(self) -> int:
+        """
+        Number of tasks that are queued or running.
+        """
+        with self._lock:
+            return len(self._handles)
+
+    def cancel(self, task_id: int) -> bool:
+        with self._lock:
+            handle = self._handles.get(task_id)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def cancel_all(self):
+        with self._lock:
+            handles = list(self._handles.values())
+        for handle in handles:
+            handle.cancel()
+
+    def drain_events(self, max_events: int = None) -> list[TaskEvent]:
+        """
+        Returns pending events without blocking (at most `max_events` if given).
+        """
+        drained = []
+        while max_events is None or len(drained) < max_events:
+            try:
+                drained.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return drained
+
+    def shutdown(self, wait: bool = False):
+        self.cancel_all()
+        self._executor.shutdown(wait=wait)
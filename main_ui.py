@@ -1,9 +1,25 @@
+import logging
+import os
 import tkinter as tk
 from tkinter import ttk
-import json
-import urllib.request
-import urllib.error
-from core_logic import generate_system_prompt, execute_ollama_request
+import tracing
+from core_logic import (
+    stream_agent_request, parse_model_output, build_user_content, ParsedOutput,
+    OUTPUT_EVENT_TOKEN, OUTPUT_EVENT_ANSWER_DELTA, OUTPUT_EVENT_TOOL_CALL, OUTPUT_EVENT_TOOL_RESULT,
+    OUTPUT_EVENT_FOLLOW_UP, OUTPUT_EVENT_TURN_DONE,
+)
+from execution_engine import ExecutionEngine, EVENT_RESULT, EVENT_ERROR, EVENT_CANCELLED, TERMINAL_EVENTS
+from ollama_client import OllamaError
+from model_manager import ModelManager
+from output_view import OutputView
+from session import ChatSession
+from response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_MS = 16 # ~60fps; background task events are applied to the widgets at this rate
+MAX_EVENTS_PER_POLL = 500 # Bounds the work done per frame when a burst of tokens arrives
+MAX_CONCURRENT_REQUESTS = 4
 
 class DogmaAgentControlUI:
     def __init__(self, master):
@@ -11,7 +27,7 @@ class DogmaAgentControlUI:
         master.title("Dogma Agent Control")
 
         # Ollama Server URL
-        self.ollama_url_label = ttk.Label(master, text="Ollama Server URL:")
+        self.ollama_url_label = ttk.Label(master, text="Ollama Server URL(s):")
         self.ollama_url_label.grid(row=0, column=0, sticky="w", padx=5, pady=5)
         self.ollama_url_entry = ttk.Entry(master, width=40) # Adjusted width
         self.ollama_url_entry.insert(0, "http://localhost:11434")
@@ -24,13 +40,20 @@ class DogmaAgentControlUI:
         self.model_label = ttk.Label(master, text="Select Model:")
         self.model_label.grid(row=1, column=0, sticky="w", padx=5, pady=5)
         self.model_combobox = ttk.Combobox(master, values=[]) # Initially empty
-        self.model_combobox.grid(row=1, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.model_combobox.grid(row=1, column=1, sticky="ew", padx=5, pady=5)
+        self.model_combobox.bind("<<ComboboxSelected>>", self.on_model_selected)
+        self.pin_model_var = tk.BooleanVar()
+        self.pin_model_check = ttk.Checkbutton(master, text="Keep loaded", variable=self.pin_model_var, command=self.on_pin_toggled)
+        self.pin_model_check.grid(row=1, column=2, sticky="w", padx=5, pady=5)
 
         # Target URL
         self.target_url_label = ttk.Label(master, text="Target URL (for tools):")
         self.target_url_label.grid(row=2, column=0, sticky="w", padx=5, pady=5)
         self.target_url_entry = ttk.Entry(master, width=50)
-        self.target_url_entry.grid(row=2, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.target_url_entry.grid(row=2, column=1, sticky="ew", padx=5, pady=5)
+        self.prefetch_var = tk.BooleanVar(value=True)
+        self.prefetch_check = ttk.Checkbutton(master, text="Prefetch while generating", variable=self.prefetch_var)
+        self.prefetch_check.grid(row=2, column=2, sticky="w", padx=5, pady=5)
 
         # User Prompt
         self.prompt_label = ttk.Label(master, text="User Prompt:")
@@ -48,67 +71,128 @@ class DogmaAgentControlUI:
         self.smartscrape_check = ttk.Checkbutton(master, text="SmartScrapeAI", variable=self.smartscrape_var)
         self.smartscrape_check.grid(row=4, column=2, sticky="w", padx=5, pady=5)
 
+        # Output Options
+        self.options_label = ttk.Label(master, text="Options:")
+        self.options_label.grid(row=5, column=0, sticky="w", padx=5, pady=5)
+        self.structured_var = tk.BooleanVar()
+        self.structured_check = ttk.Checkbutton(master, text="Structured output", variable=self.structured_var)
+        self.structured_check.grid(row=5, column=1, sticky="w", padx=5, pady=5)
+        self.use_cache_var = tk.BooleanVar(value=True)
+        self.use_cache_check = ttk.Checkbutton(master, text="Reuse cached answers", variable=self.use_cache_var)
+        self.use_cache_check.grid(row=5, column=2, sticky="w", padx=5, pady=5)
+
         # Output Display
         self.output_label = ttk.Label(master, text="Output:")
-        self.output_label.grid(row=5, column=0, sticky="nw", padx=5, pady=5)
+        self.output_label.grid(row=6, column=0, sticky="nw", padx=5, pady=5)
         self.output_text_area = tk.Text(master, height=10, width=50, state=tk.DISABLED)
         # self.output_text_area.insert(tk.END, "results") # Initial message removed
-        self.output_text_area.grid(row=5, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.output_text_area.grid(row=6, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.output_scrollbar = ttk.Scrollbar(master, orient=tk.VERTICAL, command=self.output_text_area.yview)
+        self.output_scrollbar.grid(row=6, column=3, sticky="ns", pady=5)
+        self.output_text_area.config(yscrollcommand=self.output_scrollbar.set)
+        # Updates are applied as appends once per frame, with bounded retained text
+        self.output_view = OutputView(self.output_text_area)
 
 
-        # Submit Button
-        self.submit_button = ttk.Button(master, text="Submit", command=self.handle_submit)
-        self.submit_button.grid(row=6, column=1, sticky="e", padx=5, pady=10)
+        # New Session / Submit / Cancel Buttons
+        self.submit_frame = ttk.Frame(master) # New Session and Submit share column 1
+        self.submit_frame.grid(row=7, column=1, sticky="e", padx=5, pady=10)
+        self.new_session_button = ttk.Button(self.submit_frame, text="New Session", command=self.handle_new_session)
+        self.new_session_button.pack(side=tk.LEFT, padx=(0, 10))
+        self.submit_button = ttk.Button(self.submit_frame, text="Submit", command=self.handle_submit)
+        self.submit_button.pack(side=tk.LEFT)
+        self.cancel_button = ttk.Button(master, text="Cancel", command=self.handle_cancel, state=tk.DISABLED)
+        self.cancel_button.grid(row=7, column=2, sticky="w", padx=5, pady=10)
+        self.status_label = ttk.Label(master, text="")
+        self.status_label.grid(row=7, column=0, sticky="w", padx=5, pady=10)
 
         # Informational Note
-        self.info_label = ttk.Label(master, text="Info: Ensure Ollama is accessible (e.g., bound to 0.0.0.0 if not running on localhost).")
-        self.info_label.grid(row=7, column=0, columnspan=3, sticky="w", padx=5, pady=5)
+        self.info_label = ttk.Label(master, text="Info: Ensure Ollama is accessible (e.g., bound to 0.0.0.0 if not running on localhost). Separate several servers with commas.")
+        self.info_label.grid(row=8, column=0, columnspan=3, sticky="w", padx=5, pady=5)
 
         # Configure column weights for resizing
         master.columnconfigure(1, weight=1)
         # master.columnconfigure(2, weight=1) # Column 2 no longer needs to take all remaining space
 
+        # Background execution: network I/O and generation never run on the Tk event thread
+        self.engine = ExecutionEngine(max_concurrent=MAX_CONCURRENT_REQUESTS)
+        self._task_handlers = {} # task_id -> callback for that task's events
+        self._request_spans = {} # task_id -> tracing span of a submitted request
+        self._displayed_task_id = None # The request whose output is shown in the output area
+        self._output_mode = None # None while a status message is shown, then "raw" tokens or the parsed "answer"
+        self._tool_executor = None
+        self._prefetcher = None # Speculative target URL loads on the tool executor, with hit/waste counters
+        self._session = None # Conversation continued by each submit until "New Session"
+        self.model_manager = ModelManager()
+        # Identical requests are answered from here or share one generation; DOGMA_RESPONSE_CACHE persists it
+        self.response_cache = ResponseCache(os.environ.get("DOGMA_RESPONSE_CACHE"))
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
+        master.after(POLL_INTERVAL_MS, self._poll_events)
+
     def fetch_ollama_models(self):
         ollama_url = self.ollama_url_entry.get().strip()
         if not ollama_url:
             self.update_output_area("Error: Ollama Server URL cannot be empty.")
             return
 
-        api_url = f"{ollama_url}/api/tags"
-
-        try:
-            self.update_output_area("Fetching models...") # Inform user
-            with urllib.request.urlopen(api_url, timeout=5) as response:
-                if response.status == 200:
-                    data = json.load(response)
-                    if "models" in data and isinstance(data["models"], list):
-                        model_names = [model.get("name") for model in data["models"] if model.get("name")]
-                        if model_names:
-                            self.model_combobox['values'] = model_names
-                            self.model_combobox.set('') # Clear selection or set to a default
-                            self.update_output_area(f"Successfully fetched {len(model_names)} models.")
-                        else:
-                            self.model_combobox['values'] = []
-                            self.model_combobox.set('')
-                            self.update_output_area("No models found at the server.")
-                    else:
-                        self.model_combobox['values'] = []
-                        self.model_combobox.set('')
-                        self.update_output_area("Error: Unexpected JSON structure from Ollama API.")
-                else:
-                    self.update_output_area(f"Error: Failed to fetch models. Status code: {response.status}")
-        except urllib.error.URLError as e:
-            self.update_output_area(f"Error fetching models: {e.reason}")
-        except json.JSONDecodeError:
-            self.update_output_area("Error: Could not parse JSON response from Ollama API.")
-        except Exception as e: # Catch any other unexpected errors
-            self.update_output_area(f"An unexpected error occurred: {e}")
+        self.update_output_area("Fetching models...") # Inform user
+        self.fetch_models_button.config(state=tk.DISABLED)
+        handle = self.engine.submit(_fetch_model_names, self.model_manager, ollama_url)
+        self._task_handlers[handle.task_id] = self._on_fetch_models_event
+
+    def _on_fetch_models_event(self, event):
+        if event.kind not in TERMINAL_EVENTS:
+            return
+        self.fetch_models_button.config(state=tk.NORMAL)
+        if event.kind == EVENT_RESULT:
+            model_names = event.payload
+            self.model_combobox['values'] = model_names
+            self.model_combobox.set('') # Clear selection or set to a default
+            if model_names:
+                self.update_output_area(f"Successfully fetched {len(model_names)} models.")
+            else:
+                self.update_output_area("No models found at the server.")
+        elif event.kind == EVENT_ERROR:
+            self.model_combobox['values'] = []
+            self.model_combobox.set('')
+            if isinstance(event.payload, OllamaError):
+                self.update_output_area(f"Error fetching models: {event.payload}")
+            else:
+                self.update_output_area(f"An unexpected error occurred: {event.payload}")
+
+    def on_model_selected(self, event=None):
+        # Load the model in the background so the first prompt does not pay for the cold start
+        ollama_url = self.ollama_url_entry.get().strip()
+        selected_model = self.model_combobox.get()
+        if not ollama_url or not selected_model:
+            return
+        self.pin_model_var.set(selected_model in self.model_manager.pinned(ollama_url))
+        self.model_manager.warm(ollama_url, selected_model)
+
+    def on_pin_toggled(self):
+        ollama_url = self.ollama_url_entry.get().strip()
+        selected_model = self.model_combobox.get()
+        if not ollama_url or not selected_model:
+            self.pin_model_var.set(False)
+            return
+        if self.pin_model_var.get():
+            self.model_manager.pin(ollama_url, selected_model)
+        else:
+            self.model_manager.release(ollama_url, selected_model)
 
     def update_output_area(self, message):
-        self.output_text_area.config(state=tk.NORMAL)
-        self.output_text_area.delete('1.0', tk.END)
-        self.output_text_area.insert(tk.END, message)
-        self.output_text_area.config(state=tk.DISABLED)
+        # Replaces the output; drawn on the next frame
+        self.output_view.set_text(message)
+        self._output_mode = None
+
+    def _stream_output(self, mode: str, text: str):
+        # The first chunk of a mode replaces the status message (or the raw tokens, once the
+        # answer starts); later chunks are appended
+        if self._output_mode == mode:
+            self.output_view.append(text)
+        else:
+            self.output_view.set_text(text)
+            self._output_mode = mode
 
     def handle_submit(self):
         ollama_url = self.ollama_url_entry.get().strip()
@@ -122,71 +206,203 @@ class DogmaAgentControlUI:
         if self.smartscrape_var.get():
             enabled_tools.append("SmartScrapeAI")
 
-        print(f"Ollama URL: {ollama_url}")
-        print(f"Selected Model: {selected_model}")
-        print(f"Target URL: {target_url}")
-        print(f"User Prompt: {user_prompt}")
-        print(f"Enabled Tools: {enabled_tools}")
-
-        # Generate System Prompt
-        system_prompt = generate_system_prompt(enabled_tools)
-
-        # Call the placeholder backend function (execute_ollama_request)
-        mock_response = execute_ollama_request(
-            ollama_url=ollama_url,
-            model_name=selected_model,
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            target_url=target_url,
-            enabled_tools=enabled_tools
-        )
-
-        # Process and display this mock response
-        self.process_and_display_output(mock_response)
-
-    def process_and_display_output(self, raw_model_output: str):
+        logger.debug("Submitting request: url=%s model=%s target_url=%s tools=%s", ollama_url, selected_model, target_url, enabled_tools)
+        logger.debug("User prompt: %s", user_prompt)
+
+        # The request runs on a worker thread; only its events are handled here
+        session = self._get_session(ollama_url, selected_model)
+        queued = session.open_requests()
+        turn = session.begin_request() # Follow-ups wait for the turns submitted before them
+        keep_alive = self.model_manager.keep_alive_for(ollama_url, selected_model)
+        request_span = tracing.span("ui_request", model=selected_model)
+        handle = self.engine.submit(_run_agent_request, ollama_url, selected_model, user_prompt, target_url, enabled_tools, self._get_tool_executor() if enabled_tools else None, keep_alive, request_span, session,
+                                    self.response_cache if self.use_cache_var.get() else None, self.structured_var.get(),
+                                    self._get_prefetcher() if enabled_tools and target_url and self.prefetch_var.get() else None, turn)
+        handle.future.add_done_callback(lambda _: session.end_request(turn)) # Also when cancelled before it ran
+        self._task_handlers[handle.task_id] = self._on_submit_event
+        self._request_spans[handle.task_id] = request_span
+        self._displayed_task_id = handle.task_id
+        if queued:
+            self.update_output_area(f"Request #{handle.task_id} queued after the {queued} earlier request(s) of this conversation...")
+        else:
+            self.update_output_area(f"Request #{handle.task_id} submitted...")
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def _get_session(self, ollama_url: str, model: str) -> ChatSession:
+        # The conversation continues while the server and model stay the same
+        if self._session is None or (self._session.ollama_url, self._session.model) != (ollama_url, model):
+            if self._session is not None:
+                self._session.close()
+            self._session = ChatSession(ollama_url, model)
+        return self._session
+
+    def handle_new_session(self):
+        if self._session is not None:
+            self._session.reset()
+        self.update_output_area("Started a new session.")
+
+    def handle_cancel(self):
+        if self._displayed_task_id is not None:
+            self.engine.cancel(self._displayed_task_id)
+
+    def _on_submit_event(self, event):
+        if event.task_id != self._displayed_task_id:
+            if event.kind in TERMINAL_EVENTS:
+                self._end_request_span(event)
+            return # A newer request owns the output area; older ones finish in the background
+        if event.kind == OUTPUT_EVENT_TOKEN:
+            if self._output_mode != "answer": # Once the model starts writing user_facing_answer, only the answer is shown
+                self._stream_output("raw", event.payload)
+        elif event.kind == OUTPUT_EVENT_ANSWER_DELTA:
+            self._stream_output("answer", event.payload)
+        elif event.kind == OUTPUT_EVENT_TOOL_CALL:
+            self.status_label.config(text=f"Tool call: {event.payload.tool} {event.payload.url or ''}")
+        elif event.kind == OUTPUT_EVENT_TOOL_RESULT:
+            outcome = "done" if event.payload.ok else f"failed ({event.payload.error})"
+            self.status_label.config(text=f"Tool call: {event.payload.tool} {outcome}")
+        elif event.kind == OUTPUT_EVENT_FOLLOW_UP:
+            # The next model turn answers with the tool results; its output replaces the first turn's
+            self.update_output_area("Tool results received, generating answer...")
+        elif event.kind == EVENT_RESULT:
+            raw_model_output, parsed = event.payload
+            with tracing.span("parse", parent=self._request_spans.get(event.task_id)) as parse_span:
+                self.process_and_display_output(raw_model_output, parsed)
+                if parse_span:
+                    parse_span.set(output_bytes=len(raw_model_output.encode("utf-8")))
+        elif event.kind == EVENT_ERROR:
+            if isinstance(event.payload, OllamaError):
+                self.update_output_area(f"Error: Ollama request failed: {event.payload}")
+            else:
+                self.update_output_area(f"An unexpected error occurred: {event.payload}")
+        elif event.kind == EVENT_CANCELLED:
+            self.output_view.append("\n\n[Request cancelled]")
+            self._output_mode = None
+        if event.kind in TERMINAL_EVENTS:
+            self.cancel_button.config(state=tk.DISABLED)
+            self._end_request_span(event)
+
+    def _end_request_span(self, event):
+        request_span = self._request_spans.pop(event.task_id, None)
+        if request_span is not None:
+            request_span.end(outcome=event.kind)
+
+    def _poll_events(self):
+        for event in self.engine.drain_events(MAX_EVENTS_PER_POLL):
+            handler = self._task_handlers.get(event.task_id)
+            if handler is not None:
+                handler(event)
+            if event.kind in TERMINAL_EVENTS:
+                self._task_handlers.pop(event.task_id, None)
+        # Everything appended while handling this batch of events is drawn as one update
+        self.output_view.flush()
+        active = self.engine.active_count
+        if not active:
+            self.status_label.config(text="")
+        elif not self.status_label.cget("text").startswith("Tool call"):
+            self.status_label.config(text=f"{active} request(s) running")
+        self.master.after(POLL_INTERVAL_MS, self._poll_events)
+
+    def _get_tool_executor(self):
+        # Created (and its modules imported) on first use, so the browser is only started once tools are actually needed
+        if self._tool_executor is None:
+            from page_cache import PageCache
+            from tool_executor import ToolExecutor
+            self._tool_executor = ToolExecutor(cache=PageCache())
+        return self._tool_executor
+
+    def _get_prefetcher(self):
+        if self._prefetcher is None:
+            from prefetch import Prefetcher
+            self._prefetcher = Prefetcher(self._get_tool_executor())
+        return self._prefetcher
+
+    def on_close(self):
+        self.engine.shutdown(wait=False)
+        self.model_manager.close()
+        if self._prefetcher is not None:
+            logger.debug("Prefetch stats: %s", self._prefetcher.stats())
+        if self._tool_executor is not None:
+            self._tool_executor.close()
+        self.output_view.close()
+        self.response_cache.close()
+        if self._session is not None:
+            self._session.close()
+        tracing.configure() # Flushes the metrics file and closes the trace log
+        self.master.destroy()
+
+    def process_and_display_output(self, raw_model_output: str, parsed: ParsedOutput = None):
         raw_model_output = raw_model_output.strip() if raw_model_output else ""
 
         if not raw_model_output:
             self.update_output_area("results")
             return
 
-        # Try to find the JSON block as specified in core_logic.py
-        # ```json
-        # { ... }
-        # ```
-        json_block_start_marker = "```json\n"
-        json_block_end_marker = "\n```"
-        
-        start_index = raw_model_output.find(json_block_start_marker)
-        
-        if start_index != -1:
-            # Adjust start_index to be after the marker
-            actual_json_start = start_index + len(json_block_start_marker)
-            # Find the end of the JSON block
-            end_index = raw_model_output.find(json_block_end_marker, actual_json_start)
-            
-            if end_index != -1:
-                json_string = raw_model_output[actual_json_start:end_index].strip()
-                try:
-                    parsed_json = json.loads(json_string)
-                    if isinstance(parsed_json, dict) and "user_facing_answer" in parsed_json:
-                        self.update_output_area(parsed_json["user_facing_answer"])
-                        return # Successfully displayed the specific answer
-                    else:
-                        # JSON found and parsed, but no 'user_facing_answer' or not a dict
-                        self.update_output_area(f"Parsed JSON, but 'user_facing_answer' key missing or invalid structure:\n{json_string}\n\nFull output:\n{raw_model_output}")
-                        return
-                except json.JSONDecodeError:
-                    # JSON block markers found, but content is not valid JSON
-                    self.update_output_area(f"Found JSON block markers, but failed to parse JSON:\n{json_string}\n\nFull output:\n{raw_model_output}")
+        # The ```json block format is specified in core_logic.py; reuse the parse done while streaming if available
+        if parsed is None:
+            parsed = parse_model_output(raw_model_output)
+        block = parsed.json_block
+
+        if block is not None:
+            if block.error is None:
+                if isinstance(block.data, dict) and "user_facing_answer" in block.data:
+                    self.update_output_area(block.data["user_facing_answer"])
+                    return # Successfully displayed the specific answer
+                else:
+                    # JSON found and parsed, but no 'user_facing_answer' or not a dict
+                    self.update_output_area(f"Parsed JSON, but 'user_facing_answer' key missing or invalid structure:\n{block.json_string}\n\nFull output:\n{raw_model_output}")
                     return
+            else:
+                # JSON block markers found, but content is not valid JSON
+                self.update_output_area(f"Found JSON block markers, but failed to parse JSON:\n{block.json_string}\n\nFull output:\n{raw_model_output}")
+                return
 
         # If no JSON block, or parsing failed and we decided to show full output
         self.update_output_area(raw_model_output)
 
 
+def _fetch_model_names(ctx, model_manager: ModelManager, ollama_url: str) -> list[str]:
+    # Runs on a worker thread; the catalog is cached by the model manager
+    return model_manager.list_models(ollama_url)
+
+
+def _run_agent_request(ctx, ollama_url: str, model_name: str, user_prompt: str, target_url: str, enabled_tools: list[str], tool_executor, keep_alive, request_span=tracing.NOOP_SPAN, session: ChatSession = None, response_cache: ResponseCache = None, structured: bool = False, prefetcher=None, turn: int = None):
+    # Runs on a worker thread: streams tokens, parser events and tool results back to the UI.
+    # With a session, the request waits for its `turn`, continues the conversation and is recorded in it.
+    if session is not None and turn is not None:
+        session.wait_for_turn(turn, ctx)
+    tracing.span("queue", parent=request_span, start=request_span.start).end() # Time spent waiting for a worker and the previous turn
+    result = None
+    steps = [] # Messages of the tool rounds, recorded with the turn
+    agent_events = stream_agent_request(
+        ollama_url=ollama_url,
+        model_name=model_name,
+        user_prompt=user_prompt,
+        target_url=target_url,
+        enabled_tools=enabled_tools,
+        executor=tool_executor,
+        keep_alive=keep_alive,
+        span=request_span,
+        system_prompt=session.system_prompt(enabled_tools, structured) if session is not None else None,
+        history=session.history() if session is not None else None,
+        cache=response_cache,
+        structured=structured,
+        prefetcher=prefetcher,
+        cancel=ctx
+    )
+    for output_event in ctx.iterate(agent_events):
+        if output_event.kind == OUTPUT_EVENT_TURN_DONE:
+            result = output_event.payload
+        else:
+            if output_event.kind == OUTPUT_EVENT_FOLLOW_UP:
+                steps.extend(output_event.payload.messages)
+            ctx.emit(output_event.kind, output_event.payload)
+    if session is not None and result is not None:
+        session.record_turn(build_user_content(user_prompt, target_url), result[0], enabled_tools, structured, steps)
+    return result
+
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get("DOGMA_LOG_LEVEL", "WARNING"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    tracing.configure_from_env() # DOGMA_TRACE_LOG and DOGMA_METRICS_FILE enable tracing
     root = tk.Tk()
     gui = DogmaAgentControlUI(root)
     root.mainloop()
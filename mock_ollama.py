@@ -0,0 +1,259 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-in Ollama server for benchmarks and tests.
+#
+# Implements /api/tags, /api/ps, /api/chat and /api/generate with NDJSON streaming like the
+# real server, with a configurable time to first token, token rate, per-token jitter and
+# failure injection (HTTP 500 before the stream, an error event in it, or a dropped
+# connection mid-stream). Tests script the responses and inspect the recorded requests.
+
+DEFAULT_MODELS = ["mock:latest"]
+DEFAULT_ANSWER_TOKENS = 64
+
+
+class MockOllamaConfig:
+    """
+    Behaviour of a MockOllamaServer. Requests are answered with the next of the scripted
+    `responses`, then with `response_text` if set; otherwise an answer in the system
+    prompt's JSON block format is generated.
+    """
+    def __init__(self, tokens_per_second: float = 200.0, ttft: float = 0.05, jitter: float = 0.0,
+                 failure_rate: float = 0.0, drop_rate: float = 0.0, models: list[str] = None,
+                 answer_tokens: int = DEFAULT_ANSWER_TOKENS, response_text: str = None, seed: int = None,
+                 loaded_models: list[str] = None, responses: list[str] = None, stream_error: str = None):
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft  # Seconds before the first token
+        self.jitter = jitter  # Fraction of the token interval added or removed at random
+        self.failure_rate = failure_rate  # Probability of answering HTTP 500
+        self.drop_rate = drop_rate  # Probability of closing the connection halfway through the stream
+        self.models = list(models or DEFAULT_MODELS)
+        self.loaded_models = list(self.models if loaded_models is None else loaded_models)  # Reported by /api/ps
+        self.answer_tokens = answer_tokens
+        self.response_text = response_text
+        self.responses = list(responses or ())  # Consumed in order
+        self.stream_error = stream_error  # Sent as an {"error": ...} event instead of a response
+        self.seed = seed
+
+
+def mock_response_text(prompt: str, answer_tokens: int = DEFAULT_ANSWER_TOKENS) -> str:
+    """
+    A response in the format requested by core_logic.generate_system_prompt.
+    """
+    filler = " ".join(f"word{i}" for i in range(answer_tokens))
+    answer = {
+        "tool_used": None,
+        "tool_input": None,
+        "summary": "Mock response.",
+        "user_facing_answer": f"Mock answer to: {prompt[:40]} {filler}",
+    }
+    return "Here is my answer.\n```json\n" + json.dumps(answer, indent=2) + "\n```\nLet me know if you need anything else."
+
+
+def split_tokens(text: str) -> list[str]:
+    # Word-sized pieces, keeping the separators, approximate model tokens well enough
+    tokens = []
+    start = 0
+    for index, char in enumerate(text):
+        if char in " \n" and index > start:
+            tokens.append(text[start:index])
+            start = index
+    tokens.append(text[start:])
+    return [token for token in tokens if token]
+
+
+class _MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        config = self.server.config
+        if self.path == "/api/tags":
+            self.server.count("catalog_requests")
+            self._send_json(200, {"models": [{"name": name, "model": name, "size": 0} for name in config.models]})
+        elif self.path == "/api/ps":
+            self._send_json(200, {"models": [{"name": name, "model": name} for name in config.loaded_models]})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": "0.0.0-mock"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        server = self.server
+        config = server.config
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server.count("requests")
+        server.record(self.path, payload)
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+        if payload.get("model") not in config.models:
+            self._send_json(404, {"error": f"model '{payload.get('model')}' not found, try pulling it first"})
+            return
+        if server.chance(config.failure_rate):
+            server.count("failures")
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        if self.path == "/api/chat":
+            messages = payload.get("messages") or []
+            prompt = messages[-1].get("content", "") if messages else ""
+        else:
+            prompt = payload.get("prompt", "")
+        generates = bool(prompt) or self.path == "/api/chat"  # An empty generate only loads the model
+        text = server.next_response() if generates else None
+        if text is None:
+            text = config.response_text if config.response_text is not None else mock_response_text(prompt, config.answer_tokens)
+        tokens = split_tokens(text) if generates else []
+        drop_at = len(tokens) // 2 if tokens and server.chance(config.drop_rate) else None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        started = time.perf_counter()
+        time.sleep(config.ttft)
+        if config.stream_error:
+            self._write_chunk({"error": config.stream_error})
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        for index, token in enumerate(tokens):
+            if index == drop_at:
+                server.count("drops")
+                self.close_connection = True
+                self.wfile.flush()
+                return # Ends the response without the terminating chunk
+            if index:
+                time.sleep(max(0.0, interval * (1 + server.uniform(-config.jitter, config.jitter))))
+            if self.path == "/api/chat":
+                event = {"model": payload["model"], "message": {"role": "assistant", "content": token}, "done": False}
+            else:
+                event = {"model": payload["model"], "response": token, "done": False}
+            self._write_chunk(event)
+        elapsed_ns = int((time.perf_counter() - started) * 1e9)
+        final = {
+            "model": payload["model"], "done": True, "done_reason": "stop" if tokens else "load",
+            "total_duration": elapsed_ns, "load_duration": 0,
+            "prompt_eval_count": len(split_tokens(prompt)), "prompt_eval_duration": int(config.ttft * 1e9),
+            "eval_count": len(tokens), "eval_duration": elapsed_ns - int(config.ttft * 1e9),
+        }
+        if self.path == "/api/chat":
+            final["message"] = {"role": "assistant", "content": ""}
+        else:
+            final["response"] = ""
+        self._write_chunk(final)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, event: dict):
+        data = json.dumps(event).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockOllamaServer(ThreadingHTTPServer):
+    """
+    Mock Ollama server on a background thread; use as a context manager or start()/stop().
+    """
+    daemon_threads = True
+
+    def __init__(self, config: MockOllamaConfig = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _MockOllamaHandler)
+        self.config = config or MockOllamaConfig()
+        self.counters = {"requests": 0, "failures": 0, "drops": 0, "connections": 0, "catalog_requests": 0}
+        self.requests = []  # (path, payload) of every POST, in arrival order
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def record(self, path: str, payload: dict):
+        with self._lock:
+            self.requests.append((path, payload))
+
+    def next_response(self):
+        # The next scripted response, or None once they are used up
+        with self._lock:
+            return self.config.responses.pop(0) if self.config.responses else None
+
+    def payloads(self, path: str = "/api/chat") -> list[dict]:
+        """
+        The payloads of the requests to `path` received so far.
+        """
+        with self._lock:
+            return [payload for request_path, payload in self.requests if request_path == path]
+
+    def chance(self, probability: float) -> bool:
+        with self._lock:
+            return probability > 0 and self._random.random() < probability
+
+    def uniform(self, low: float, high: float) -> float:
+        with self._lock:
+            return self._random.uniform(low, high)
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Run a mock Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tps", type=float, default=200.0, help="Tokens per second per request")
+    parser.add_argument("--ttft", type=float, default=0.05, help="Seconds to first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Per-token jitter as a fraction of the token interval")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability of an HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probability of dropping the stream halfway")
+    parser.add_argument("--model", action="append", dest="models", help="Model name to serve (repeatable)")
+    args = parser.parse_args(argv)
+    config = MockOllamaConfig(args.tps, args.ttft, args.jitter, args.failure_rate, args.drop_rate, args.models)
+    server = MockOllamaServer(config, args.host, args.port)
+    print(f"Mock Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
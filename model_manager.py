@@ -0,0 +1,206 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core_logic import get_ollama_backend
+from ollama_client import OllamaError
+
+# Model lifecycle on the Ollama servers: a TTL-cached model catalog, background warm-up of
+# the selected model and keep_alive management.
+#
+# Ollama loads a model on its first request and unloads it `keep_alive` after the last one,
+# and every request resets that timer to its own keep_alive. Warming sends an empty
+# /api/generate, which loads the model without generating anything; pinned models are
+# warmed and requested with keep_alive=-1 so they stay resident until released.
+#
+# Loads and unloads of one model are serialized and only the latest one is sent if several
+# are waiting, so a release cannot be overtaken by the pin it undoes. With a server pool, a
+# pin goes to one server chosen by routing and its release to that same server.
+
+DEFAULT_CATALOG_TTL = 60  # Seconds
+DEFAULT_KEEP_ALIVE = "30m"
+PINNED_KEEP_ALIVE = -1  # Never unload
+RELEASE_KEEP_ALIVE = 0  # Unload immediately
+DEFAULT_MAX_PINNED = 1
+CLOSE_TIMEOUT = 5  # Seconds close() waits for the pins to be released
+
+
+class ModelManager:
+    """
+    Caches model catalogs and keeps the models in use loaded according to a pinning policy:
+    at most `max_pinned` models are pinned per server, pinning another releases the oldest.
+    """
+    def __init__(self, catalog_ttl: float = DEFAULT_CATALOG_TTL, keep_alive=DEFAULT_KEEP_ALIVE, max_pinned: int = DEFAULT_MAX_PINNED):
+        self.catalog_ttl = catalog_ttl
+        self.keep_alive = keep_alive
+        self.max_pinned = max_pinned
+        self._catalogs = {}  # ollama_url -> (fetched_at, model names)
+        self._pinned = {}  # ollama_url -> pinned model names, oldest first
+        self._warming = {}  # (ollama_url, model, keep_alive) -> (generation, Future)
+        self._releasing = {}  # ollama_url -> Futures of the unloads started by pin()
+        self._generations = {}  # (ollama_url, model) -> number of the latest load/unload requested
+        self._model_locks = {}  # (ollama_url, model) -> Lock held while a load/unload is sent
+        self._pin_servers = {}  # (ollama_url, model) -> URL of the pool server holding the pin
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="dogma-models")
+
+    def list_models(self, ollama_url: str, force_refresh: bool = False) -> list[str]:
+        """
+        Model names available at `ollama_url`, served from cache while younger than the TTL.
+        """
+        with self._lock:
+            cached = self._catalogs.get(ollama_url)
+        if cached is not None and not force_refresh and time.monotonic() - cached[0] < self.catalog_ttl:
+            return list(cached[1])
+        models = get_ollama_backend(ollama_url).list_models()
+        names = [model.get("name") for model in models if model.get("name")]
+        with self._lock:
+            self._catalogs[ollama_url] = (time.monotonic(), names)
+        return list(names)
+
+    def invalidate(self, ollama_url: str = None):
+        with self._lock:
+            if ollama_url is None:
+                self._catalogs.clear()
+            else:
+                self._catalogs.pop(ollama_url, None)
+
+    def keep_alive_for(self, ollama_url: str, model: str):
+        """
+        The keep_alive to send with requests for `model`, so they do not shorten a pin.
+        """
+        with self._lock:
+            return PINNED_KEEP_ALIVE if model in self._pinned.get(ollama_url, ()) else self.keep_alive
+
+    def warm(self, ollama_url: str, model: str, keep_alive=None):
+        """
+        Loads `model` in the background. Returns a Future; concurrent warm-ups of the same
+        model share one request.
+        """
+        if keep_alive is None:
+            keep_alive = self.keep_alive_for(ollama_url, model)
+        key = (ollama_url, model, keep_alive)
+        with self._lock:
+            generation, future = self._warming.get(key, (None, None))
+            if future is not None and generation == self._generations.get((ollama_url, model)):
+                return future
+            future = self._submit_load(ollama_url, model, keep_alive)
+            generation = self._generations[(ollama_url, model)]
+            self._warming[key] = (generation, future)
+        future.add_done_callback(lambda _: self._forget_warming(key, generation))
+        return future
+
+    def _forget_warming(self, key, generation: int):
+        with self._lock:
+            if self._warming.get(key, (None,))[0] == generation:
+                del self._warming[key]
+
+    def _submit_load(self, ollama_url: str, model: str, keep_alive):
+        # Called with self._lock held
+        key = (ollama_url, model)
+        generation = self._generations[key] = self._generations.get(key, 0) + 1
+        model_lock = self._model_locks.setdefault(key, threading.Lock())
+        return self._executor.submit(self._load, key, generation, model_lock, keep_alive)
+
+    def _load(self, key, generation: int, model_lock, keep_alive):
+        ollama_url, model = key
+        with model_lock:
+            with self._lock:
+                if self._generations.get(key) != generation:
+                    return  # A later load/unload of the model supersedes this one
+                server_url = self._pin_servers.get(key)
+            for client in self._targets(ollama_url, model, keep_alive, server_url):
+                # An empty prompt makes Ollama load (or unload, with keep_alive=0) the model without generating
+                for _ in client.generate(model, "", keep_alive=keep_alive):
+                    pass
+                with self._lock:
+                    if keep_alive == PINNED_KEEP_ALIVE:
+                        self._pin_servers[key] = client.base_url
+            if keep_alive == RELEASE_KEEP_ALIVE:
+                with self._lock:
+                    self._pin_servers.pop(key, None)
+
+    def _targets(self, ollama_url: str, model: str, keep_alive, server_url: str = None) -> list:
+        backend = get_ollama_backend(ollama_url)
+        if not hasattr(backend, "holding"):
+            return [backend]
+        # A server pool: send to a server rather than wherever routing would go, so the
+        # release reaches the server that holds the pin
+        pinned_server = backend.server(server_url) if server_url else None
+        if keep_alive == RELEASE_KEEP_ALIVE:
+            servers = [pinned_server] if pinned_server else backend.holding(model)
+        else:
+            servers = [pinned_server or backend.select(model)]
+        return [server.client for server in servers]
+
+    def pin(self, ollama_url: str, model: str):
+        """
+        Keeps `model` loaded until released; releases the oldest pin beyond `max_pinned`.
+        Returns the Future of the warm-up; those of the releases are in pending_releases().
+        """
+        with self._lock:
+            pinned = self._pinned.setdefault(ollama_url, [])
+            if model in pinned:
+                pinned.remove(model)
+            pinned.append(model)
+            evicted = pinned[:-self.max_pinned] if self.max_pinned > 0 else list(pinned)
+            del pinned[:len(evicted)]
+            releases = [self._submit_load(ollama_url, old_model, RELEASE_KEEP_ALIVE) for old_model in evicted]
+            self._releasing.setdefault(ollama_url, set()).update(releases)
+        for future in releases:
+            future.add_done_callback(lambda future: self._forget_release(ollama_url, future))
+        return self.warm(ollama_url, model, PINNED_KEEP_ALIVE)
+
+    def _forget_release(self, ollama_url: str, future):
+        with self._lock:
+            self._releasing.get(ollama_url, set()).discard(future)
+
+    def pending_releases(self, ollama_url: str) -> list:
+        """
+        Futures of the unloads that pin() started for `ollama_url` and that have not finished.
+        """
+        with self._lock:
+            return list(self._releasing.get(ollama_url, ()))
+
+    def release(self, ollama_url: str, model: str):
+        """
+        Unpins `model` and unloads it now. Returns the Future of the unload request.
+        """
+        with self._lock:
+            pinned = self._pinned.get(ollama_url, [])
+            if model in pinned:
+                pinned.remove(model)
+            return self._submit_load(ollama_url, model, RELEASE_KEEP_ALIVE)
+
+    def pinned(self, ollama_url: str) -> list[str]:
+        with self._lock:
+            return list(self._pinned.get(ollama_url, ()))
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        """
+        Drops the pending warm-ups and releases the pinned models, waiting up to `timeout`
+        seconds for the unloads so the models do not stay resident forever.
+        """
+        with self._lock:
+            releases = [(url, model) for url, models in self._pinned.items() for model in models]
+            self._pinned.clear()
+            for url, model in releases:
+                key = (url, model)
+                self._generations[key] = self._generations.get(key, 0) + 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        threads = []
+        for url, model in releases:
+            key = (url, model)
+            with self._lock:
+                generation, model_lock = self._generations[key], self._model_locks.setdefault(key, threading.Lock())
+            thread = threading.Thread(target=self._release_on_close, args=(key, generation, model_lock), name="dogma-models-release", daemon=True)
+            thread.start()
+            threads.append(thread)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _release_on_close(self, key, generation: int, model_lock):
+        try:
+            self._load(key, generation, model_lock, RELEASE_KEEP_ALIVE)
+        except OllamaError:
+            pass  # The server is gone; so is the model
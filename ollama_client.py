@@ -0,0 +1,293 @@
+import http.client
+import json
+import socket
+import threading
+import urllib.parse
+import tracing
+
+# Streaming client for the Ollama HTTP API.
+#
+# Ollama answers /api/chat and /api/generate with newline-delimited JSON (NDJSON),
+# one object per generated token batch, the last one carrying "done": true plus the
+# timing/usage statistics. Connections are HTTP/1.1 keep-alive and are pooled per
+# server so consecutive requests skip the TCP (and TLS) setup.
+#
+# Requests take an optional `cancel` object (an execution_engine.TaskContext): its cancel
+# callback shuts down the socket of the request in flight, which unblocks a read waiting
+# for the first token and makes the server stop generating.
+
+DEFAULT_TIMEOUT = 300  # Seconds; generation on CPU-only nodes can be slow between tokens.
+CATALOG_TIMEOUT = 5  # Seconds for the quick GETs (model list, running models), so an unreachable host fails fast
+DEFAULT_MAX_IDLE_CONNECTIONS = 4
+
+
+class OllamaError(Exception):
+    """
+    Raised when an Ollama server cannot be reached or reports an error. `status` is the HTTP
+    status of the server's answer (200 for an error reported in a stream), None when there was none.
+    """
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class _ConnectionPool:
+    """
+    Thread-safe LIFO pool of idle keep-alive connections to a single server.
+    """
+    def __init__(self, scheme: str, host: str, port: int, timeout: float, max_idle: int):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+    def get(self) -> http.client.HTTPConnection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.connections_opened += 1
+        connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def put(self, conn: http.client.HTTPConnection):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class OllamaClient:
+    """
+    Minimal Ollama API client with pooled persistent connections.
+
+    The streaming methods (`chat`, `generate`) return generators of the decoded NDJSON
+    events. Closing a generator early closes its connection, which makes the server
+    abort the generation.
+    """
+    def __init__(self, base_url: str, timeout: float = DEFAULT_TIMEOUT, max_idle_connections: int = DEFAULT_MAX_IDLE_CONNECTIONS, catalog_timeout: float = CATALOG_TIMEOUT):
+        parsed = urllib.parse.urlsplit(base_url.strip())
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise OllamaError(f"Invalid Ollama server URL: {base_url!r}")
+        self.base_url = base_url.strip().rstrip("/")
+        self._base_path = parsed.path.rstrip("/")
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self._pool = _ConnectionPool(parsed.scheme, parsed.hostname, port, timeout, max_idle_connections)
+        self.catalog_timeout = min(timeout, catalog_timeout)
+
+    @property
+    def connections_opened(self) -> int:
+        return self._pool.connections_opened
+
+    def _request(self, method: str, path: str, payload: dict = None, span=None, cancel=None, timeout: float = None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Accept": "application/json", "Connection": "keep-alive"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(2):
+            conn = self._pool.get()
+            reused = conn.sock is not None
+            # Set per request, since pooled connections serve both quick GETs and long generations
+            conn.timeout = timeout if timeout is not None else self._pool.timeout
+            if reused:
+                conn.sock.settimeout(conn.timeout)
+            # Covers connection setup, sending the request and waiting for the response headers
+            connect_span = tracing.span("connect", parent=span, server=self.base_url, reused=reused, request_bytes=len(body or b""))
+            remove_cancel_hook = _on_cancel(cancel, conn)
+            try:
+                conn.request(method, self._base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+                connect_span.end(status=response.status)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                connect_span.end(error=type(e).__name__)
+                conn.close()
+                _raise_if_cancelled(cancel, f"Request to {self.base_url}{path}", e)
+                # An idle keep-alive connection may have been dropped by the server; retry once on a fresh one.
+                if reused and attempt == 0:
+                    continue
+                raise OllamaError(f"Connection to {self.base_url} failed: {e}") from e
+            except (OSError, http.client.HTTPException) as e:
+                connect_span.end(error=type(e).__name__)
+                conn.close()
+                _raise_if_cancelled(cancel, f"Request to {self.base_url}{path}", e)
+                raise OllamaError(f"Connection to {self.base_url} failed: {e}") from e
+            finally:
+                remove_cancel_hook()
+
+            if response.status != 200:
+                error_body = response.read()
+                self._release(conn, response)
+                raise OllamaError(f"{method} {path} returned HTTP {response.status}: {_error_message(error_body)}", status=response.status)
+            return conn, response
+
+    def _release(self, conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        # Only fully consumed responses leave the connection in a reusable state.
+        if response.isclosed() and not response.will_close:
+            self._pool.put(conn)
+        else:
+            conn.close()
+
+    def get_json(self, path: str) -> dict:
+        """
+        GETs `path` with the catalog timeout and returns the decoded JSON.
+        """
+        conn, response = self._request("GET", path, timeout=self.catalog_timeout)
+        try:
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise OllamaError(f"Reading {path} from {self.base_url} failed: {e}") from e
+        self._release(conn, response)
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as e:
+            raise OllamaError(f"Could not parse JSON response from {path}.") from e
+
+    def stream(self, path: str, payload: dict, span=None, cancel=None):
+        """
+        POSTs `payload` to `path` and yields each decoded NDJSON event as it arrives.
+        `span` (a tracing span) receives a "connect" child and the server's token counts;
+        cancelling `cancel` aborts the request at once, also before the first event.
+        """
+        conn, response = self._request("POST", path, payload, span, cancel)
+        remove_cancel_hook = _on_cancel(cancel, conn)
+        released = False
+        received = 0
+        try:
+            for line in response:
+                received += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise OllamaError(f"Malformed stream line from {path}: {line[:200]!r}") from e
+                if "error" in event:
+                    raise OllamaError(f"{path} stream error: {event['error']}", status=response.status)
+                if event.get("done"):
+                    if span:
+                        span.set(server=self.base_url, response_bytes=received,
+                                 prompt_tokens=event.get("prompt_eval_count", 0), completion_tokens=event.get("eval_count", 0))
+                    # Drain the terminating chunk before handing the final event out, so the
+                    # connection goes back to the pool even if the caller stops iterating here.
+                    response.read()
+                    self._release(conn, response)
+                    released = True
+                    yield event
+                    return
+                yield event
+            _raise_if_cancelled(cancel, f"Stream from {self.base_url}{path}")
+            raise OllamaError(f"Stream from {self.base_url}{path} ended before the final event")
+        except (OSError, http.client.HTTPException) as e:
+            _raise_if_cancelled(cancel, f"Stream from {self.base_url}{path}", e)
+            raise OllamaError(f"Stream from {self.base_url}{path} was interrupted: {e}") from e
+        finally:
+            remove_cancel_hook()
+            if not released:
+                conn.close()
+
+    def chat(self, model: str, messages: list[dict], options: dict = None, span=None, cancel=None, **extra):
+        """
+        Streams a /api/chat completion. Extra keyword arguments (e.g. `keep_alive`, `format`)
+        are passed through in the request body; `span` and `cancel` are passed to stream().
+        """
+        payload = {"model": model, "messages": messages, "stream": True}
+        if options:
+            payload["options"] = options
+        payload.update(extra)
+        return self.stream("/api/chat", payload, span, cancel)
+
+    def generate(self, model: str, prompt: str, system: str = None, options: dict = None, span=None, cancel=None, **extra):
+        """
+        Streams a /api/generate completion.
+        """
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        if system is not None:
+            payload["system"] = system
+        if options:
+            payload["options"] = options
+        payload.update(extra)
+        return self.stream("/api/generate", payload, span, cancel)
+
+    def list_models(self) -> list[dict]:
+        """
+        Returns the model entries reported by /api/tags.
+        """
+        data = self.get_json("/api/tags")
+        if not isinstance(data, dict) or not isinstance(data.get("models"), list):
+            raise OllamaError("Unexpected JSON structure from Ollama API.")
+        return data["models"]
+
+    def close(self):
+        self._pool.close()
+
+
+def iter_text(events):
+    """
+    Yields the generated text of each /api/chat or /api/generate event.
+    """
+    for event in events:
+        message = event.get("message")
+        text = message.get("content", "") if isinstance(message, dict) else event.get("response", "")
+        if text:
+            yield text
+
+
+def _on_cancel(cancel, conn: http.client.HTTPConnection):
+    # Registers a cancel callback that aborts `conn`; returns the function that unregisters it
+    if cancel is None:
+        return lambda: None
+    return cancel.add_cancel_callback(lambda: _abort_connection(conn))
+
+
+def _abort_connection(conn: http.client.HTTPConnection):
+    # Runs on the cancelling thread. shutdown() wakes a reader blocked in recv(), which close() alone does not.
+    sock = conn.sock
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _raise_if_cancelled(cancel, what: str, cause: Exception = None):
+    if cancel is not None and cancel.cancelled:
+        raise OllamaError(f"{what} was cancelled.") from cause
+
+
+def _error_message(body: bytes) -> str:
+    try:
+        data = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return body[:200].decode("utf-8", "replace")
+    if isinstance(data, dict) and "error" in data:
+        return str(data["error"])
+    return str(data)[:200]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str) -> OllamaClient:
+    """
+    Returns the shared client (and thus connection pool) for `base_url`.
+    """
+    key = base_url.strip().rstrip("/")
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = OllamaClient(key)
+        return client
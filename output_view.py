@@ -0,0 +1,183 @@
+import os
+import tempfile
+from collections import namedtuple
+
+# Append-only, bounded output for the Tk text widget.
+#
+# Redrawing the whole output on every update is O(n) per update and O(n^2) per streamed
+# response, and inserting a multi-megabyte tool output stalls Tk. OutputBuffer records
+# updates as deltas (append, or replace the document) and hands them out once per frame:
+# all appends since the last frame become one insert, at most `max_chars_per_frame`
+# characters are inserted per frame, and only the last `max_chars` characters are kept in
+# the widget (older text is trimmed from the top, like a ring buffer). The full document is
+# kept in memory until it outgrows the cap; from then on it is spilled to a transcript file
+# on disk, whose path is shown in a header line above the retained text.
+
+DEFAULT_MAX_CHARS = 200_000
+DEFAULT_MAX_CHARS_PER_FRAME = 64_000
+TRIMMED_HEADER = "[Earlier output trimmed; full transcript: {path}]\n"
+
+# A frame's worth of changes to the widget: clear it first (`reset`), insert `header` as the
+# first line, delete `trim` characters from the start of the retained text, then append `text`.
+OutputDelta = namedtuple("OutputDelta", ["reset", "header", "trim", "text"])
+
+
+class OutputBuffer:
+    """
+    Toolkit-independent model of the output area; see the module comment.
+    """
+    def __init__(self, max_chars: int = DEFAULT_MAX_CHARS, max_chars_per_frame: int = DEFAULT_MAX_CHARS_PER_FRAME, spill_dir: str = None):
+        self.max_chars = max_chars
+        self.max_chars_per_frame = max_chars_per_frame
+        self.spill_dir = spill_dir
+        self.transcript_path = None  # Set once the document has been spilled to disk
+        self._transcript_file = None
+        self._document = []  # Full document while it fits in memory
+        self._document_chars = 0
+        self._pending = []  # Text appended since the last delta
+        self._pending_chars = 0
+        self._reset = False
+        self._header_shown = False
+        self._widget_chars = 0  # Retained characters in the widget after the deltas handed out so far
+
+    def set_text(self, text: str):
+        """
+        Replaces the whole document with `text`.
+        """
+        self._discard_transcript()
+        self._document = []
+        self._document_chars = 0
+        self._pending = []
+        self._pending_chars = 0
+        self._reset = True
+        self._header_shown = False
+        self._widget_chars = 0
+        self.append(text)
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars > self.max_chars + self.max_chars_per_frame:
+            # Text that will be trimmed before it is ever displayed is dropped right away
+            joined = "".join(self._pending)
+            self._pending = [joined[-self.max_chars:]]
+            self._pending_chars = len(self._pending[0])
+        if self._transcript_file is not None:
+            self._transcript_file.write(text)
+            return
+        self._document.append(text)
+        self._document_chars += len(text)
+        if self._document_chars > self.max_chars:
+            self._spill()
+
+    def text(self) -> str:
+        """
+        The full document, read back from the transcript file once spilled.
+        """
+        if self._transcript_file is None:
+            return "".join(self._document)
+        self._transcript_file.flush()
+        with open(self.transcript_path, encoding="utf-8") as transcript:
+            return transcript.read()
+
+    @property
+    def has_pending(self) -> bool:
+        return self._reset or bool(self._pending)
+
+    def take_delta(self) -> OutputDelta:
+        """
+        The changes to apply to the widget this frame, or None if there are none.
+        """
+        if not self.has_pending:
+            return None
+        reset, self._reset = self._reset, False
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_chars = 0
+        if len(text) > self.max_chars:
+            text = text[-self.max_chars:]
+        if len(text) > self.max_chars_per_frame:
+            # The rest is inserted in the following frames
+            self._pending = [text[self.max_chars_per_frame:]]
+            self._pending_chars = len(self._pending[0])
+            text = text[:self.max_chars_per_frame]
+        trim = max(0, self._widget_chars + len(text) - self.max_chars)
+        self._widget_chars += len(text) - trim
+        header = None
+        if self.transcript_path is not None and not self._header_shown:
+            header = TRIMMED_HEADER.format(path=self.transcript_path)
+            self._header_shown = True
+        return OutputDelta(reset, header, trim, text)
+
+    def _spill(self):
+        fd, self.transcript_path = tempfile.mkstemp(prefix="dogma-transcript-", suffix=".txt", dir=self.spill_dir)
+        self._transcript_file = os.fdopen(fd, "w", encoding="utf-8")
+        self._transcript_file.writelines(self._document)
+        self._document = []
+        self._document_chars = 0
+
+    def _discard_transcript(self):
+        if self._transcript_file is not None:
+            self._transcript_file.close()
+            self._transcript_file = None
+        if self.transcript_path is not None:
+            try:
+                os.remove(self.transcript_path)
+            except OSError:
+                pass
+            self.transcript_path = None
+
+    def close(self):
+        self._discard_transcript()
+
+
+class OutputView:
+    """
+    Applies an OutputBuffer to a read-only tk.Text widget. Call flush() once per frame
+    (the UI's poll loop does); set_text() and append() only record the change.
+    """
+    def __init__(self, text_widget, max_chars: int = DEFAULT_MAX_CHARS, max_chars_per_frame: int = DEFAULT_MAX_CHARS_PER_FRAME, spill_dir: str = None):
+        self.widget = text_widget
+        self.buffer = OutputBuffer(max_chars, max_chars_per_frame, spill_dir)
+        self._has_header = False
+
+    def set_text(self, text: str):
+        self.buffer.set_text(text)
+
+    def append(self, text: str):
+        self.buffer.append(text)
+
+    def text(self) -> str:
+        return self.buffer.text()
+
+    def flush(self) -> bool:
+        """
+        Applies this frame's delta to the widget. Returns whether anything changed.
+        """
+        delta = self.buffer.take_delta()
+        if delta is None:
+            return False
+        widget = self.widget
+        # Follow the end of the output unless the user has scrolled up to read
+        at_bottom = widget.yview()[1] >= 0.999
+        widget.config(state="normal")
+        if delta.reset:
+            widget.delete("1.0", "end")
+            self._has_header = False
+        if delta.header is not None:
+            widget.insert("1.0", delta.header)
+            self._has_header = True
+        retained_start = "2.0" if self._has_header else "1.0"
+        if delta.trim:
+            widget.delete(retained_start, f"{retained_start} + {delta.trim} chars")
+        if delta.text:
+            widget.insert("end", delta.text)
+        widget.config(state="disabled")
+        if at_bottom or delta.reset:
+            widget.see("end")
+        return True
+
+    def close(self):
+        self.buffer.close()
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from tool_executor import HttpPageFetcher, Page, ToolError
+
+# On-disk cache of fetched pages and of the text/data the tools extracted from them.
+#
+# Entries are keyed by the normalized URL. Page bodies are stored content-addressed
+# (by the SHA-256 of the body) under objects/, so identical pages share one file; the
+# index and the extracted text live in a SQLite database next to them. Extracts are
+# tied to the body they were computed from and become invalid when the page changes.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 300  # Seconds an entry is served without revalidation
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "dogma", "pages")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of `url` for cache keys: lowercase scheme and host, no default port,
+    no fragment or credentials, sorted query parameters and "/" for an empty path.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"
+    port = parts.port
+    if port is not None and (scheme, port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def _header(headers: dict, name: str):
+    name = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class PageCache:
+    """
+    Size-capped LRU cache of pages with ETag/Last-Modified revalidation.
+    Safe to share between the tool worker threads.
+    """
+    def __init__(self, directory: str = None, max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._objects_dir = os.path.join(self.directory, "objects")
+        os.makedirs(self._objects_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY, final_url TEXT, status INTEGER, body_hash TEXT, size INTEGER,
+                etag TEXT, last_modified TEXT, content_type TEXT, fetched_at REAL, last_access REAL
+            );
+            CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access);
+            CREATE TABLE IF NOT EXISTS extracts (
+                key TEXT, tool TEXT, body_hash TEXT, text TEXT, data TEXT, size INTEGER,
+                PRIMARY KEY (key, tool)
+            );
+        """)
+        self._lock = threading.RLock()
+        self._revalidator = HttpPageFetcher()
+        self._counters = dict.fromkeys(
+            ("hits", "misses", "revalidations", "bytes_served", "bytes_fetched", "extract_hits", "extract_misses", "evictions"), 0)
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+    def _object_path(self, body_hash: str) -> str:
+        return os.path.join(self._objects_dir, body_hash[:2], body_hash)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _lookup(self, key: str):
+        with self._lock:
+            return self._db.execute(
+                "SELECT final_url, status, body_hash, size, etag, last_modified, content_type, fetched_at FROM pages WHERE key = ?",
+                (key,)).fetchone()
+
+    def _load(self, key: str, row) -> Page:
+        final_url, status, body_hash, size, etag, last_modified, content_type, _ = row
+        try:
+            with open(self._object_path(body_hash), "rb") as f:
+                html = f.read().decode("utf-8")
+        except OSError:
+            return None
+        headers = {name: value for name, value in (("ETag", etag), ("Last-Modified", last_modified), ("Content-Type", content_type)) if value}
+        with self._lock:
+            self._db.execute("UPDATE pages SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        self._count("hits")
+        self._count("bytes_served", size)
+        return Page(final_url, status, html, headers)
+
+    def get_page(self, url: str, fetcher, cancel=None) -> Page:
+        """
+        Returns the page for `url`: from the cache while fresh, after a conditional request
+        (If-None-Match / If-Modified-Since) once stale, or freshly fetched with `fetcher`.
+        `cancel`, if given, is passed on to the fetcher.
+        """
+        fetch_options = {"cancel": cancel} if cancel is not None else {}
+        key = self.cache_key(url)
+        row = self._lookup(key)
+        if row is not None:
+            etag, last_modified, fetched_at = row[4], row[5], row[7]
+            if time.time() - fetched_at < self.max_age:
+                page = self._load(key, row)
+                if page is not None:
+                    return page
+            elif etag or last_modified:
+                validators = {}
+                if etag:
+                    validators["If-None-Match"] = etag
+                if last_modified:
+                    validators["If-Modified-Since"] = last_modified
+                if isinstance(fetcher, HttpPageFetcher):
+                    # Plain HTTP revalidates and refetches in one request
+                    response = fetcher.fetch(url, headers=validators, **fetch_options)
+                    unchanged = response.status == 304
+                    if not unchanged:
+                        self._count("misses")
+                        self._store(key, response)
+                        return response
+                else:
+                    # A browser only renders pages that changed; the check skips the body of a
+                    # changed page, and if it fails the browser may still get through
+                    try:
+                        unchanged = self._revalidator.is_unchanged(url, validators, cancel)
+                    except ToolError:
+                        if cancel is not None and cancel.cancelled:
+                            raise
+                        unchanged = False
+                if unchanged:
+                    with self._lock:
+                        self._db.execute("UPDATE pages SET fetched_at = ? WHERE key = ?", (time.time(), key))
+                        self._db.commit()
+                    page = self._load(key, row)
+                    if page is not None:
+                        self._count("revalidations")
+                        return page
+
+        self._count("misses")
+        page = fetcher.fetch(url, **fetch_options)
+        self._store(key, page)
+        return page
+
+    def _store(self, key: str, page: Page):
+        body = page.html.encode("utf-8")
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._object_path(body_hash)
+        self._count("bytes_fetched", len(body))
+        now = time.time()
+        with self._lock:
+            # Written under the lock so a concurrent eviction cannot release a body that is being referenced
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(body)
+                os.replace(temp_path, path)
+            previous = self._db.execute("SELECT body_hash FROM pages WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, page.url, page.status, body_hash, len(body), _header(page.headers, "ETag"),
+                 _header(page.headers, "Last-Modified"), _header(page.headers, "Content-Type"), now, now))
+            if previous is not None and previous[0] != body_hash:
+                self._db.execute("DELETE FROM extracts WHERE key = ?", (key,))
+                self._release_object(previous[0])
+            self._db.commit()
+            self._evict()
+
+    def get_extract(self, url: str, tool: str):
+        """
+        Returns the (text, data) a tool extracted from the currently cached body of `url`, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT e.text, e.data FROM extracts e JOIN pages p ON p.key = e.key AND p.body_hash = e.body_hash "
+                "WHERE e.key = ? AND e.tool = ?", (self.cache_key(url), tool)).fetchone()
+        if row is None:
+            self._count("extract_misses")
+            return None
+        self._count("extract_hits")
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    def put_extract(self, url: str, tool: str, text: str, data):
+        key = self.cache_key(url)
+        data_json = json.dumps(data) if data is not None else None
+        size = len(text.encode("utf-8")) + len(data_json or "")
+        with self._lock:
+            row = self._db.execute("SELECT body_hash FROM pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO extracts VALUES (?, ?, ?, ?, ?, ?)", (key, tool, row[0], text, data_json, size))
+            self._db.commit()
+            self._evict()
+
+    def _total_bytes(self) -> int:
+        pages = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        extracts = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM extracts").fetchone()[0]
+        return pages + extracts
+
+    def _evict(self):
+        # Called with the lock held: drops least recently used pages (and their extracts) until under the cap
+        total = self._total_bytes()
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT key, body_hash FROM pages ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            key, body_hash = row
+            self._db.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM extracts WHERE key = ?", (key,))
+            self._release_object(body_hash)
+            self._counters["evictions"] += 1
+            total = self._total_bytes()
+        self._db.commit()
+
+    def _release_object(self, body_hash: str):
+        # Deletes a body file once no entry references it
+        if self._db.execute("SELECT 1 FROM pages WHERE body_hash = ? LIMIT 1", (body_hash,)).fetchone() is None:
+            try:
+                os.remove(self._object_path(body_hash))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Hit/miss/byte counters plus the current size of the cache.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            stats["total_bytes"] = self._total_bytes()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            hashes = [row[0] for row in self._db.execute("SELECT DISTINCT body_hash FROM pages")]
+            self._db.execute("DELETE FROM pages")
+            self._db.execute("DELETE FROM extracts")
+            self._db.commit()
+            for body_hash in hashes:
+                self._release_object(body_hash)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
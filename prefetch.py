@@ -0,0 +1,98 @@
+import threading
+import tool_registry
+from page_cache import normalize_url
+
+# Speculative prefetch of the target URL.
+#
+# A tool-using turn normally runs its two slowest stages one after the other: the model
+# generates until it emits the tool call, and only then is the page loaded and extracted.
+# When tools are enabled and a target URL is given, the URL is almost always what the model
+# will ask for, so the page is fetched and extracted for each enabled tool while the model
+# is still generating. A tool call for the same (tool, URL) then takes the prefetched
+# result instead of starting a new fetch. Prefetches the model did not ask for are
+# cancelled when the request ends; hit and waste rates show whether the guess pays off.
+
+
+class Prefetch:
+    """
+    The speculative tool runs of one request, as returned by Prefetcher.start().
+    """
+    def __init__(self, prefetcher: "Prefetcher", url: str, futures: dict):
+        self._prefetcher = prefetcher
+        self._key = normalize_url(url)
+        self._futures = futures  # tool -> Future[ToolResult]
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self._released = False
+
+    def claim(self, tool_call):
+        """
+        Returns the Future of the prefetched result for `tool_call`, or None if it was not prefetched.
+        """
+        if not tool_call.url or normalize_url(tool_call.url) != self._key:
+            return None
+        with self._lock:
+            future = self._futures.get(tool_call.tool)
+            if future is None or self._released:
+                return None
+            if tool_call.tool not in self._claimed:
+                self._claimed.add(tool_call.tool)
+                self._prefetcher._count("hits")
+        return future
+
+    @property
+    def hits(self) -> int:
+        with self._lock:
+            return len(self._claimed)
+
+    def release(self):
+        """
+        Aborts the prefetches that were not claimed and records them as wasted. A run already
+        in progress stops before its next step, and a browser page still loading is closed.
+        """
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+            unclaimed = [future for tool, future in self._futures.items() if tool not in self._claimed]
+        for future in unclaimed:
+            self._prefetcher._count("wasted")
+            if future.abort():
+                self._prefetcher._count("cancelled")
+
+
+class Prefetcher:
+    """
+    Starts speculative tool runs on a tool_executor.ToolExecutor and keeps hit/waste counters
+    across requests. Safe to share between worker threads.
+    """
+    def __init__(self, executor):
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("started", "hits", "wasted", "cancelled"), 0)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def start(self, target_url: str, enabled_tools: list[str]) -> Prefetch:
+        """
+        Prefetches `target_url` for each enabled tool. Returns None when there is nothing to prefetch.
+        """
+        tools = [tool.name for tool in tool_registry.known_tools(enabled_tools)]
+        if not target_url or not tools:
+            return None
+        futures = self.executor.prefetch(target_url, tools, allowed_tools=enabled_tools)
+        self._count("started", len(futures))
+        return Prefetch(self, target_url, futures)
+
+    def stats(self) -> dict:
+        """
+        The counters plus the share of prefetches used by a tool call (hit rate) and not used (waste rate).
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        started = stats["started"]
+        stats["hit_rate"] = stats["hits"] / started if started else 0.0
+        stats["waste_rate"] = stats["wasted"] / started if started else 0.0
+        return stats
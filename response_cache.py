@@ -0,0 +1,296 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from core_logic import (
+    StreamingOutputParser, OutputEvent, FollowUp,
+    OUTPUT_EVENT_TOKEN, OUTPUT_EVENT_TOOL_RESULT, OUTPUT_EVENT_FOLLOW_UP, OUTPUT_EVENT_TURN_DONE,
+)
+from execution_engine import TaskContext
+from tool_executor import ToolResult
+
+# Cache of complete agent responses with single-flight deduplication.
+#
+# An entry is keyed by a hash of the model, the system prompt (which encodes the enabled
+# tools), the conversation history, the prompt, the target URL and whether tool calls are
+# executed (and with what token budget their results are fed back). It stores the recorded
+# token stream of each model turn together with the tool results in between; a hit is
+# replayed through a fresh StreamingOutputParser, so consumers see the same OutputEvents as
+# for a live request. Identical requests arriving while one is generating attach to it and
+# receive its events as they are produced instead of starting a second generation.
+#
+# The shared generation runs on its own thread, so any request may stop consuming it (e.g.
+# when its task is cancelled) without affecting the others. It is cancelled only once no
+# request follows it any more.
+#
+# Entries live in SQLite: in memory by default, or in a file given as `path` so that they
+# survive restarts. Expired entries are dropped on access, and the least recently used ones
+# once the stored responses exceed `max_bytes`.
+
+DEFAULT_TTL = 3600  # Seconds a response is served from the cache
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+RECORD_FORMAT = 3  # Part of the key, so entries recorded in an older format are not replayed
+
+
+class ResponseCacheError(Exception):
+    """
+    Raised to requests that joined a shared generation which failed.
+    """
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str, target_url: str = None, history: list[dict] = None, schema: dict = None,
+              run_tools: bool = False, tool_token_budget: int = None) -> str:
+    # A response whose tool calls were not executed ends after the first turn, so it must not answer a request that runs tools
+    material = json.dumps([RECORD_FORMAT, model, system_prompt, history or [], user_prompt, target_url or None, schema,
+                           run_tools, tool_token_budget if run_tools else None], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def replay_events(records: list, new_parser=StreamingOutputParser):
+    """
+    Yields the OutputEvents of a recorded response, parsing its tokens again turn by turn
+    with parsers made by `new_parser`.
+    """
+    parser = None
+    chunks = []
+    for kind, payload in records:
+        if kind == OUTPUT_EVENT_TOKEN:
+            if parser is None:
+                parser = new_parser()
+                chunks = []
+            chunks.append(payload)
+            yield OutputEvent(OUTPUT_EVENT_TOKEN, payload)
+            yield from parser.feed(payload)
+            continue
+        if parser is not None:
+            yield from parser.close()
+            parser = None
+        if kind == OUTPUT_EVENT_TOOL_RESULT:
+            yield OutputEvent(OUTPUT_EVENT_TOOL_RESULT, ToolResult(**payload))
+        elif kind == OUTPUT_EVENT_FOLLOW_UP:
+            yield OutputEvent(OUTPUT_EVENT_FOLLOW_UP, FollowUp(**payload))
+        else:
+            yield OutputEvent(kind, payload)
+    if parser is None:  # The final turn produced no tokens
+        parser = new_parser()
+        chunks = []
+    yield from parser.close()
+    yield OutputEvent(OUTPUT_EVENT_TURN_DONE, ("".join(chunks), parser.result()))
+
+
+class _Flight:
+    # One in-flight generation: events published by its thread and read by the requests following it
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.exception = None  # Why the generation failed, raised to the request that started it
+        self.error = None  # The ResponseCacheError raised to the requests that joined it
+        self.consumers = 0  # Guarded by the ResponseCache lock
+        self.cancel = TaskContext(0, None)  # Passed to produce(); cancelled when the last consumer leaves
+        self.condition = threading.Condition()
+
+    def publish(self, event: OutputEvent):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def finish(self, exception: Exception = None):
+        with self.condition:
+            self.done = True
+            if exception is not None:
+                self.exception = exception
+                self.error = ResponseCacheError(f"The shared request failed: {type(exception).__name__}: {exception}")
+            self.condition.notify_all()
+
+    def _wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def follow(self, cancel=None, started: bool = False):
+        # Yields the events published so far and then as they arrive; a cancelled `cancel` stops waiting at once
+        remove_cancel_hook = cancel.add_cancel_callback(self._wake) if cancel is not None else (lambda: None)
+        position = 0
+        try:
+            while True:
+                with self.condition:
+                    while position == len(self.events) and not self.done and not (cancel is not None and cancel.cancelled):
+                        self.condition.wait()
+                    pending = self.events[position:]
+                    position = len(self.events)
+                    done = self.done
+                if cancel is not None:
+                    cancel.check_cancelled()
+                yield from pending
+                if done and position == len(self.events):
+                    if self.exception is not None:
+                        raise self.exception if started else self.error
+                    return
+        finally:
+            remove_cancel_hook()
+
+
+class ResponseCache:
+    """
+    TTL and size-capped cache of agent responses, safe to share between worker threads.
+    """
+    def __init__(self, path: str = None, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, model TEXT, events TEXT, size INTEGER, created_at REAL, last_access REAL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+        """)
+        self._lock = threading.RLock()
+        self._flights = {}  # key -> _Flight of the generation in progress
+        self._counters = dict.fromkeys(("hits", "misses", "shared", "stores", "evictions"), 0)
+
+    cache_key = staticmethod(cache_key)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key: str):
+        """
+        Returns the recorded events of a fresh entry, or None.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT events, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] >= self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, records: list):
+        events = json.dumps(records, ensure_ascii=False, default=str)
+        size = len(events.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, model, events, size, now, now))
+            self._counters["stores"] += 1
+            self._evict(now)
+
+    def _evict(self, now: float):
+        # Called with the lock held: drops expired entries, then the least recently used until under the cap
+        self._counters["evictions"] += self._db.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,)).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self._counters["evictions"] += 1
+            total -= row[1]
+        self._db.commit()
+
+    def stream(self, key: str, model: str, produce, span=None, new_parser=StreamingOutputParser, cancel=None):
+        """
+        Yields the OutputEvents for `key`: replayed from the cache, shared with an identical
+        request in flight, or generated by `produce(cancel)` on a new thread and recorded if it
+        succeeds. The generation's `cancel` (an execution_engine.TaskContext) is cancelled when
+        no request follows it any more. Cancelling this request's own `cancel` only stops it
+        from following. `new_parser` makes the parser a replay runs the recorded tokens through.
+        """
+        records = self.get(key)
+        if records is None:
+            with self._lock:
+                flight = self._flights.get(key)
+                leading = flight is None
+                if leading:
+                    # Looked up again under the lock: a generation stores its entry before it leaves _flights
+                    records = self.get(key)
+                if records is None:
+                    if leading:
+                        flight = self._flights[key] = _Flight()
+                    flight.consumers += 1
+        if records is not None:
+            self._count("hits")
+            if span:
+                span.set(cache="hit")
+            yield from replay_events(records, new_parser)
+            return
+        self._count("misses" if leading else "shared")
+        if span:
+            span.set(cache="miss" if leading else "shared")
+        if leading:
+            threading.Thread(target=self._generate, args=(key, model, produce, flight), name="dogma-cache-flight", daemon=True).start()
+        try:
+            yield from flight.follow(cancel, started=leading)
+        finally:
+            self._detach(key, flight)
+
+    def _generate(self, key: str, model: str, produce, flight: _Flight):
+        # Runs on the flight's thread: publishes the events of produce() and stores them if the response completes
+        records = []
+        completed = False
+        cacheable = True
+        exception = None
+        try:
+            for event in produce(flight.cancel):
+                if event.kind == OUTPUT_EVENT_TOKEN:
+                    records.append((event.kind, event.payload))
+                elif event.kind == OUTPUT_EVENT_FOLLOW_UP:
+                    records.append((event.kind, event.payload._asdict()))
+                elif event.kind == OUTPUT_EVENT_TOOL_RESULT:
+                    records.append((event.kind, event.payload._asdict()))
+                    cacheable = cacheable and event.payload.ok  # Failed fetches may succeed next time
+                elif event.kind == OUTPUT_EVENT_TURN_DONE:
+                    completed = True
+                flight.publish(event)
+        except Exception as e:
+            exception = e
+        finally:
+            # Stored before the flight is removed, so an identical request always finds one of the two
+            if exception is None and completed and cacheable and not flight.cancel.cancelled:
+                self.put(key, model, records)
+            self._end_flight(key, flight)
+            flight.finish(exception)
+
+    def _end_flight(self, key: str, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _detach(self, key: str, flight: _Flight):
+        # A request stopped following `flight`; the generation is cancelled once none is left
+        with self._lock:
+            flight.consumers -= 1
+            abandoned = flight.consumers == 0 and not flight.done
+            if abandoned:
+                self._end_flight(key, flight)  # Later identical requests start a new generation
+        if abandoned:
+            flight.cancel.cancel()
+
+    def stats(self) -> dict:
+        """
+        Hit/miss/shared counters plus the current size of the cache.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"], stats["total_bytes"] = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = stats["hits"] + stats["shared"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["shared"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
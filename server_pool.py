@@ -0,0 +1,242 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ollama_client import OllamaClient, OllamaError
+
+# Routing of requests across several Ollama servers.
+#
+# Each server is probed periodically: /api/tags lists the models it can serve and /api/ps
+# the ones currently loaded in memory. A request goes to the least-loaded healthy server
+# that already has the model resident, falling back to one that merely has it installed
+# (a cold load) and, if a server fails before the first event, fails over to the next
+# candidate. Only connection errors take a server out of rotation until its next probe.
+
+DEFAULT_PROBE_INTERVAL = 15  # Seconds between background health probes
+PROBE_TIMEOUT = 5
+
+
+class ServerState:
+    """
+    What the pool knows about one server.
+    """
+    def __init__(self, url: str):
+        self.url = url.strip().rstrip("/")
+        self.client = OllamaClient(self.url)
+        self.probe_client = OllamaClient(self.url, timeout=PROBE_TIMEOUT, max_idle_connections=1)
+        self.healthy = False
+        self.models = set()  # Installed models (/api/tags)
+        self.loaded = set()  # Models resident in memory (/api/ps)
+        self.in_flight = 0
+        self.last_error = None
+        self.last_probe = None
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url, "healthy": self.healthy, "in_flight": self.in_flight,
+            "models": sorted(self.models), "loaded": sorted(self.loaded), "last_error": self.last_error,
+        }
+
+
+class OllamaServerPool:
+    """
+    A set of Ollama servers that requests are spread over by model residency and load.
+    """
+    def __init__(self, urls: list[str], probe_interval: float = DEFAULT_PROBE_INTERVAL):
+        if not urls:
+            raise OllamaError("A server pool needs at least one Ollama URL.")
+        self.servers = [ServerState(url) for url in urls]
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._probe_thread = None
+
+    def probe(self, server: ServerState) -> bool:
+        """
+        Refreshes `server`'s health and model lists.
+        """
+        try:
+            models = {model.get("name") for model in server.probe_client.list_models()}
+            running = server.probe_client.get_json("/api/ps").get("models") or []
+        except (OllamaError, AttributeError) as e:
+            with self._lock:
+                server.healthy = False
+                server.last_error = str(e)
+                server.last_probe = time.monotonic()
+            return False
+        with self._lock:
+            server.healthy = True
+            server.models = models - {None}
+            server.loaded = {model.get("name") for model in running} - {None}
+            server.last_error = None
+            server.last_probe = time.monotonic()
+        return True
+
+    def refresh(self):
+        """
+        Probes all servers in parallel.
+        """
+        with ThreadPoolExecutor(max_workers=len(self.servers)) as probes:
+            list(probes.map(self.probe, self.servers))
+
+    def start_health_checks(self):
+        if self._probe_thread is not None:
+            return
+        self.refresh()
+
+        def run():
+            while not self._stop.wait(self.probe_interval):
+                self.refresh()
+
+        self._probe_thread = threading.Thread(target=run, name="dogma-health", daemon=True)
+        self._probe_thread.start()
+
+    def candidates(self, model: str) -> list[ServerState]:
+        """
+        Healthy servers in routing order: model resident first, then model installed,
+        then the rest (the server may still pull the model), each group by current load.
+        """
+        with self._lock:
+            healthy = [server for server in self.servers if server.healthy]
+            return sorted(healthy, key=lambda server: (model not in server.loaded, model not in server.models, server.in_flight))
+
+    def select(self, model: str) -> ServerState:
+        candidates = self.candidates(model)
+        if not candidates:
+            raise self._no_server_error()
+        return candidates[0]
+
+    def server(self, url: str):
+        """
+        The state of the pool's server at `url`, or None if it is not in the pool.
+        """
+        url = url.strip().rstrip("/")
+        return next((server for server in self.servers if server.url == url), None)
+
+    def holding(self, model: str) -> list[ServerState]:
+        """
+        Servers that last reported `model` as resident.
+        """
+        with self._lock:
+            return [server for server in self.servers if model in server.loaded]
+
+    def _no_server_error(self) -> OllamaError:
+        with self._lock:
+            errors = "; ".join(f"{server.url}: {server.last_error or 'not probed'}" for server in self.servers)
+        return OllamaError(f"No healthy Ollama server available ({errors}).")
+
+    @contextmanager
+    def lease(self, server: ServerState):
+        with self._lock:
+            server.in_flight += 1
+        try:
+            yield server
+        finally:
+            with self._lock:
+                server.in_flight -= 1
+
+    def _mark_failed(self, server: ServerState, error: Exception):
+        with self._lock:
+            server.healthy = False
+            server.last_error = str(error)
+
+    def _mark_loaded(self, server: ServerState, model: str):
+        with self._lock:
+            server.loaded.add(model)
+            server.models.add(model)
+
+    def _mark_missing(self, server: ServerState, model: str):
+        with self._lock:
+            server.loaded.discard(model)
+            server.models.discard(model)
+
+    def _stream(self, method: str, model: str, *args, **kwargs):
+        # Fails over to the next candidate if a server errors before producing any output.
+        # Once events have been yielded the request cannot be replayed, so later errors propagate.
+        tried = set()
+        last_error = None
+        while True:
+            candidates = [server for server in self.candidates(model) if server.url not in tried]
+            if not candidates:
+                # Last resort: servers marked unhealthy may have recovered since their last probe
+                candidates = [server for server in self.servers if server.url not in tried and not server.healthy]
+            if not candidates:
+                raise last_error or self._no_server_error()
+            server = candidates[0]
+            tried.add(server.url)
+            with self.lease(server):
+                events = getattr(server.client, method)(model, *args, **kwargs)
+                try:
+                    first = next(events, None)
+                except OllamaError as e:
+                    cancel = kwargs.get("cancel")
+                    if cancel is not None and cancel.cancelled:
+                        raise # Aborted by the caller; not a server failure
+                    if e.status is None:
+                        self._mark_failed(server, e) # Unreachable: skip it until the next successful probe
+                    elif e.status == 404:
+                        self._mark_missing(server, model) # Not installed there after all
+                    elif e.status != 200 and e.status < 500:
+                        raise # The server answered; the request itself is bad
+                    # Otherwise the server is up but could not serve this request (e.g. the model
+                    # failed to load): try the next one without taking this one out of rotation
+                    last_error = e
+                    continue
+                self._mark_loaded(server, model)
+                try:
+                    if first is not None:
+                        yield first
+                    yield from events
+                finally:
+                    events.close()
+                return
+
+    def chat(self, model: str, messages: list[dict], **kwargs):
+        return self._stream("chat", model, messages, **kwargs)
+
+    def generate(self, model: str, prompt: str, **kwargs):
+        return self._stream("generate", model, prompt, **kwargs)
+
+    def list_models(self) -> list[dict]:
+        """
+        Union of the models installed on the healthy servers, in /api/tags form.
+        """
+        with self._lock:
+            names = set().union(*(server.models for server in self.servers if server.healthy))
+        if not names and not any(server.healthy for server in self.servers):
+            raise self._no_server_error()
+        return [{"name": name} for name in sorted(names)]
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [server.snapshot() for server in self.servers]
+
+    def close(self):
+        self._stop.set()
+        for server in self.servers:
+            server.client.close()
+            server.probe_client.close()
+
+
+def parse_server_urls(ollama_url: str) -> list[str]:
+    """
+    Splits a comma- or whitespace-separated list of server URLs.
+    """
+    return [url for url in ollama_url.replace(",", " ").split() if url]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_server_pool(urls: list[str]) -> OllamaServerPool:
+    """
+    Returns the shared, health-checked pool for this set of servers.
+    """
+    key = tuple(sorted(url.rstrip("/") for url in urls))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = OllamaServerPool(list(key))
+            pool.start_health_checks()
+        return pool
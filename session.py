@@ -0,0 +1,199 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from content_distiller import estimate_tokens
+from core_logic import generate_system_prompt, get_ollama_backend
+from structured_output import generate_structured_system_prompt
+
+# Multi-turn conversation sessions.
+#
+# Ollama keeps the KV cache of the last prompt of a loaded model and only evaluates the part
+# of a new prompt after the longest common prefix. A session therefore sends every turn as
+# the same system prompt, the same history messages (assistant turns exactly as generated)
+# and then the new user message, so a follow-up turn only pays for its own tokens.
+#
+# When the estimated size of the history reaches `compact_ratio` of the context window,
+# the older turns are summarized by the model in the background and replaced by a summary
+# message placed right after the system prompt. Turn sizes and counts are capped, so the
+# memory held per session stays bounded even if compaction cannot keep up.
+#
+# A turn is built from the history as it was when the request started, so the requests of
+# a session take turns: each reserves its place with begin_request() when it is submitted and
+# waits in wait_for_turn() until the ones submitted before it have finished.
+
+DEFAULT_CONTEXT_TOKENS = 4096  # Ollama's default num_ctx
+DEFAULT_COMPACT_RATIO = 0.75
+DEFAULT_KEEP_RECENT_TURNS = 2  # Turns left verbatim by compaction
+MAX_TURNS = 50
+MAX_TURN_CHARS = 16_000  # Per stored message
+MAX_SUMMARY_CHARS = 4000
+SUMMARY_INSTRUCTION = (
+    "You maintain the memory of a conversation between a user and an assistant. Summarize the "
+    "conversation below in at most 200 words: keep facts, names, numbers, URLs, decisions and open "
+    "questions that later turns may refer to. Reply with the summary only."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+Turn = namedtuple("Turn", ["user", "assistant", "steps"], defaults=((),))
+# steps: the messages between the user message and the final answer (tool-calling assistant turns and tool results)
+
+
+class ChatSession:
+    """
+    Message history of one conversation with `model` on `ollama_url`.
+    """
+    def __init__(self, ollama_url: str, model: str, context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                 compact_ratio: float = DEFAULT_COMPACT_RATIO, keep_recent_turns: int = DEFAULT_KEEP_RECENT_TURNS):
+        self.ollama_url = ollama_url
+        self.model = model
+        self.context_tokens = context_tokens
+        self.compact_ratio = compact_ratio
+        self.keep_recent_turns = keep_recent_turns
+        self.summary = None
+        self._turns = []
+        self._system_prompts = {}  # (tuple(enabled_tools), structured) -> system prompt, so the prefix stays byte-identical
+        self._compaction = None  # Future of the running compaction
+        self._prompt_key = ((), False)  # (enabled tools, structured) of the last turn, for size estimates
+        self._issued = 0  # Turn tickets handed out by begin_request()
+        self._next_ticket = 0  # The ticket whose request may run now
+        self._finished = set()  # Tickets that ended before their turn came
+        self._lock = threading.Lock()
+        self._turn_changed = threading.Condition(self._lock)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dogma-session")
+
+    def system_prompt(self, enabled_tools: list[str], structured: bool = False) -> str:
+        key = (tuple(enabled_tools or ()), structured)
+        with self._lock:
+            prompt = self._system_prompts.get(key)
+            if prompt is None:
+                generate = generate_structured_system_prompt if structured else generate_system_prompt
+                prompt = self._system_prompts[key] = generate(list(key[0]))
+            return prompt
+
+    @property
+    def turns(self) -> list[Turn]:
+        with self._lock:
+            return list(self._turns)
+
+    def history(self) -> list[dict]:
+        """
+        The messages to send between the system prompt and the new user message.
+        """
+        with self._lock:
+            messages = [{"role": "system", "content": SUMMARY_PREFIX + self.summary}] if self.summary else []
+            for turn in self._turns:
+                messages.append({"role": "user", "content": turn.user})
+                messages.extend(turn.steps)
+                messages.append({"role": "assistant", "content": turn.assistant})
+        return messages
+
+    def begin_request(self) -> int:
+        """
+        Reserves the next turn of the conversation, in submission order. Returns the ticket to
+        pass to wait_for_turn() and, once the request has finished or was cancelled, end_request().
+        """
+        with self._lock:
+            ticket = self._issued
+            self._issued += 1
+            return ticket
+
+    def open_requests(self) -> int:
+        """
+        Number of requests that have a ticket and have not ended.
+        """
+        with self._lock:
+            return self._issued - self._next_ticket - len(self._finished)
+
+    def wait_for_turn(self, ticket: int, cancel=None):
+        """
+        Blocks until the requests submitted before `ticket` have ended. Cancelling `cancel`
+        (an execution_engine.TaskContext) stops the wait with TaskCancelled.
+        """
+        remove_cancel_hook = cancel.add_cancel_callback(self._wake) if cancel is not None else (lambda: None)
+        try:
+            with self._turn_changed:
+                while self._next_ticket != ticket and not (cancel is not None and cancel.cancelled):
+                    self._turn_changed.wait()
+        finally:
+            remove_cancel_hook()
+        if cancel is not None:
+            cancel.check_cancelled()
+
+    def end_request(self, ticket: int):
+        with self._turn_changed:
+            self._finished.add(ticket)
+            while self._next_ticket in self._finished:
+                self._finished.remove(self._next_ticket)
+                self._next_ticket += 1
+            self._turn_changed.notify_all()
+
+    def _wake(self):
+        with self._turn_changed:
+            self._turn_changed.notify_all()
+
+    def record_turn(self, user_content: str, assistant_output: str, enabled_tools: list[str] = None, structured: bool = False, steps: list[dict] = None):
+        """
+        Appends a finished turn and starts a compaction if the history has grown too large.
+        `user_content` must be the user message exactly as sent and `steps` the messages of the
+        tool rounds in between (see core_logic.FollowUp), so the next prompt extends this one;
+        `enabled_tools` and `structured` select the system prompt the turn was sent with.
+        """
+        steps = tuple({"role": step["role"], "content": step["content"][:MAX_TURN_CHARS]} for step in steps or ())
+        with self._lock:
+            self._turns.append(Turn(user_content[:MAX_TURN_CHARS], assistant_output[:MAX_TURN_CHARS], steps))
+            del self._turns[:-MAX_TURNS]
+            self._prompt_key = (tuple(enabled_tools or ()), structured)
+        self.maybe_compact()
+
+    def estimated_tokens(self, enabled_tools: list[str] = None, structured: bool = False) -> int:
+        text = self.system_prompt(enabled_tools, structured) + "".join(message["content"] for message in self.history())
+        return estimate_tokens(text, self.model)
+
+    def maybe_compact(self):
+        """
+        Starts summarizing the older turns in the background when the history nears the
+        context limit. Returns the Future of the compaction, or None if none is needed.
+        """
+        with self._lock:
+            enabled_tools, structured = self._prompt_key
+        if self.estimated_tokens(list(enabled_tools), structured) < self.compact_ratio * self.context_tokens:
+            return None
+        with self._lock:
+            if self._compaction is not None:
+                return self._compaction
+            old_turns = self._turns[:-self.keep_recent_turns] if self.keep_recent_turns else list(self._turns)
+            if not old_turns:
+                return None
+            self._compaction = self._executor.submit(self._compact, old_turns, self.summary)
+            return self._compaction
+
+    def _compact(self, old_turns: list[Turn], previous_summary: str):
+        from ollama_client import iter_text
+        try:
+            parts = [SUMMARY_PREFIX + previous_summary] if previous_summary else []
+            for turn in old_turns:
+                lines = [f"User: {turn.user}"]
+                lines.extend(f"{'Assistant' if step['role'] == 'assistant' else 'Tool results'}: {step['content']}" for step in turn.steps)
+                lines.append(f"Assistant: {turn.assistant}")
+                parts.append("\n".join(lines))
+            messages = [
+                {"role": "system", "content": SUMMARY_INSTRUCTION},
+                {"role": "user", "content": "\n\n".join(parts)},
+            ]
+            summary = "".join(iter_text(get_ollama_backend(self.ollama_url).chat(self.model, messages))).strip()
+            with self._lock:
+                # Only replace the turns if they are still the oldest ones (no reset in between)
+                if self._turns[:len(old_turns)] == old_turns and self.summary == previous_summary:
+                    self.summary = summary[:MAX_SUMMARY_CHARS]
+                    del self._turns[:len(old_turns)]
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def reset(self):
+        with self._lock:
+            self._turns = []
+            self.summary = None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,133 @@
+import functools
+import json
+from tool_registry import known_tools
+
+# Schema-constrained output mode.
+#
+# Instead of asking for a fenced ```json block in prose (see generate_system_prompt), the
+# JSON schema below is sent as Ollama's `format` parameter, which constrains generation to
+# valid JSON of that shape. The whole response is then the object, so the system prompt
+# only has to explain the fields, and the result is checked by a validator compiled once
+# per schema instead of being searched for in free text.
+#
+# A tool is requested by naming it in "tool_used" with the URL in "tool_input" and an
+# empty "user_facing_answer"; the tool results are sent back in a follow-up turn, whose
+# response then carries the answer.
+
+def output_schema(enabled_tools: list[str]) -> dict:
+    """
+    JSON schema of a structured response; "tool_used" is limited to the enabled tools.
+    """
+    tools = [tool.name for tool in known_tools(enabled_tools)]
+    return {
+        "type": "object",
+        "properties": {
+            "tool_used": {"type": ["string", "null"], "enum": [*tools, None]},
+            "tool_input": {"type": "object", "properties": {"url": {"type": "string"}}},
+            "summary": {"type": "string"},
+            "extracted_data": {"type": "object"},
+            "user_facing_answer": {"type": "string"},
+        },
+        "required": ["tool_used", "summary", "user_facing_answer"],
+    }
+
+
+def generate_structured_system_prompt(enabled_tools: list[str]) -> str:
+    """
+    The system prompt for structured mode: the fields of the response and the enabled tools, without examples.
+    """
+    tools = known_tools(enabled_tools)
+    lines = [
+        "You are a helpful AI assistant. Answer the user's request accurately and concisely.",
+        "Reply with a JSON object: \"tool_used\" (tool name or null), \"tool_input\" ({\"url\": ...}), "
+        "\"summary\" (what a tool did or found, or why it failed), \"extracted_data\" (optional data points) "
+        "and \"user_facing_answer\" (the complete answer shown to the user).",
+    ]
+    if tools:
+        lines.append("Tools: " + "; ".join(f"{tool.name} {tool.summary}" for tool in tools) + ".")
+        lines.append("To use a tool, set \"tool_used\" and \"tool_input\" and leave \"user_facing_answer\" empty; "
+                     "its result will be sent to you. Only use a tool when the request needs it.")
+    else:
+        lines.append("No tools are enabled; answer from your own knowledge with \"tool_used\" set to null.")
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def response_validator(enabled_tools: tuple):
+    """
+    The compiled validator of output_schema(enabled_tools), built once per tool selection.
+    """
+    return compile_validator(output_schema(list(enabled_tools)))
+
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+}
+
+
+def compile_validator(schema: dict):
+    """
+    Compiles the subset of JSON schema used here (type, enum, properties, required, items)
+    into a function that returns the list of errors of a value, empty if it conforms.
+    The schema is walked once; validating a value only runs the prepared checks.
+    """
+    checks = _compile(schema)
+
+    def validate(value) -> list[str]:
+        errors = []
+        for check in checks:
+            check(value, "$", errors)
+        return errors
+
+    return validate
+
+
+def _compile(schema: dict) -> list:
+    checks = []
+    if "type" in schema:
+        types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        type_checks = [_TYPE_CHECKS[name] for name in types]
+        expected = " or ".join(types)
+
+        def check_type(value, path, errors):
+            if not any(type_check(value) for type_check in type_checks):
+                errors.append(f"{path}: expected {expected}")
+        checks.append(check_type)
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append(f"{path}: {json.dumps(value)} is not one of {json.dumps(allowed)}")
+        checks.append(check_enum)
+    required = list(schema.get("required", ()))
+    properties = {name: _compile(subschema) for name, subschema in schema.get("properties", {}).items()}
+    if required or properties:
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append(f"{path}: missing {name!r}")
+            for name, property_checks in properties.items():
+                if name in value:
+                    for check in property_checks:
+                        check(value[name], f"{path}.{name}", errors)
+        checks.append(check_object)
+    if "items" in schema:
+        item_checks = _compile(schema["items"])
+
+        def check_items(value, path, errors):
+            if not isinstance(value, list):
+                return
+            for index, item in enumerate(value):
+                for check in item_checks:
+                    check(item, f"{path}[{index}]", errors)
+        checks.append(check_items)
+    return checks
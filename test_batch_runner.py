@@ -0,0 +1,70 @@
+import unittest
+import io
+import json
+import os
+import tempfile
+from batch_runner import run_batch, load_completed_ids, main
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        # Answers in the JSON block format, echoing the prompt; "broken" is not installed
+        self.server = MockOllamaServer(MockOllamaConfig(ttft=0, tokens_per_second=0, models=["llama3"], answer_tokens=0)).start()
+        self.url = self.server.url
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_path = os.path.join(self.temp_dir.name, "out.jsonl")
+
+    def tearDown(self):
+        self.server.stop()
+        self.temp_dir.cleanup()
+
+    def _read_output(self):
+        with open(self.output_path, encoding="utf-8") as f:
+            return {result["id"]: result for result in map(json.loads, f)}
+
+    def test_results_are_written_per_record(self):
+        lines = [json.dumps({"model": "llama3", "prompt": f"prompt {i}", "enabled_tools": []}) for i in range(10)]
+        counts = run_batch(io.StringIO("\n".join(lines)), self.output_path, self.url, workers=3)
+        self.assertEqual(counts, {"written": 10, "skipped": 0, "failed": 0})
+        results = self._read_output()
+        self.assertEqual(sorted(results), list(range(1, 11)))
+        self.assertEqual(results[4]["user_facing_answer"].strip(), "Mock answer to: prompt 3")
+        self.assertEqual(results[4]["summary"], "Mock response.")
+        self.assertIsNotNone(results[4]["timings"]["ttft_ms"])
+
+    def test_failures_are_recorded_and_retried_on_resume(self):
+        records = [
+            json.dumps({"id": "a", "model": "llama3", "prompt": "one"}),
+            "{not json",
+            json.dumps({"id": "b", "model": "broken", "prompt": "two"}),
+            json.dumps({"id": "c", "prompt": "three"}),
+            json.dumps({"id": "d", "model": "llama3", "prompt": "four", "enabled_tools": 3}),
+        ]
+        counts = run_batch(io.StringIO("\n".join(records)), self.output_path, self.url, workers=2)
+        self.assertEqual(counts, {"written": 5, "skipped": 0, "failed": 4})
+        results = self._read_output()
+        self.assertIn("Invalid JSON on line 2", results[2]["error"])
+        self.assertIn("enabled_tools", results["d"]["error"])
+        self.assertIn("model 'broken' not found", results["b"]["error"])
+        self.assertEqual(load_completed_ids(self.output_path), {"a"})
+
+        # Resuming skips the completed record; --model fills in the missing one
+        counts = run_batch(io.StringIO("\n".join(records)), self.output_path, self.url, workers=2, default_model="llama3")
+        self.assertEqual(counts["skipped"], 1)
+        self.assertEqual(load_completed_ids(self.output_path), {"a", "c"})
+        prompts = [payload["messages"][-1]["content"] for payload in self.server.payloads()]
+        self.assertEqual(prompts.count("one"), 1)
+
+    def test_main_reads_input_file(self):
+        input_path = os.path.join(self.temp_dir.name, "in.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"prompt": "hello", "target_url": "https://example.com"}) + "\n")
+        exit_code = main([input_path, self.output_path, "--ollama-url", self.url, "--model", "llama3", "--workers", "1"])
+        self.assertEqual(exit_code, 0)
+        self.assertIn("Target URL: https://example.com", self._read_output()[1]["user_facing_answer"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from collections import namedtuple
+from content_distiller import ContentDistiller, distill, distill_stream, estimate_tokens, html_to_text, GAP_MARKER
+from core_logic import format_tool_results
+
+BOILERPLATE_PAGE = """<html><head><title>Pricing - Example</title><script>track();</script></head><body>
+<header><a href="/">Home</a> <a href="/docs">Docs</a></header>
+<nav><ul><li><a href="/a">Products</a></li><li><a href="/b">Blog</a></li></ul></nav>
+<div class="cookie-banner">We use cookies to improve your experience.</div>
+<main><article><header><h1>Plans and pricing</h1></header>
+<p>The team plan costs 42 EUR per user and month, billed yearly.</p>
+<ul class="menu"><li><a href="/x">Related link one</a></li></ul>
+<p>See <a href="/faq">the FAQ</a> for answers to common billing questions.</p>
+</article></main>
+<aside>Sponsored: buy more things.</aside>
+<footer>Copyright 2024 Example Inc.</footer></body></html>"""
+
+ToolResult = namedtuple("ToolResult", ["tool", "url", "ok", "text", "data", "error", "elapsed"])
+
+
+def _topic_text(topic: str, count: int) -> str:
+    return " ".join(f"This sentence is about {topic} number {i}." for i in range(count))
+
+
+class TestContentDistiller(unittest.TestCase):
+
+    def test_html_to_text_removes_boilerplate(self):
+        text = html_to_text(BOILERPLATE_PAGE)
+        self.assertEqual(text.splitlines(), [
+            "Pricing - Example",
+            "Plans and pricing",
+            "The team plan costs 42 EUR per user and month, billed yearly.",
+            "See the FAQ for answers to common billing questions.",
+        ])
+
+    def test_boilerplate_classes_match_whole_tokens(self):
+        html = """<body><div class="share-price">Shares closed at 12 USD.</div>
+<div class="site-nav">Home Docs Blog</div><div class="nav-tabs panel">Quarterly results are up.</div></body>"""
+        self.assertEqual(html_to_text(html).splitlines(), ["Shares closed at 12 USD.", "Quarterly results are up."])
+
+    def test_skipping_ends_with_an_implicitly_closed_element(self):
+        html = """<body><div><p class="share">Share this<p>First paragraph.</div>
+<ul><li class="promo">Buy now<li>Second item.</ul><div>Third block.</div></body>"""
+        self.assertEqual(html_to_text(html).splitlines(), ["First paragraph.", "Second item.", "Third block."])
+
+    def test_token_estimate_depends_on_model(self):
+        text = "x" * 420
+        self.assertEqual(estimate_tokens(text, "llama3:8b"), 100)
+        self.assertEqual(estimate_tokens(text, "unknown-model"), 105)
+
+    def test_most_relevant_chunks_are_kept_in_document_order(self):
+        blocks = [_topic_text("gardening", 6), _topic_text("kubernetes pricing", 6), _topic_text("cooking", 6), _topic_text("kubernetes pricing", 6)]
+        content = "\n".join(blocks)
+        result = distill(content, "What does kubernetes pricing look like?", token_budget=200, html=False, chunk_tokens=100)
+        self.assertEqual([chunk.index for chunk in result.chunks], [1, 3])
+        self.assertEqual(result.total_chunks, 4)
+        self.assertLessEqual(result.kept_tokens, 200)
+        self.assertEqual(result.text, f"{blocks[1]}\n\n{GAP_MARKER}\n\n{blocks[3]}")
+
+    def test_without_query_terms_the_start_is_kept(self):
+        content = "\n".join(_topic_text(f"topic{i}", 8) for i in range(6))
+        result = distill(content, "please tell me", token_budget=200, html=False, chunk_tokens=100)
+        self.assertEqual([chunk.index for chunk in result.chunks], [0, 1])
+
+    def test_streaming_matches_whole_input_and_bounds_candidates(self):
+        page = "<html><body>" + "".join(f"<p>{_topic_text('filler' if i != 70 else 'needle', 3)}</p>" for i in range(100)) + "</body></html>"
+        whole = distill(page, "needle", token_budget=100, chunk_tokens=50)
+        distiller = ContentDistiller("needle", token_budget=100, chunk_tokens=50)
+        for start in range(0, len(page), 97):
+            distiller.feed(page[start:start + 97])
+            self.assertLessEqual(len(distiller._candidates), distiller._max_candidates)
+        streamed = distiller.close()
+        self.assertEqual(streamed, whole)
+        self.assertIn("needle", streamed.text)
+        self.assertEqual(distill_stream(iter([page]), "needle", token_budget=100, chunk_tokens=50), whole)
+
+    def test_long_blocks_are_split_to_chunk_size(self):
+        result = distill("word " * 5000, "word", token_budget=10_000, html=False, chunk_tokens=100)
+        self.assertTrue(all(chunk.tokens <= 100 for chunk in result.chunks))
+        self.assertEqual(result.kept_tokens, result.total_tokens)
+
+    def test_tool_results_are_distilled_for_the_prompt(self):
+        page = "\n".join([_topic_text("weather", 200), "The price is 42 EUR.", _topic_text("history", 200)])
+        results = [ToolResult("Browser Use", "https://example.com", True, page, None, None, 0.1)]
+        message = format_tool_results(results, "What is the price in EUR?", "llama3", token_budget=300)
+        self.assertIn("The price is 42 EUR.", message)
+        self.assertIn("passages most relevant to the request", message)
+        self.assertLess(len(message), len(page) // 5)
+
+    def test_extracted_data_counts_against_the_token_budget(self):
+        page = _topic_text("weather", 200)
+        data = {"title": "Weather", "links": [f"https://example.com/day/{i}" for i in range(500)]}
+        results = [ToolResult("SmartScrapeAI", "https://example.com", True, page, data, None, 0.1)]
+        message = format_tool_results(results, "weather", "llama3", token_budget=300)
+        self.assertIn("[truncated]", message)
+        self.assertLess(estimate_tokens(message, "llama3"), 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
-import json # For checking JSON parts in mock response
-from core_logic import generate_system_prompt, execute_ollama_request
+from core_logic import (
+    generate_system_prompt, execute_ollama_request, parse_model_output, StreamingOutputParser, ToolCall,
+    OUTPUT_EVENT_TOOL_CALL, OUTPUT_EVENT_JSON_BLOCK, OUTPUT_EVENT_ANSWER_DELTA,
+)
 
 class TestCoreLogic(unittest.TestCase):
 
@@ -40,21 +42,15 @@ class TestCoreLogic(unittest.TestCase):
         self.assertIn("When you use a tool, you MUST report the outcome", prompt)
 
     def _extract_json_block(self, text_with_json_block):
-        # Helper to extract JSON block for easier testing
-        try:
-            # Expecting ```json
-# {...}
-# ```
-            start_index = text_with_json_block.index("```json\n") + len("```json\n")
-            end_index = text_with_json_block.index("\n```", start_index)
-            json_str = text_with_json_block[start_index:end_index]
-            return json.loads(json_str)
-        except (ValueError, json.JSONDecodeError) as e:
-            self.fail(f"Could not extract or parse JSON block: {e}\nBlock content: {text_with_json_block}")
+        # Helper to extract JSON block for easier testing, using the same parser as the UI
+        block = parse_model_output(text_with_json_block).json_block
+        if block is None or block.error is not None:
+            self.fail(f"Could not extract or parse JSON block: {block}\nBlock content: {text_with_json_block}")
+        return block.data
 
 
     def test_execute_ollama_request_mock_browser_tool(self):
-        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", "http://target.com", ["Browser Use"])
+        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", "http://target.com", ["Browser Use"], simulate=True)
         # Check it's the mock by looking for specific phrasing not in the JSON
         self.assertIn("Okay, I will use the Browser Use tool", response)
         json_data = self._extract_json_block(response)
@@ -63,7 +59,7 @@ class TestCoreLogic(unittest.TestCase):
         self.assertIn("simulated browsing to http://target.com", json_data["user_facing_answer"])
 
     def test_execute_ollama_request_mock_smartscrape_tool(self):
-        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", "http://scrape.it", ["SmartScrapeAI"])
+        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", "http://scrape.it", ["SmartScrapeAI"], simulate=True)
         self.assertIn("Okay, I will use the SmartScrapeAI tool", response)
         json_data = self._extract_json_block(response)
         self.assertEqual(json_data["tool_used"], "SmartScrapeAI")
@@ -72,7 +68,7 @@ class TestCoreLogic(unittest.TestCase):
         self.assertIn("extracted_data", json_data)
 
     def test_execute_ollama_request_mock_no_tool(self):
-        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", enabled_tools=[])
+        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", enabled_tools=[], simulate=True)
         self.assertIn("I'm processing your request", response) # General query mock
         json_data = self._extract_json_block(response)
         self.assertIsNone(json_data["tool_used"]) # Expecting null for tool_used
@@ -81,12 +77,83 @@ class TestCoreLogic(unittest.TestCase):
 
     def test_execute_ollama_request_mock_browser_tool_no_target_url(self):
         # Test default URL for browser tool
-        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", enabled_tools=["Browser Use"])
+        response = execute_ollama_request("http://testurl", "testmodel", "sysprompt", "userprompt", enabled_tools=["Browser Use"], simulate=True)
         self.assertIn("Okay, I will use the Browser Use tool", response)
         json_data = self._extract_json_block(response)
         self.assertEqual(json_data["tool_used"], "Browser Use")
         self.assertEqual(json_data["tool_input"]["url"], "https://example.com/browsed") # Default URL
 
+class TestStreamingOutputParser(unittest.TestCase):
+
+    SAMPLE_OUTPUT = (
+        "Let me look that up. [TOOL_CALL: Browser Use, URL: https://example.com/a?b=1]\n"
+        "```json\n"
+        "{\n"
+        '  "tool_used": "Browser Use",\n'
+        '  "tool_input": {"url": "https://example.com/a?b=1", "user_facing_answer": "nested, not the answer"},\n'
+        '  "summary": "Fetched the page.",\n'
+        '  "user_facing_answer": "Line one\\nsaid \\"hi\\" \\u00e9\\ud83d\\ude00 done"\n'
+        "}\n"
+        "```\n"
+        "Anything else? [TOOL_CALL: SmartScrapeAI, URL: https://scrape.it]"
+    )
+    EXPECTED_ANSWER = 'Line one\nsaid "hi" \u00e9\U0001F600 done'
+
+    def _feed_in_chunks(self, text, size):
+        parser = StreamingOutputParser()
+        events = []
+        for start in range(0, len(text), size):
+            events.extend(parser.feed(text[start:start + size]))
+        events.extend(parser.close())
+        return parser, events
+
+    def test_events_are_independent_of_chunking(self):
+        for size in (1, 2, 3, 5, 7, 16, len(self.SAMPLE_OUTPUT)):
+            with self.subTest(chunk_size=size):
+                parser, events = self._feed_in_chunks(self.SAMPLE_OUTPUT, size)
+                tool_calls = [e.payload for e in events if e.kind == OUTPUT_EVENT_TOOL_CALL]
+                self.assertEqual(tool_calls, [
+                    ToolCall("Browser Use", "https://example.com/a?b=1"),
+                    ToolCall("SmartScrapeAI", "https://scrape.it"),
+                ])
+                answer = "".join(e.payload for e in events if e.kind == OUTPUT_EVENT_ANSWER_DELTA)
+                self.assertEqual(answer, self.EXPECTED_ANSWER)
+                blocks = [e.payload for e in events if e.kind == OUTPUT_EVENT_JSON_BLOCK]
+                self.assertEqual(len(blocks), 1)
+                self.assertIsNone(blocks[0].error)
+                self.assertEqual(blocks[0].data["user_facing_answer"], self.EXPECTED_ANSWER)
+                self.assertEqual(parser.result().json_block, blocks[0])
+
+    def test_events_are_emitted_before_stream_ends(self):
+        parser = StreamingOutputParser()
+        first_half = self.SAMPLE_OUTPUT[:self.SAMPLE_OUTPUT.index("Anything else?")]
+        kinds = [e.kind for e in parser.feed(first_half)]
+        self.assertEqual(kinds[0], OUTPUT_EVENT_TOOL_CALL)
+        self.assertIn(OUTPUT_EVENT_ANSWER_DELTA, kinds)
+        self.assertEqual(kinds[-1], OUTPUT_EVENT_JSON_BLOCK)
+
+    def test_unterminated_block_is_not_reported(self):
+        result = parse_model_output('```json\n{"user_facing_answer": "partial')
+        self.assertIsNone(result.json_block)
+
+    def test_invalid_json_block_reports_error(self):
+        result = parse_model_output("```json\n{not json}\n```")
+        self.assertEqual(result.json_block.json_string, "{not json}")
+        self.assertIsNone(result.json_block.data)
+        self.assertIsNotNone(result.json_block.error)
+
+    def test_multiline_bracket_is_not_a_tool_call(self):
+        result = parse_model_output("[TOOL_CALL: Browser Use\nnot closed] [TOOL_CALL: Browser Use]")
+        self.assertEqual(result.tool_calls, [ToolCall("Browser Use", None)])
+
+    def test_large_output_is_parsed(self):
+        filler = "lorem ipsum [not a tool] ``` json " * 60000
+        text = filler + self.SAMPLE_OUTPUT + filler
+        parser, events = self._feed_in_chunks(text, 4096)
+        self.assertEqual(len(parser.tool_calls), 2)
+        self.assertEqual(parser.json_block.data["user_facing_answer"], self.EXPECTED_ANSWER)
+
+
 if __name__ == '__main__':
     unittest.main()
 # Corrected assertion in test_generate_system_prompt_no_tools, _with_browser, etc.
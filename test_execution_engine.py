@@ -0,0 +1,154 @@
+import unittest
+import threading
+import time
+from concurrent.futures import Future
+from core_logic import stream_agent_request, _wait_for_results
+from execution_engine import ExecutionEngine, TaskContext, TaskEvent, EVENT_STARTED, EVENT_RESULT, EVENT_ERROR, EVENT_CANCELLED, TERMINAL_EVENTS
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+
+
+def _wait_for_terminal_events(engine, count, timeout=5):
+    # Collects events until `count` tasks have finished
+    events = []
+    deadline = time.monotonic() + timeout
+    while sum(1 for e in events if e.kind in TERMINAL_EVENTS) < count:
+        if time.monotonic() > deadline:
+            raise AssertionError(f"Timed out waiting for events, got: {events}")
+        events.extend(engine.drain_events())
+        time.sleep(0.005)
+    return events
+
+
+class TestExecutionEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = ExecutionEngine(max_concurrent=2)
+
+    def tearDown(self):
+        self.engine.shutdown(wait=True)
+
+    def test_result_and_partial_events_are_queued_in_order(self):
+        def job(ctx, words):
+            for word in words:
+                ctx.emit("token", word)
+            return " ".join(words)
+
+        handle = self.engine.submit(job, ["a", "b", "c"])
+        events = _wait_for_terminal_events(self.engine, 1)
+        self.assertEqual([e.kind for e in events], [EVENT_STARTED, "token", "token", "token", EVENT_RESULT])
+        self.assertEqual(events[-1], TaskEvent(handle.task_id, EVENT_RESULT, "a b c"))
+
+    def test_exceptions_become_error_events(self):
+        def job(ctx):
+            raise ValueError("boom")
+
+        self.engine.submit(job)
+        events = _wait_for_terminal_events(self.engine, 1)
+        self.assertEqual(events[-1].kind, EVENT_ERROR)
+        self.assertIsInstance(events[-1].payload, ValueError)
+
+    def test_concurrency_is_limited(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def job(ctx):
+            with lock:
+                running.append(ctx.task_id)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(ctx.task_id)
+
+        for _ in range(6):
+            self.engine.submit(job)
+        _wait_for_terminal_events(self.engine, 6)
+        self.assertEqual(max(peak), 2)
+
+    def test_cancel_running_task_closes_stream(self):
+        started = threading.Event()
+        closed = threading.Event()
+
+        def tokens():
+            try:
+                while True:
+                    yield "tok"
+                    started.set()
+                    time.sleep(0.005)
+            finally:
+                closed.set()
+
+        def job(ctx):
+            return "".join(ctx.iterate(tokens()))
+
+        handle = self.engine.submit(job)
+        self.assertTrue(started.wait(5))
+        handle.cancel()
+        events = _wait_for_terminal_events(self.engine, 1)
+        self.assertEqual(events[-1].kind, EVENT_CANCELLED)
+        self.assertTrue(closed.is_set())
+
+    def test_cancel_callbacks_run_once_and_can_be_removed(self):
+        ctx = TaskContext(1, None)
+        calls = []
+        ctx.add_cancel_callback(lambda: calls.append("kept"))
+        remove = ctx.add_cancel_callback(lambda: calls.append("removed"))
+        remove()
+        ctx.cancel()
+        ctx.cancel()
+        ctx.add_cancel_callback(lambda: calls.append("late"))
+        self.assertEqual(calls, ["kept", "late"])
+
+    def test_cancel_aborts_wait_for_first_token(self):
+        with MockOllamaServer(MockOllamaConfig(ttft=5, seed=1)) as server:
+            def job(ctx):
+                events = stream_agent_request(server.url, "mock:latest", "hello", cancel=ctx)
+                return list(ctx.iterate(events))
+
+            handle = self.engine.submit(job)
+            time.sleep(0.3)
+            cancelled_at = time.monotonic()
+            handle.cancel()
+            events = _wait_for_terminal_events(self.engine, 1)
+            self.assertEqual(events[-1].kind, EVENT_CANCELLED)
+            self.assertLess(time.monotonic() - cancelled_at, 1)
+
+    def test_cancel_aborts_wait_for_tool_results(self):
+        never_done = Future()
+
+        def job(ctx):
+            return _wait_for_results([never_done], cancel=ctx)
+
+        handle = self.engine.submit(job)
+        time.sleep(0.05)
+        handle.cancel()
+        events = _wait_for_terminal_events(self.engine, 1)
+        self.assertEqual(events[-1].kind, EVENT_CANCELLED)
+        self.assertTrue(never_done.cancelled())
+
+    def test_cancel_queued_task_never_runs(self):
+        release = threading.Event()
+        ran = []
+
+        def blocker(ctx):
+            release.wait(5)
+
+        def job(ctx):
+            ran.append(ctx.task_id)
+
+        self.engine.submit(blocker)
+        self.engine.submit(blocker)
+        queued = self.engine.submit(job)
+        self.assertTrue(self.engine.cancel(queued.task_id))
+        release.set()
+        events = _wait_for_terminal_events(self.engine, 3)
+        self.assertEqual(ran, [])
+        self.assertIn(TaskEvent(queued.task_id, EVENT_CANCELLED, None), events)
+        deadline = time.monotonic() + 5
+        while self.engine.active_count and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(self.engine.active_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
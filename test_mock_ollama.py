@@ -0,0 +1,98 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+from benchmark import compare_results, main as benchmark_main, percentile, run_benchmarks
+from core_logic import execute_ollama_request, parse_model_output
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+from ollama_client import OllamaClient, OllamaError, iter_text
+
+
+class TestMockOllamaServer(unittest.TestCase):
+
+    def _server(self, **config):
+        server = MockOllamaServer(MockOllamaConfig(seed=1, **config)).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_streams_parseable_agent_response(self):
+        server = self._server(ttft=0, tokens_per_second=0)
+        response = execute_ollama_request(server.url, "mock:latest", "sys", "What is this?")
+        parsed = parse_model_output(response)
+        self.assertTrue(parsed.json_block.data["user_facing_answer"].startswith("Mock answer to: What is this?"))
+
+    def test_ttft_and_token_rate_are_applied(self):
+        server = self._server(ttft=0.1, tokens_per_second=100, response_text="a b c d e f g h i j k")
+        client = OllamaClient(server.url)
+        self.addCleanup(client.close)
+        started = time.perf_counter()
+        tokens = iter(iter_text(client.generate("mock:latest", "hi")))
+        next(tokens)
+        ttft = time.perf_counter() - started
+        rest = list(tokens)
+        total = time.perf_counter() - started
+        self.assertGreaterEqual(ttft, 0.1)
+        self.assertEqual(len(rest), 10)
+        self.assertGreaterEqual(total, 0.1 + 10 * 0.01)
+
+    def test_catalog_endpoints(self):
+        server = self._server(models=["a:1", "b:2"])
+        client = OllamaClient(server.url)
+        self.addCleanup(client.close)
+        self.assertEqual([model["name"] for model in client.list_models()], ["a:1", "b:2"])
+        self.assertEqual([model["name"] for model in client.get_json("/api/ps")["models"]], ["a:1", "b:2"])
+
+    def test_failure_injection(self):
+        server = self._server(ttft=0, failure_rate=1.0)
+        with self.assertRaises(OllamaError) as caught:
+            execute_ollama_request(server.url, "mock:latest", "sys", "hi")
+        self.assertEqual(caught.exception.status, 500)
+        server.config.failure_rate = 0
+        server.config.drop_rate = 1.0
+        with self.assertRaises(OllamaError):
+            execute_ollama_request(server.url, "mock:latest", "sys", "hi")
+        self.assertEqual(server.counters, {"requests": 2, "failures": 1, "drops": 1, "connections": 1, "catalog_requests": 0})
+
+    def test_scripted_responses_and_recorded_requests(self):
+        server = self._server(ttft=0, tokens_per_second=0, response_text="fallback", responses=["first", "second"])
+        self.assertEqual([execute_ollama_request(server.url, "mock:latest", "sys", prompt) for prompt in ("a", "b", "c")],
+                         ["first", "second", "fallback"])
+        self.assertEqual([payload["messages"][-1]["content"] for payload in server.payloads("/api/chat")], ["a", "b", "c"])
+        server.config.stream_error = "out of memory"
+        with self.assertRaises(OllamaError) as caught:
+            execute_ollama_request(server.url, "mock:latest", "sys", "d")
+        self.assertEqual(caught.exception.status, 200)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_percentile_interpolates(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2.5)
+        self.assertEqual(percentile([5], 0.99), 5)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_run_benchmarks_reports_every_level(self):
+        results = run_benchmarks(concurrency_levels=[1, 3], requests_per_level=3,
+                                 mock_config=MockOllamaConfig(ttft=0.01, tokens_per_second=0, answer_tokens=8))
+        self.assertEqual([level["concurrency"] for level in results["levels"]], [1, 3])
+        for level in results["levels"]:
+            self.assertEqual(level["errors"], 0)
+            self.assertEqual(level["latency_ms"]["count"], 3)
+            self.assertGreaterEqual(level["ttft_ms"]["p50"], 10)
+        self.assertGreater(results["parser"]["per_token_us"], 0)
+        self.assertEqual([dispatch["errors"] for dispatch in results["tool_dispatch"]], [0, 0])
+        self.assertTrue(any("c=1 latency_ms p50" in line for line in compare_results(results, results)))
+
+    def test_cli_writes_result_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            benchmark_main(["--concurrency", "2", "--requests", "2", "--ttft", "0", "--tps", "0", "--output", output])
+            with open(output, encoding="utf-8") as result_file:
+                results = json.load(result_file)
+        self.assertEqual(results["config"]["ollama_url"], "mock")
+        self.assertEqual(results["levels"][0]["requests"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
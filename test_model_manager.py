@@ -0,0 +1,111 @@
+import unittest
+from core_logic import execute_ollama_request
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+from model_manager import ModelManager, PINNED_KEEP_ALIVE, RELEASE_KEEP_ALIVE
+from server_pool import get_server_pool
+
+
+class TestModelManager(unittest.TestCase):
+
+    def setUp(self):
+        self.server = self._start_server()
+        self.url = self.server.url
+        self.manager = ModelManager(catalog_ttl=60, keep_alive="10m", max_pinned=1)
+
+    def _start_server(self):
+        server = MockOllamaServer(MockOllamaConfig(ttft=0, tokens_per_second=0, models=["llama3:latest", "qwen2:7b"])).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def tearDown(self):
+        self.manager.close()
+
+    def _generate_calls(self, server=None):
+        server = server or self.server
+        return [(payload["model"], payload["prompt"], payload["keep_alive"]) for payload in server.payloads("/api/generate")]
+
+    def test_catalog_is_cached_until_ttl_or_forced_refresh(self):
+        self.assertEqual(self.manager.list_models(self.url), ["llama3:latest", "qwen2:7b"])
+        self.manager.list_models(self.url)
+        self.assertEqual(self.server.counters["catalog_requests"], 1)
+        self.manager.list_models(self.url, force_refresh=True)
+        self.assertEqual(self.server.counters["catalog_requests"], 2)
+        self.manager.catalog_ttl = 0
+        self.manager.list_models(self.url)
+        self.assertEqual(self.server.counters["catalog_requests"], 3)
+
+    def test_warm_sends_empty_generate_with_keep_alive(self):
+        self.manager.warm(self.url, "llama3:latest").result(5)
+        self.assertEqual(self._generate_calls(), [("llama3:latest", "", "10m")])
+
+    def test_concurrent_warm_ups_share_one_request(self):
+        self.server.config.ttft = 0.1
+        futures = [self.manager.warm(self.url, "llama3:latest") for _ in range(5)]
+        for future in futures:
+            future.result(5)
+        self.assertEqual(len(self._generate_calls()), 1)
+
+    def test_pinning_policy_releases_oldest_pin(self):
+        self.manager.pin(self.url, "llama3:latest").result(5)
+        self.assertEqual(self.manager.keep_alive_for(self.url, "llama3:latest"), PINNED_KEEP_ALIVE)
+        self.manager.pin(self.url, "qwen2:7b").result(5)
+        for future in self.manager.pending_releases(self.url):
+            future.result(5)
+        self.assertEqual(self.manager.pinned(self.url), ["qwen2:7b"])
+        self.assertEqual(self.manager.keep_alive_for(self.url, "llama3:latest"), "10m")
+        self.manager.release(self.url, "qwen2:7b").result(5)
+        self.assertEqual(self.manager.pinned(self.url), [])
+        self.assertEqual(sorted(self._generate_calls(), key=str), sorted([
+            ("llama3:latest", "", PINNED_KEEP_ALIVE),
+            ("llama3:latest", "", RELEASE_KEEP_ALIVE),
+            ("qwen2:7b", "", PINNED_KEEP_ALIVE),
+            ("qwen2:7b", "", RELEASE_KEEP_ALIVE),
+        ], key=str))
+
+    def test_release_is_not_overtaken_by_the_pin_it_undoes(self):
+        self.server.config.ttft = 0.1
+        futures = [self.manager.pin(self.url, "llama3:latest"), self.manager.release(self.url, "llama3:latest")]
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self._generate_calls()[-1], ("llama3:latest", "", RELEASE_KEEP_ALIVE))
+
+        futures.append(self.manager.pin(self.url, "llama3:latest"))
+        futures.append(self.manager.release(self.url, "llama3:latest"))
+        futures.append(self.manager.pin(self.url, "llama3:latest"))
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self._generate_calls()[-1], ("llama3:latest", "", PINNED_KEEP_ALIVE))
+
+    def test_close_releases_pins(self):
+        self.manager.pin(self.url, "llama3:latest").result(5)
+        self.manager.close()
+        self.assertEqual(self._generate_calls(), [
+            ("llama3:latest", "", PINNED_KEEP_ALIVE),
+            ("llama3:latest", "", RELEASE_KEEP_ALIVE),
+        ])
+        self.assertEqual(self.manager.pinned(self.url), [])
+
+    def test_pool_release_goes_to_the_server_holding_the_pin(self):
+        other = self._start_server()
+        urls = [self.url, other.url]
+        pool = get_server_pool(urls)
+        self.addCleanup(pool.close)
+        pool_url = ",".join(urls)
+        self.manager.pin(pool_url, "llama3:latest").result(5)
+        holder, idle = (self.server, other) if self._generate_calls() else (other, self.server)
+        # Routing alone would now pick the idle server
+        with pool.lease(pool.server(urls[0] if holder is self.server else urls[1])):
+            self.manager.release(pool_url, "llama3:latest").result(5)
+        self.assertEqual(self._generate_calls(holder), [
+            ("llama3:latest", "", PINNED_KEEP_ALIVE),
+            ("llama3:latest", "", RELEASE_KEEP_ALIVE),
+        ])
+        self.assertEqual(self._generate_calls(idle), [])
+
+    def test_requests_carry_keep_alive(self):
+        execute_ollama_request(self.url, "llama3:latest", "sys", "hi", keep_alive=PINNED_KEEP_ALIVE)
+        self.assertEqual(self.server.payloads()[-1]["keep_alive"], PINNED_KEEP_ALIVE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import socket
+import time
+from mock_ollama import MockOllamaConfig, MockOllamaServer, split_tokens
+from ollama_client import OllamaClient, OllamaError, iter_text
+from core_logic import execute_ollama_request, stream_ollama_request
+
+TEXT = "Hello world, streamed in tokens"
+TOKENS = split_tokens(TEXT)
+
+
+class TestOllamaClient(unittest.TestCase):
+
+    def setUp(self):
+        config = MockOllamaConfig(ttft=0, tokens_per_second=0, models=["llama3:latest", "qwen2:7b", "llama3"], response_text=TEXT)
+        self.server = MockOllamaServer(config).start()
+        self.url = self.server.url
+        self.client = OllamaClient(self.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_chat_streams_tokens_in_order(self):
+        events = list(self.client.chat("llama3", [{"role": "user", "content": "hi"}]))
+        self.assertEqual(list(iter_text(events)), TOKENS)
+        self.assertTrue(events[-1]["done"])
+        self.assertEqual(self.server.payloads()[0]["messages"], [{"role": "user", "content": "hi"}])
+        self.assertTrue(self.server.payloads()[0]["stream"])
+
+    def test_generate_streams_tokens(self):
+        text = "".join(iter_text(self.client.generate("llama3", "hi", system="sys", keep_alive="5m")))
+        self.assertEqual(text, TEXT)
+        self.assertEqual(self.server.payloads("/api/generate")[0]["system"], "sys")
+        self.assertEqual(self.server.payloads("/api/generate")[0]["keep_alive"], "5m")
+
+    def test_connection_is_reused_across_requests(self):
+        self.client.list_models()
+        list(self.client.chat("llama3", []))
+        list(self.client.generate("llama3", "hi"))
+        self.assertEqual(self.server.counters["connections"], 1)
+        self.assertEqual(self.client.connections_opened, 1)
+
+    def test_abandoned_stream_closes_connection(self):
+        events = self.client.chat("llama3", [])
+        next(events)
+        events.close()
+        list(self.client.chat("llama3", []))
+        self.assertEqual(self.client.connections_opened, 2)
+
+    def test_error_status_raises(self):
+        with self.assertRaises(OllamaError) as ctx:
+            list(self.client.chat("missing", []))
+        self.assertEqual(ctx.exception.status, 404)
+        self.assertIn("model 'missing' not found", str(ctx.exception))
+
+    def test_unreachable_server_raises(self):
+        self.server.stop()
+        client = OllamaClient(self.url, timeout=2)
+        with self.assertRaises(OllamaError):
+            client.list_models()
+
+    def test_catalog_requests_use_the_short_timeout(self):
+        silent = socket.socket()  # Accepts connections (backlog) but never answers
+        silent.bind(("127.0.0.1", 0))
+        silent.listen()
+        self.addCleanup(silent.close)
+        client = OllamaClient(f"http://127.0.0.1:{silent.getsockname()[1]}", catalog_timeout=0.2)
+        self.addCleanup(client.close)
+        started = time.monotonic()
+        with self.assertRaises(OllamaError):
+            client.list_models()
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_list_models(self):
+        names = [model["name"] for model in self.client.list_models()]
+        self.assertEqual(names, ["llama3:latest", "qwen2:7b", "llama3"])
+
+    def test_execute_ollama_request_drains_stream(self):
+        response = execute_ollama_request(self.url, "llama3", "sysprompt", "userprompt", "http://target.com", ["Browser Use"])
+        self.assertEqual(response, TEXT)
+        messages = self.server.payloads()[0]["messages"]
+        self.assertEqual(messages[0], {"role": "system", "content": "sysprompt"})
+        self.assertIn("userprompt", messages[1]["content"])
+        self.assertIn("http://target.com", messages[1]["content"])
+
+    def test_stream_ollama_request_yields_incrementally(self):
+        self.assertEqual(list(stream_ollama_request(self.url, "llama3", "s", "u")), TOKENS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import os
+import re
+import tempfile
+from output_view import OutputBuffer, OutputView
+
+
+class _FakeTextWidget:
+    # Implements the subset of tk.Text used by OutputView, with "line.column" and "+ N chars" indexes
+    def __init__(self):
+        self.content = ""
+        self.inserts = 0
+        self.state = "disabled"
+
+    def _offset(self, index: str) -> int:
+        match = re.fullmatch(r"(end|(\d+)\.0)(?: \+ (\d+) chars)?", index)
+        if match.group(1) == "end":
+            offset = len(self.content)
+        else:
+            offset = 0
+            for _ in range(int(match.group(2)) - 1):
+                offset = self.content.index("\n", offset) + 1
+        return min(len(self.content), offset + int(match.group(3) or 0))
+
+    def insert(self, index, text):
+        assert self.state == "normal"
+        offset = self._offset(index)
+        self.content = self.content[:offset] + text + self.content[offset:]
+        self.inserts += 1
+
+    def delete(self, start, end):
+        assert self.state == "normal"
+        self.content = self.content[:self._offset(start)] + self.content[self._offset(end):]
+
+    def config(self, state):
+        self.state = state
+
+    def yview(self):
+        return (0.0, 1.0)
+
+    def see(self, index):
+        pass
+
+
+class TestOutputBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spill_dir.cleanup)
+
+    def test_appends_are_coalesced_into_one_delta(self):
+        buffer = OutputBuffer(max_chars=100, spill_dir=self.spill_dir.name)
+        buffer.set_text("a")
+        buffer.append("b")
+        buffer.append("c")
+        delta = buffer.take_delta()
+        self.assertEqual((delta.reset, delta.header, delta.trim, delta.text), (True, None, 0, "abc"))
+        self.assertIsNone(buffer.take_delta())
+        buffer.append("d")
+        self.assertEqual(buffer.take_delta().text, "d")
+
+    def test_retained_text_is_capped_and_full_text_spilled(self):
+        buffer = OutputBuffer(max_chars=10, max_chars_per_frame=10, spill_dir=self.spill_dir.name)
+        buffer.set_text("0123456")
+        self.assertEqual(buffer.take_delta().text, "0123456")
+        self.assertIsNone(buffer.transcript_path)
+        buffer.append("789abc")
+        delta = buffer.take_delta()
+        self.assertEqual((delta.trim, delta.text), (3, "789abc"))
+        self.assertIn(buffer.transcript_path, delta.header)
+        self.assertEqual(buffer.text(), "0123456789abc")
+        path = buffer.transcript_path
+        buffer.set_text("new")
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(buffer.text(), "new")
+
+    def test_huge_append_is_inserted_over_several_frames(self):
+        buffer = OutputBuffer(max_chars=1000, max_chars_per_frame=300, spill_dir=self.spill_dir.name)
+        buffer.set_text("x" * 1_000_000 + "tail")
+        deltas = []
+        while buffer.has_pending:
+            deltas.append(buffer.take_delta())
+        self.assertEqual([len(delta.text) for delta in deltas], [300, 300, 300, 100])
+        self.assertTrue(deltas[-1].text.endswith("tail"))
+        self.assertEqual(sum(delta.trim for delta in deltas), 0)
+        self.assertEqual(len(buffer.text()), 1_000_004)
+        buffer.close()
+
+
+class TestOutputView(unittest.TestCase):
+
+    def test_widget_holds_header_and_bounded_tail(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            widget = _FakeTextWidget()
+            view = OutputView(widget, max_chars=50, max_chars_per_frame=20, spill_dir=spill_dir)
+            view.set_text("Request submitted...")
+            view.flush()
+            self.assertEqual(widget.content, "Request submitted...")
+            view.set_text("")
+            full = "".join(f"line {i}\n" for i in range(40))
+            for start in range(0, len(full), 7):
+                view.append(full[start:start + 7])
+                if start % 21 == 0:
+                    view.flush()
+            while view.flush():
+                pass
+            header, retained = widget.content.split("\n", 1)
+            self.assertIn(view.buffer.transcript_path, header)
+            self.assertEqual(retained, full[-50:])
+            self.assertEqual(view.text(), full)
+            self.assertEqual(widget.state, "disabled")
+            view.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import unittest
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from core_logic import ToolCall
+from page_cache import PageCache, normalize_url
+from tool_executor import ToolExecutor, HttpPageFetcher
+
+
+class _ValidatingHandler(BaseHTTPRequestHandler):
+    # Serves server.pages[path] with an ETag derived from its version and honours If-None-Match
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.server.fail_conditional and self.headers.get("If-None-Match"):
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.pages[self.path].encode()
+        etag = f'"v{hash(body) & 0xffff}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _BrowserFetcher:
+    # Stands in for the Playwright pool: not an HttpPageFetcher, so the cache revalidates on its own
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.fetches = 0
+
+    def fetch(self, url, cancel=None):
+        self.fetches += 1
+        return self.fetcher.fetch(url)
+
+
+class TestPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _ValidatingHandler)
+        self.server.requests = []
+        self.server.fail_conditional = False
+        self.server.pages = {
+            "/a": "<html><head><title>A</title></head><body><p>Alpha page</p></body></html>",
+            "/b": "<html><body><p>" + "b" * 2000 + "</p></body></html>",
+            "/c": "<html><body><p>" + "c" * 2000 + "</p></body></html>",
+        }
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.fetcher = HttpPageFetcher(timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def _cache(self, **kwargs):
+        cache = PageCache(self.temp_dir.name, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url("HTTP://Example.COM:80?b=2&a=1#frag"), "http://example.com/?a=1&b=2")
+        self.assertEqual(normalize_url("https://example.com:8443/x"), "https://example.com:8443/x")
+        self.assertEqual(PageCache.cache_key("http://example.com"), PageCache.cache_key("http://EXAMPLE.com/#top"))
+
+    def test_fresh_entry_is_served_without_network(self):
+        cache = self._cache(max_age=60)
+        first = cache.get_page(f"{self.base_url}/a", self.fetcher)
+        second = cache.get_page(f"{self.base_url}/a#section", self.fetcher)
+        self.assertEqual(first.html, second.html)
+        self.assertEqual(len(self.server.requests), 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+        self.assertEqual(stats["bytes_served"], len(first.html.encode()))
+
+    def test_stale_entry_is_revalidated_with_etag(self):
+        cache = self._cache(max_age=0)
+        page = cache.get_page(f"{self.base_url}/a", self.fetcher)
+        revalidated = cache.get_page(f"{self.base_url}/a", self.fetcher)
+        self.assertEqual(revalidated.html, page.html)
+        self.assertEqual(self.server.requests[1], ("/a", page.headers["ETag"]))
+        self.assertEqual(cache.stats()["revalidations"], 1)
+
+    def test_changed_page_replaces_body_and_extracts(self):
+        cache = self._cache(max_age=0)
+        url = f"{self.base_url}/a"
+        cache.get_page(url, self.fetcher)
+        cache.put_extract(url, "Browser Use", "Alpha page", None)
+        self.assertEqual(cache.get_extract(url, "Browser Use"), ("Alpha page", None))
+        self.server.pages["/a"] = "<html><body><p>Changed</p></body></html>"
+        self.assertIn("Changed", cache.get_page(url, self.fetcher).html)
+        self.assertIsNone(cache.get_extract(url, "Browser Use"))
+
+    def test_browser_fetcher_renders_only_changed_pages(self):
+        cache = self._cache(max_age=0)
+        browser = _BrowserFetcher(self.fetcher)
+        url = f"{self.base_url}/a"
+        cache.get_page(url, browser)
+        cache.get_page(url, browser)
+        self.assertEqual(browser.fetches, 1)
+        self.assertEqual(cache.stats()["revalidations"], 1)
+        self.server.pages["/a"] = "<html><body><p>Changed</p></body></html>"
+        self.assertIn("Changed", cache.get_page(url, browser).html)
+        self.assertEqual(browser.fetches, 2)
+
+    def test_failed_revalidation_falls_through_to_browser(self):
+        cache = self._cache(max_age=0)
+        browser = _BrowserFetcher(self.fetcher)
+        url = f"{self.base_url}/a"
+        cache.get_page(url, browser)
+        self.server.fail_conditional = True
+        self.assertIn("Alpha page", cache.get_page(url, browser).html)
+        self.assertEqual(browser.fetches, 2)
+
+    def test_lru_eviction_respects_size_cap(self):
+        cache = self._cache(max_bytes=4100, max_age=60)
+        cache.get_page(f"{self.base_url}/b", self.fetcher)
+        cache.get_page(f"{self.base_url}/c", self.fetcher)
+        cache.get_page(f"{self.base_url}/b", self.fetcher) # /c is now least recently used
+        cache.get_page(f"{self.base_url}/a", self.fetcher)
+        stats = cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertLessEqual(stats["total_bytes"], 4100)
+        cache.get_page(f"{self.base_url}/b", self.fetcher)
+        cache.get_page(f"{self.base_url}/c", self.fetcher)
+        self.assertEqual([path for path, _ in self.server.requests], ["/b", "/c", "/a", "/c"])
+
+    def test_cache_persists_across_instances(self):
+        self._cache(max_age=60).get_page(f"{self.base_url}/a", self.fetcher)
+        reopened = self._cache(max_age=60)
+        reopened.get_page(f"{self.base_url}/a", self.fetcher)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_tool_executor_reuses_cached_extracts(self):
+        executor = ToolExecutor(fetcher=self.fetcher, cache=self._cache(max_age=60))
+        self.addCleanup(executor.close)
+        first, = executor.run([ToolCall("SmartScrapeAI", f"{self.base_url}/a")])
+        second, = executor.run([ToolCall("SmartScrapeAI", f"{self.base_url}/a")])
+        self.assertEqual((first.text, first.data), (second.text, second.data))
+        self.assertEqual(second.data["title"], "A")
+        stats = executor.cache.stats()
+        self.assertEqual((stats["extract_misses"], stats["extract_hits"]), (1, 1))
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from core_logic import ToolCall
+from prefetch import Prefetcher
+from tool_executor import PrefetchFuture
+
+
+class _RecordingExecutor:
+    # Hands out unresolved Futures so the test decides when a prefetch has run
+    def __init__(self):
+        self.prefetched = []
+
+    def prefetch(self, url, tools, allowed_tools=None):
+        self.prefetched.append((url, tools))
+        return {tool: PrefetchFuture() for tool in tools}
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = _RecordingExecutor()
+        self.prefetcher = Prefetcher(self.executor)
+
+    def test_only_enabled_tools_with_a_target_url_are_prefetched(self):
+        self.assertIsNone(self.prefetcher.start(None, ["Browser Use"]))
+        self.assertIsNone(self.prefetcher.start("https://example.com", []))
+        self.prefetcher.start("https://example.com", ["SmartScrapeAI", "ImaginaryTool", "Browser Use"])
+        self.assertEqual(self.executor.prefetched, [("https://example.com", ["SmartScrapeAI", "Browser Use"])])
+
+    def test_claims_match_normalized_urls(self):
+        prefetch = self.prefetcher.start("https://Example.com:443/?b=2&a=1", ["Browser Use"])
+        future = prefetch.claim(ToolCall("Browser Use", "https://example.com/?a=1&b=2#top"))
+        self.assertIsNotNone(future)
+        self.assertIs(prefetch.claim(ToolCall("Browser Use", "https://example.com/?a=1&b=2")), future)
+        self.assertIsNone(prefetch.claim(ToolCall("Browser Use", "https://example.com/other")))
+        self.assertIsNone(prefetch.claim(ToolCall("SmartScrapeAI", "https://example.com/?a=1&b=2")))
+        self.assertEqual(self.prefetcher.stats()["hits"], 1)
+
+    def test_release_cancels_unclaimed_prefetches(self):
+        prefetch = self.prefetcher.start("https://example.com", ["Browser Use", "SmartScrapeAI"])
+        claimed = prefetch.claim(ToolCall("Browser Use", "https://example.com"))
+        prefetch.release()
+        self.assertFalse(claimed.cancelled())
+        self.assertIsNone(prefetch.claim(ToolCall("SmartScrapeAI", "https://example.com")))
+        stats = self.prefetcher.stats()
+        self.assertEqual((stats["started"], stats["hits"], stats["wasted"], stats["cancelled"]), (2, 1, 1, 1))
+        self.assertEqual((stats["hit_rate"], stats["waste_rate"]), (0.5, 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+from core_logic import stream_agent_request, OutputEvent, OUTPUT_EVENT_TOKEN, OUTPUT_EVENT_TURN_DONE, OUTPUT_EVENT_ANSWER_DELTA
+from mock_ollama import MockOllamaServer, MockOllamaConfig
+from response_cache import ResponseCache, ResponseCacheError, cache_key
+
+ANSWER = 'Checking.\n```json\n{"tool_used": null, "summary": "s", "user_facing_answer": "Forty-two."}\n```'
+
+
+def _tokens(*texts):
+    for text in texts:
+        yield OutputEvent(OUTPUT_EVENT_TOKEN, text)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.addCleanup(self.cache.close)
+
+    def test_key_covers_prompt_inputs(self):
+        base = cache_key("llama3", "system", "prompt", "https://example.com")
+        self.assertEqual(base, cache_key("llama3", "system", "prompt", "https://example.com", history=[]))
+        self.assertNotEqual(base, cache_key("llama3", "system", "prompt"))
+        self.assertNotEqual(base, cache_key("llama3", "other system", "prompt", "https://example.com"))
+        self.assertNotEqual(base, cache_key("llama3", "system", "prompt", "https://example.com", [{"role": "user", "content": "hi"}]))
+        with_tools = cache_key("llama3", "system", "prompt", "https://example.com", run_tools=True, tool_token_budget=2000)
+        self.assertNotEqual(base, with_tools)
+        self.assertNotEqual(with_tools, cache_key("llama3", "system", "prompt", "https://example.com", run_tools=True, tool_token_budget=500))
+        self.assertEqual(base, cache_key("llama3", "system", "prompt", "https://example.com", tool_token_budget=500))
+
+    def test_hit_replays_the_same_events(self):
+        config = MockOllamaConfig(tokens_per_second=100_000, ttft=0, response_text=ANSWER)
+        with MockOllamaServer(config) as server:
+            def run():
+                return list(stream_agent_request(server.url, "mock:latest", "What is the answer?", cache=self.cache))
+            live = run()
+            cached = run()
+            self.assertEqual(server.counters["requests"], 1)
+        self.assertEqual(cached, live)
+        self.assertEqual(cached[-1].kind, OUTPUT_EVENT_TURN_DONE)
+        self.assertEqual(cached[-1].payload[1].json_block.data["user_facing_answer"], "Forty-two.")
+        self.assertIn(OUTPUT_EVENT_ANSWER_DELTA, [event.kind for event in cached])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_concurrent_identical_requests_share_one_generation(self):
+        release = threading.Event()
+        calls = []
+
+        def produce(cancel):
+            calls.append(1)
+            yield from _tokens("Hello ")
+            release.wait(5)
+            yield from _tokens("world")
+            yield OutputEvent(OUTPUT_EVENT_TURN_DONE, ("Hello world", None))
+
+        results = [None, None]
+
+        def consume(index):
+            results[index] = [event.payload for event in self.cache.stream("key", "llama3", produce) if event.kind == OUTPUT_EVENT_TOKEN]
+
+        threads = [threading.Thread(target=consume, args=(index,)) for index in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["Hello ", "world"], ["Hello ", "world"]])
+        self.assertEqual(self.cache.stats()["shared"], 1)
+
+    def test_failures_are_shared_but_not_cached(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def produce(cancel):
+            yield from _tokens("partial")
+            started.set()
+            release.wait(5)
+            raise ConnectionError("server went away")
+
+        errors = []
+
+        def lead():
+            try:
+                list(self.cache.stream("key", "llama3", produce))
+            except ConnectionError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        follower = self.cache.stream("key", "llama3", produce)
+        self.assertEqual(next(follower).payload, "partial")
+        release.set()
+        with self.assertRaises(ResponseCacheError):
+            list(follower)
+        leader.join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_cancelled_request_leaves_the_shared_generation_running(self):
+        release = threading.Event()
+
+        def produce(cancel):
+            yield from _tokens("Hello ")
+            release.wait(5)
+            yield from _tokens("world")
+            yield OutputEvent(OUTPUT_EVENT_TURN_DONE, ("Hello world", None))
+
+        first = self.cache.stream("key", "llama3", produce)
+        self.assertEqual(next(first).payload, "Hello ")
+        second = self.cache.stream("key", "llama3", produce)
+        self.assertEqual(next(second).payload, "Hello ")
+        first.close()  # What TaskContext.iterate does on Cancel
+        release.set()
+        self.assertEqual([event.payload for event in second][-1], ("Hello world", None))
+        self.assertIsNotNone(self.cache.get("key"))
+
+    def test_generation_is_cancelled_when_no_request_follows_it(self):
+        cancelled = threading.Event()
+
+        def produce(cancel):
+            cancel.add_cancel_callback(cancelled.set)
+            yield from _tokens("Hello ")
+            cancelled.wait(5)
+
+        request = self.cache.stream("key", "llama3", produce)
+        next(request)
+        request.close()
+        self.assertTrue(cancelled.wait(5))
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_finished_generation_is_stored_before_its_flight_ends(self):
+        stored = []
+        cache = self.cache
+        original_put = cache.put
+
+        def put(key, model, records):
+            original_put(key, model, records)
+            stored.append(key in cache._flights)
+
+        cache.put = put
+        list(cache.stream("key", "llama3", lambda cancel: iter([*_tokens("x"), OutputEvent(OUTPUT_EVENT_TURN_DONE, ("x", None))])))
+        self.assertEqual(stored, [True])
+        events = list(cache.stream("key", "llama3", lambda cancel: self.fail("should be served from the cache")))
+        self.assertEqual(events[0], OutputEvent(OUTPUT_EVENT_TOKEN, "x"))
+
+    def test_entries_expire_and_are_evicted_by_size(self):
+        cache = ResponseCache(ttl=0.05, max_bytes=200)
+        self.addCleanup(cache.close)
+        cache.put("a", "llama3", [[OUTPUT_EVENT_TOKEN, "x" * 60]])
+        cache.put("b", "llama3", [[OUTPUT_EVENT_TOKEN, "y" * 60]])
+        cache.get("a")
+        cache.put("c", "llama3", [[OUTPUT_EVENT_TOKEN, "z" * 60]])
+        self.assertIsNone(cache.get("b"))  # Least recently used
+        self.assertIsNotNone(cache.get("a"))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("c"))
+
+    def test_sqlite_file_persists_entries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "responses.sqlite3")
+            cache = ResponseCache(path)
+            list(cache.stream("key", "llama3", lambda cancel: iter([*_tokens("cached"), OutputEvent(OUTPUT_EVENT_TURN_DONE, ("cached", None))])))
+            cache.close()
+            reopened = ResponseCache(path)
+            events = list(reopened.stream("key", "llama3", lambda cancel: self.fail("should be served from the file")))
+            reopened.close()
+        self.assertEqual(events[0], OutputEvent(OUTPUT_EVENT_TOKEN, "cached"))
+        self.assertEqual(events[-1].payload[0], "cached")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from core_logic import execute_ollama_request
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+from ollama_client import OllamaError, iter_text
+from server_pool import OllamaServerPool, parse_server_urls
+
+
+class TestOllamaServerPool(unittest.TestCase):
+
+    def setUp(self):
+        # Each server answers with its own name
+        self.servers = [
+            MockOllamaServer(MockOllamaConfig(ttft=0, tokens_per_second=0, models=models, loaded_models=loaded, response_text=name)).start()
+            for name, models, loaded in (("alpha", ["llama3", "qwen2"], []), ("beta", ["llama3", "mistral"], ["llama3"]))
+        ]
+        self.urls = [server.url for server in self.servers]
+        self.pool = OllamaServerPool(self.urls)
+        self.pool.refresh()
+
+    def tearDown(self):
+        self.pool.close()
+        for server in self.servers:
+            server.stop()
+
+    def _chat(self, model):
+        return "".join(iter_text(self.pool.chat(model, [{"role": "user", "content": "hi"}])))
+
+    def test_probe_records_installed_and_loaded_models(self):
+        alpha, beta = self.pool.snapshot()
+        self.assertTrue(alpha["healthy"] and beta["healthy"])
+        self.assertEqual(alpha["models"], ["llama3", "qwen2"])
+        self.assertEqual(beta["loaded"], ["llama3"])
+
+    def test_routes_to_server_with_model_resident(self):
+        self.assertEqual(self._chat("llama3"), "beta")
+        self.assertEqual(self._chat("qwen2"), "alpha")
+        self.assertEqual(self._chat("mistral"), "beta")
+
+    def test_least_loaded_server_wins_among_equals(self):
+        self.servers[0].config.loaded_models = ["llama3"]
+        self.pool.refresh()
+        alpha, beta = self.pool.servers
+        with self.pool.lease(alpha):
+            self.assertIs(self.pool.select("llama3"), beta)
+        with self.pool.lease(beta):
+            self.assertIs(self.pool.select("llama3"), alpha)
+
+    def test_fails_over_when_server_goes_down(self):
+        self.servers[1].stop()
+        self.assertEqual(self._chat("llama3"), "alpha")
+        self.assertFalse(self.pool.snapshot()[1]["healthy"])
+        self.assertEqual(self._chat("llama3"), "alpha")
+
+    def test_model_missing_on_preferred_server_tries_next(self):
+        self.servers[1].config.models = ["mistral"] # Stale probe data still says beta has llama3 loaded
+        self.assertEqual(self._chat("llama3"), "alpha")
+        beta = self.pool.snapshot()[1]
+        self.assertTrue(beta["healthy"])
+        self.assertNotIn("llama3", beta["models"])
+        self.assertNotIn("llama3", beta["loaded"])
+
+    def test_stream_error_tries_next_without_marking_server_failed(self):
+        self.servers[1].config.stream_error = "model requires more system memory"
+        self.assertEqual(self._chat("llama3"), "alpha")
+        self.assertTrue(self.pool.snapshot()[1]["healthy"])
+        self.servers[1].config.stream_error = None
+        self.assertEqual(self._chat("mistral"), "beta")
+
+    def test_no_server_with_model_raises(self):
+        with self.assertRaises(OllamaError):
+            self._chat("phi3")
+
+    def test_list_models_is_union_of_healthy_servers(self):
+        self.assertEqual([model["name"] for model in self.pool.list_models()], ["llama3", "mistral", "qwen2"])
+
+    def test_execute_ollama_request_accepts_server_list(self):
+        self.assertEqual(parse_server_urls(" a, b  c,"), ["a", "b", "c"])
+        response = execute_ollama_request(", ".join(self.urls), "qwen2", "sys", "hi")
+        self.assertEqual(response, "alpha")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import threading
+from unittest import mock
+from core_logic import build_chat_messages, build_user_content
+from execution_engine import TaskCancelled, TaskContext
+from session import ChatSession, SUMMARY_PREFIX, MAX_TURNS, MAX_TURN_CHARS
+
+
+class _RecordingBackend:
+    # Stands in for the Ollama client and records the messages of each chat request
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.requests = []
+
+    def chat(self, model, messages, **kwargs):
+        self.requests.append(messages)
+        yield {"message": {"role": "assistant", "content": self.reply}, "done": True}
+
+
+class TestChatSession(unittest.TestCase):
+
+    def setUp(self):
+        self.session = ChatSession("http://localhost:11434", "llama3", context_tokens=100_000)
+        self.addCleanup(self.session.close)
+
+    def _send(self, prompt: str, answer: str, target_url: str = None) -> list[dict]:
+        system_prompt = self.session.system_prompt(["Browser Use"])
+        messages = build_chat_messages(system_prompt, prompt, target_url, history=self.session.history())
+        self.session.record_turn(build_user_content(prompt, target_url), answer)
+        return messages
+
+    def test_follow_up_extends_the_previous_prompt(self):
+        first = self._send("Open the page", "Done.", target_url="https://example.com")
+        second = self._send("And then?", "Nothing else.")
+        self.assertEqual(second[:len(first)], first)
+        self.assertEqual(second[len(first)], {"role": "assistant", "content": "Done."})
+        self.assertEqual(second[-1], {"role": "user", "content": "And then?"})
+        self.assertIs(self.session.system_prompt(["Browser Use"]), first[0]["content"])
+
+    def test_turns_are_capped(self):
+        for i in range(MAX_TURNS + 5):
+            self.session.record_turn(f"question {i}", "x" * (MAX_TURN_CHARS + 10))
+        turns = self.session.turns
+        self.assertEqual(len(turns), MAX_TURNS)
+        self.assertEqual(turns[0].user, "question 5")
+        self.assertEqual(len(turns[-1].assistant), MAX_TURN_CHARS)
+
+    def test_old_turns_are_compacted_into_a_summary(self):
+        backend = _RecordingBackend("The user asked about pricing.")
+        session = ChatSession("http://localhost:11434", "llama3", context_tokens=1000, keep_recent_turns=1)
+        self.addCleanup(session.close)
+        with mock.patch("session.get_ollama_backend", return_value=backend):
+            for i in range(3):
+                session.record_turn(f"question {i} " + "word " * 100, f"answer {i}")
+            compaction = session.maybe_compact()
+            if compaction is not None:
+                compaction.result(timeout=5)
+        self.assertTrue(backend.requests)
+        self.assertIn("question 0", backend.requests[0][1]["content"])
+        history = session.history()
+        self.assertEqual(history[0], {"role": "system", "content": SUMMARY_PREFIX + "The user asked about pricing."})
+        self.assertLess(len(session.turns), 3)
+        self.assertEqual(history[-1], {"role": "assistant", "content": "answer 2"})
+
+    def test_compaction_measures_the_prompt_the_turns_were_sent_with(self):
+        session = ChatSession("http://localhost:11434", "llama3", keep_recent_turns=1)
+        self.addCleanup(session.close)
+        for i in range(2):
+            session.record_turn(f"question {i}", f"answer {i}", ["Browser Use", "SmartScrapeAI"])
+        with_tools = session.estimated_tokens(["Browser Use", "SmartScrapeAI"])
+        self.assertGreater(with_tools, session.estimated_tokens())
+        # Between the two estimates, so compaction only triggers if the tool prompt is counted
+        session.context_tokens = (with_tools + session.estimated_tokens()) / 2 / session.compact_ratio
+        with mock.patch.object(session, "_compact") as compact:
+            self.assertIsNotNone(session.maybe_compact())
+            session._compaction.result(timeout=5)
+        compact.assert_called_once()
+
+    def test_requests_take_turns_in_submission_order(self):
+        first, second = self.session.begin_request(), self.session.begin_request()
+        self.assertEqual(self.session.open_requests(), 2)
+        started = threading.Event()
+
+        def follow_up():
+            self.session.wait_for_turn(second)
+            started.set()
+
+        thread = threading.Thread(target=follow_up)
+        thread.start()
+        self.session.wait_for_turn(first)
+        self.assertFalse(started.wait(0.1))
+        self.session.end_request(first)
+        self.assertTrue(started.wait(5))
+        thread.join(5)
+        self.session.end_request(second)
+        self.assertEqual(self.session.open_requests(), 0)
+
+    def test_cancel_stops_waiting_for_a_turn(self):
+        self.session.begin_request()
+        queued = self.session.begin_request()
+        ctx = TaskContext(1, None)
+        threading.Timer(0.05, ctx.cancel).start()
+        with self.assertRaises(TaskCancelled):
+            self.session.wait_for_turn(queued, ctx)
+        self.session.end_request(queued)
+        self.assertEqual(self.session.open_requests(), 1)
+
+    def test_reset_clears_history(self):
+        self._send("Hello", "Hi")
+        self.session.reset()
+        self.assertEqual(self.session.history(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
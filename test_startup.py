@@ -0,0 +1,50 @@
+import unittest
+import subprocess
+import sys
+import tool_registry
+from benchmark import bench_import_time, HEADLESS_MODULES, STARTUP_BUDGET_MS
+
+# Wall-clock import times vary with the machine and its load; the budget itself is tracked by
+# the benchmark report, so the tests only catch gross regressions. What an import loads is exact.
+STARTUP_TEST_MARGIN = 5
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_headless_modules_do_not_load_gui_or_browser(self):
+        for entry in bench_import_time(HEADLESS_MODULES, runs=3):
+            with self.subTest(module=entry["module"]):
+                self.assertEqual(entry["unwanted_modules"], [])
+                self.assertLess(entry["import_ms"], STARTUP_BUDGET_MS * STARTUP_TEST_MARGIN)
+
+    def test_building_prompts_does_not_load_tool_backends(self):
+        probe = (
+            "import sys, core_logic\n"
+            "core_logic.generate_system_prompt(['Browser Use', 'SmartScrapeAI'])\n"
+            "core_logic.parse_model_output('[TOOL_CALL: Browser Use, URL: https://example.com]')\n"
+            "print(' '.join(name for name in ('tool_executor', 'playwright', 'sqlite3', 'ollama_client', 'http.client', 'content_distiller') if name in sys.modules))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "")
+
+
+class TestToolRegistry(unittest.TestCase):
+
+    def test_builtin_tools_are_registered_in_order(self):
+        self.assertEqual(tool_registry.tool_names()[:2], ["Browser Use", "SmartScrapeAI"])
+        self.assertEqual(tool_registry.get_tool("Browser Use").usage, "[TOOL_CALL: Browser Use, URL: <url_to_visit>]")
+        self.assertEqual([tool.name for tool in tool_registry.known_tools(["SmartScrapeAI", "ImaginaryTool"])], ["SmartScrapeAI"])
+
+    def test_handlers_are_imported_on_first_use(self):
+        tool_registry.register_tool("Echo", "Echoes the page.", "echoes a page", "json:dumps")
+        self.addCleanup(tool_registry._tools.pop, "Echo")
+        self.addCleanup(tool_registry._handlers.pop, "Echo", None)
+        import json
+        self.assertIs(tool_registry.load_handler("Echo"), json.dumps)
+        self.assertIn("Echo", tool_registry.tool_names())
+        with self.assertRaises(KeyError):
+            tool_registry.load_handler("ImaginaryTool")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import json
+from content_distiller import estimate_tokens
+from core_logic import (
+    StructuredOutputParser, format_tool_results, generate_system_prompt,
+    OUTPUT_EVENT_ANSWER_DELTA, OUTPUT_EVENT_TOOL_CALL, OUTPUT_EVENT_JSON_BLOCK,
+)
+from structured_output import compile_validator, output_schema, generate_structured_system_prompt, response_validator
+from tool_executor import ToolResult
+
+TOOLS = ["Browser Use", "SmartScrapeAI"]
+
+
+def _parse(text: str, chunk_size: int = 5, enabled_tools=TOOLS):
+    parser = StructuredOutputParser(enabled_tools)
+    events = []
+    for start in range(0, len(text), chunk_size):
+        events.extend(parser.feed(text[start:start + chunk_size]))
+    events.extend(parser.close())
+    return events, parser.result()
+
+
+class TestValidator(unittest.TestCase):
+
+    def test_valid_response_has_no_errors(self):
+        validate = compile_validator(output_schema(TOOLS))
+        data = {"tool_used": None, "summary": "", "extracted_data": {"price": 42}, "user_facing_answer": "Hi"}
+        self.assertEqual(validate(data), [])
+
+    def test_errors_name_the_offending_fields(self):
+        validate = compile_validator(output_schema(["Browser Use"]))
+        errors = validate({"tool_used": "SmartScrapeAI", "tool_input": {"url": 5}, "summary": []})
+        self.assertEqual(errors, [
+            "$: missing 'user_facing_answer'",
+            '$.tool_used: "SmartScrapeAI" is not one of ["Browser Use", null]',
+            "$.tool_input.url: expected string",
+            "$.summary: expected string",
+        ])
+        self.assertEqual(validate([]), ["$: expected object"])
+
+    def test_validators_are_compiled_once_per_tool_selection(self):
+        self.assertIs(response_validator(("Browser Use",)), response_validator(("Browser Use",)))
+
+    def test_structured_prompt_is_shorter(self):
+        for tools in ([], TOOLS):
+            self.assertLess(estimate_tokens(generate_structured_system_prompt(tools)) * 2, estimate_tokens(generate_system_prompt(tools)))
+
+    def test_follow_up_asks_for_the_json_object(self):
+        results = [ToolResult("Browser Use", "https://example.com", True, "Page text.", None, None, 0.1)]
+        structured = format_tool_results(results, "What is on the page?", structured=True)
+        self.assertIn("user_facing_answer", structured)
+        self.assertNotIn("JSON block", structured)
+        self.assertIn("JSON block", format_tool_results(results, "What is on the page?"))
+
+
+class TestStructuredOutputParser(unittest.TestCase):
+
+    def test_answer_streams_and_block_is_reported(self):
+        data = {"tool_used": None, "summary": "s", "user_facing_answer": "Line one\nline \"two\""}
+        events, result = _parse(json.dumps(data))
+        answer = "".join(e.payload for e in events if e.kind == OUTPUT_EVENT_ANSWER_DELTA)
+        self.assertEqual(answer, data["user_facing_answer"])
+        self.assertEqual(events[-1].kind, OUTPUT_EVENT_JSON_BLOCK)
+        self.assertEqual(result.json_block.data, data)
+        self.assertEqual(result.tool_calls, [])
+
+    def test_tool_request_without_answer_is_a_tool_call(self):
+        data = {"tool_used": "Browser Use", "tool_input": {"url": "https://example.com"}, "summary": "", "user_facing_answer": ""}
+        events, result = _parse(json.dumps(data))
+        self.assertEqual([e.kind for e in events], [OUTPUT_EVENT_TOOL_CALL, OUTPUT_EVENT_JSON_BLOCK])
+        self.assertEqual(result.tool_calls[0], ("Browser Use", "https://example.com"))
+
+    def test_invalid_output_reports_error(self):
+        _, result = _parse('{"tool_used": null, "summary": "s"')
+        self.assertIsNone(result.json_block.data)
+        self.assertIsNotNone(result.json_block.error)
+        _, result = _parse('{"tool_used": "Unknown", "summary": "s", "user_facing_answer": "x"}')
+        self.assertIsNone(result.json_block.data)
+        self.assertIn("tool_used", result.json_block.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import unittest
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from core_logic import ToolCall, build_chat_messages, stream_agent_request, MAX_TOOL_ROUNDS, OUTPUT_EVENT_TOOL_RESULT, OUTPUT_EVENT_FOLLOW_UP, OUTPUT_EVENT_TURN_DONE
+from tool_executor import ToolExecutor, HttpPageFetcher, PlaywrightBrowserPool
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+from prefetch import Prefetcher
+from session import ChatSession
+
+FIXTURE_PAGE = """<html><head><title>Fixture Page</title>
+<meta name="description" content="A page for tests.">
+<style>body { color: red; }</style><script>var hidden = "not text";</script></head>
+<body><h1>Main Heading</h1><p>First paragraph with <a href="/other">a link</a>.</p>
+<h2>Second Heading</h2><p>Price: 42 EUR</p></body></html>"""
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlsplit(self.path)
+        if parsed.path == "/missing":
+            self._send(404, b"not found", "text/plain")
+            return
+        delay = float(parse_qs(parsed.query).get("delay", ["0"])[0])
+        with self.server.lock:
+            self.server.fetches += 1
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        time.sleep(delay)
+        with self.server.lock:
+            self.server.active -= 1
+        self._send(200, FIXTURE_PAGE.encode(), "text/html; charset=utf-8")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class TestToolExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.base_url = _start_server(_FixtureHandler)
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.peak = 0
+        self.server.fetches = 0
+        self.executor = ToolExecutor(fetcher=HttpPageFetcher(timeout=5), max_workers=8, per_host_limit=2)
+
+    def tearDown(self):
+        self.executor.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_browser_use_returns_page_text(self):
+        result, = self.executor.run([ToolCall("Browser Use", f"{self.base_url}/page")])
+        self.assertTrue(result.ok, result.error)
+        self.assertIn("Fixture Page", result.text)
+        self.assertIn("First paragraph with a link.", result.text)
+        self.assertNotIn("not text", result.text)
+        self.assertNotIn("color: red", result.text)
+
+    def test_smart_scrape_returns_structured_data(self):
+        result, = self.executor.run([ToolCall("SmartScrapeAI", f"{self.base_url}/page")])
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(result.data["title"], "Fixture Page")
+        self.assertEqual(result.data["description"], "A page for tests.")
+        self.assertEqual(result.data["headings"], ["Main Heading", "Second Heading"])
+        self.assertEqual(result.data["links"], [{"text": "a link", "href": f"{self.base_url}/other"}])
+
+    def test_calls_run_concurrently_within_per_host_limit(self):
+        calls = [ToolCall("Browser Use", f"{self.base_url}/page?delay=0.2&n={i}") for i in range(4)]
+        started = time.perf_counter()
+        results = self.executor.run(calls)
+        elapsed = time.perf_counter() - started
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(self.server.peak, 2)
+        self.assertLess(elapsed, 0.7) # Two waves of two parallel fetches, not four sequential ones
+
+    def test_failures_are_reported_in_results(self):
+        results = self.executor.run([
+            ToolCall("Browser Use", f"{self.base_url}/missing"),
+            ToolCall("Browser Use", "<url_to_visit>"),
+            ToolCall("ImaginaryTool", f"{self.base_url}/page"),
+            ToolCall("SmartScrapeAI", f"{self.base_url}/page"),
+        ], allowed_tools=["Browser Use"])
+        self.assertEqual([result.ok for result in results], [False, False, False, False])
+        self.assertIn("404", results[0].error)
+        self.assertIn("Invalid URL", results[1].error)
+        self.assertIn("Unknown tool", results[2].error)
+        self.assertIn("not enabled", results[3].error)
+
+    def test_aborted_prefetch_stops_before_its_next_step(self):
+        futures = self.executor.prefetch(f"{self.base_url}/page?delay=0.3", ["Browser Use", "SmartScrapeAI"])
+        time.sleep(0.1)
+        self.assertTrue(all(future.abort() for future in futures.values()))
+        result = futures["Browser Use"].result(5)
+        self.assertFalse(result.ok)
+        self.assertIn("Cancelled", result.error)
+        self.assertTrue(futures["SmartScrapeAI"].cancelled())
+        self.assertEqual(self.server.fetches, 1)
+
+    def test_closing_the_executor_settles_queued_prefetches(self):
+        executor = ToolExecutor(fetcher=HttpPageFetcher(timeout=5), max_workers=1)
+        executor.submit(ToolCall("Browser Use", f"{self.base_url}/page?delay=0.2"))
+        futures = executor.prefetch(f"{self.base_url}/page", ["Browser Use"])
+        executor.close()
+        self.assertTrue(futures["Browser Use"].cancelled())
+
+    def test_browser_that_cannot_start_fails_the_tool_call_only(self):
+        pool = PlaywrightBrowserPool()
+
+        async def launch():
+            raise RuntimeError("Executable doesn't exist at /ms-playwright/chromium")
+
+        pool._launch = launch
+        executor = ToolExecutor(fetcher=pool)
+        self.addCleanup(executor.close)
+        result, = executor.run([ToolCall("Browser Use", f"{self.base_url}/page")])
+        self.assertFalse(result.ok)
+        self.assertIn("playwright install chromium", result.error)
+        self.assertIn("Executable doesn't exist", result.error)
+
+
+class TestAgentToolLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.pages, self.pages_url = _start_server(_FixtureHandler)
+        self.pages.lock = threading.Lock()
+        self.pages.active = 0
+        self.pages.peak = 0
+        self.pages.fetches = 0
+        # Answers each chat request with the next of self.ollama.config.responses
+        self.ollama = MockOllamaServer(MockOllamaConfig(ttft=0, tokens_per_second=0, models=["llama3"])).start()
+        self.ollama_url = self.ollama.url
+        self.executor = ToolExecutor(fetcher=HttpPageFetcher(timeout=5))
+
+    def tearDown(self):
+        self.executor.close()
+        self.ollama.stop()
+        self.pages.shutdown()
+        self.pages.server_close()
+
+    def test_tool_results_are_fed_into_follow_up_turn(self):
+        answer = {"tool_used": "Browser Use", "summary": "Found the price.", "user_facing_answer": "It costs 42 EUR."}
+        self.ollama.config.responses = [
+            f"I will check. [TOOL_CALL: Browser Use, URL: {self.pages_url}/page]",
+            "```json\n" + json.dumps(answer) + "\n```\nIt costs 42 EUR.",
+        ]
+        events = list(stream_agent_request(self.ollama_url, "llama3", "How much?", enabled_tools=["Browser Use"], executor=self.executor))
+
+        tool_results = [e.payload for e in events if e.kind == OUTPUT_EVENT_TOOL_RESULT]
+        self.assertEqual(len(tool_results), 1)
+        self.assertTrue(tool_results[0].ok)
+        self.assertIn(OUTPUT_EVENT_FOLLOW_UP, [e.kind for e in events])
+        self.assertEqual(events[-1].kind, OUTPUT_EVENT_TURN_DONE)
+        raw_output, parsed = events[-1].payload
+        self.assertEqual(parsed.json_block.data, answer)
+
+        follow_up = self.ollama.payloads()[1]["messages"]
+        self.assertEqual(follow_up[2]["role"], "assistant")
+        self.assertIn("Price: 42 EUR", follow_up[3]["content"])
+
+    def test_session_history_keeps_the_tool_round(self):
+        self.ollama.config.responses = [f"[TOOL_CALL: Browser Use, URL: {self.pages_url}/page]", "It costs 42 EUR."]
+        session = ChatSession(self.ollama_url, "llama3")
+        self.addCleanup(session.close)
+        system_prompt = session.system_prompt(["Browser Use"])
+        events = list(stream_agent_request(self.ollama_url, "llama3", "How much?", enabled_tools=["Browser Use"],
+                                           executor=self.executor, system_prompt=system_prompt))
+        steps = [message for e in events if e.kind == OUTPUT_EVENT_FOLLOW_UP for message in e.payload.messages]
+        session.record_turn("How much?", events[-1].payload[0], ["Browser Use"], steps=steps)
+
+        answered = self.ollama.payloads()[1]["messages"] + [{"role": "assistant", "content": "It costs 42 EUR."}]
+        next_prompt = build_chat_messages(system_prompt, "And in USD?", history=session.history())
+        self.assertEqual(next_prompt[:len(answered)], answered)  # The next turn extends the cached prefix
+
+    def test_structured_mode_sends_schema_and_runs_requested_tool(self):
+        request = {"tool_used": "Browser Use", "tool_input": {"url": f"{self.pages_url}/page"}, "summary": "", "user_facing_answer": ""}
+        answer = {"tool_used": "Browser Use", "summary": "Found the price.", "user_facing_answer": "It costs 42 EUR."}
+        self.ollama.config.responses = [json.dumps(request), json.dumps(answer)]
+        events = list(stream_agent_request(self.ollama_url, "llama3", "How much?", enabled_tools=["Browser Use"],
+                                           executor=self.executor, structured=True))
+
+        self.assertEqual(self.ollama.payloads()[0]["format"]["properties"]["tool_used"]["enum"], ["Browser Use", None])
+        self.assertNotIn("```json", self.ollama.payloads()[0]["messages"][0]["content"])
+        self.assertTrue([e.payload for e in events if e.kind == OUTPUT_EVENT_TOOL_RESULT][0].ok)
+        self.assertIn("Price: 42 EUR", self.ollama.payloads()[1]["messages"][3]["content"])
+        self.assertEqual(events[-1].payload[1].json_block.data, answer)
+
+    def test_structured_last_round_offers_no_tool(self):
+        request = {"tool_used": "Browser Use", "tool_input": {"url": f"{self.pages_url}/page"}, "summary": "", "user_facing_answer": ""}
+        answer = {"tool_used": None, "summary": "Found the price.", "user_facing_answer": "It costs 42 EUR."}
+        self.ollama.config.responses = [json.dumps(request)] * MAX_TOOL_ROUNDS + [json.dumps(answer)]
+        events = list(stream_agent_request(self.ollama_url, "llama3", "How much?", enabled_tools=["Browser Use"],
+                                           executor=self.executor, structured=True))
+
+        last_request = self.ollama.payloads()[MAX_TOOL_ROUNDS]
+        self.assertEqual(last_request["format"]["properties"]["tool_used"]["enum"], [None])
+        self.assertIn("no more tools can be used", last_request["messages"][-1]["content"])
+        self.assertEqual(self.ollama.payloads()[MAX_TOOL_ROUNDS - 1]["format"]["properties"]["tool_used"]["enum"], ["Browser Use", None])
+        self.assertEqual(events[-1].payload[1].json_block.data, answer)
+
+    def test_prefetched_target_url_serves_the_tool_call(self):
+        target_url = f"{self.pages_url}/page"
+        answer = {"tool_used": "Browser Use", "summary": "Found the price.", "user_facing_answer": "It costs 42 EUR."}
+        self.ollama.config.responses = [
+            "[TOOL_CALL: Browser Use]",
+            "```json\n" + json.dumps(answer) + "\n```",
+            "No tools needed.",
+        ]
+        prefetcher = Prefetcher(self.executor)
+        events = list(stream_agent_request(self.ollama_url, "llama3", "How much?", target_url, ["Browser Use"],
+                                           executor=self.executor, prefetcher=prefetcher))
+        self.assertTrue([e.payload for e in events if e.kind == OUTPUT_EVENT_TOOL_RESULT][0].ok)
+        self.assertEqual(self.pages.fetches, 1)
+        self.assertEqual(prefetcher.stats()["hits"], 1)
+
+        list(stream_agent_request(self.ollama_url, "llama3", "Hi", target_url, ["Browser Use"], executor=self.executor, prefetcher=prefetcher))
+        stats = prefetcher.stats()
+        self.assertEqual((stats["started"], stats["hits"], stats["wasted"]), (2, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_no_tool_call_finishes_in_one_turn(self):
+        self.ollama.config.responses = ["Just an answer."]
+        events = list(stream_agent_request(self.ollama_url, "llama3", "Hi", executor=self.executor))
+        self.assertEqual(events[-1].payload[0], "Just an answer.")
+        self.assertEqual(len(self.ollama.payloads()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
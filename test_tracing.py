@@ -0,0 +1,72 @@
+import unittest
+import json
+import os
+import tempfile
+import tracing
+from core_logic import stream_agent_request, OUTPUT_EVENT_TURN_DONE
+from mock_ollama import MockOllamaConfig, MockOllamaServer
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.trace_log = os.path.join(self.directory.name, "trace.jsonl")
+        self.metrics_file = os.path.join(self.directory.name, "dogma.prom")
+
+    def tearDown(self):
+        tracing.configure()
+        self.directory.cleanup()
+
+    def _spans(self):
+        with open(self.trace_log, encoding="utf-8") as trace_file:
+            return [json.loads(line) for line in trace_file]
+
+    def test_disabled_tracing_returns_noop_span(self):
+        self.assertIsNone(tracing.get_tracer())
+        span = tracing.span("anything", size_bytes=1)
+        self.assertIs(span, tracing.NOOP_SPAN)
+        self.assertFalse(span)
+        with tracing.span("child", parent=span) as child:
+            child.set(tokens=1)
+        self.assertIs(child, tracing.NOOP_SPAN)
+
+    def test_spans_are_logged_and_aggregated(self):
+        tracing.configure(self.trace_log, self.metrics_file)
+        with tracing.span("outer") as outer:
+            tracing.span("inner", parent=outer, completion_tokens=5, response_bytes=100, status=200).end()
+        tracing.span("inner", parent=outer, completion_tokens=7).end()
+        inner, outer_record, _ = self._spans()
+        self.assertEqual(inner["parent_id"], outer_record["span_id"])
+        self.assertEqual(inner["trace_id"], outer_record["trace_id"])
+        self.assertIsNone(outer_record["parent_id"])
+
+        with open(self.metrics_file, encoding="utf-8") as metrics_file:
+            metrics = metrics_file.read()
+        self.assertIn('dogma_span_duration_seconds_count{span="outer"} 1', metrics)
+        # Written when the root span ended, before the second inner span
+        self.assertIn('dogma_span_attribute_total{span="inner",attribute="completion_tokens"} 5', metrics)
+        self.assertNotIn('attribute="status"', metrics)
+        self.assertIn('dogma_span_attribute_total{span="inner",attribute="completion_tokens"} 12', tracing.get_tracer().metrics_text())
+
+    def test_agent_request_spans(self):
+        tracing.configure(self.trace_log)
+        server = MockOllamaServer(MockOllamaConfig(ttft=0.02, tokens_per_second=0, answer_tokens=8)).start()
+        self.addCleanup(server.stop)
+        events = list(stream_agent_request(server.url, "mock:latest", "hello"))
+        self.assertEqual(events[-1].kind, OUTPUT_EVENT_TURN_DONE)
+
+        spans = {span["name"]: span for span in self._spans()}
+        self.assertEqual(set(spans), {"agent_request", "prompt_build", "model_turn", "connect", "ttft", "generation"})
+        request = spans["agent_request"]
+        self.assertTrue(all(span["trace_id"] == request["trace_id"] for span in spans.values()))
+        self.assertEqual(spans["model_turn"]["parent_id"], request["span_id"])
+        self.assertEqual(spans["connect"]["parent_id"], spans["model_turn"]["span_id"])
+        self.assertGreaterEqual(spans["ttft"]["duration_ms"], 20)
+        self.assertGreater(spans["model_turn"]["attributes"]["completion_tokens"], 0)
+        self.assertGreater(spans["generation"]["attributes"]["output_bytes"], 0)
+        self.assertGreater(spans["prompt_build"]["attributes"]["prompt_bytes"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,430 @@
+import importlib.util
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from html.parser import HTMLParser
+from content_distiller import html_to_text
+from execution_engine import TaskContext
+import tool_registry
+
+# Execution of the tools the model requests with `[TOOL_CALL: <tool>, URL: <url>]`.
+#
+# Tool calls are dispatched concurrently on a worker pool, with a per-host limit so a
+# turn that asks for several pages of the same site does not hammer it. Pages are
+# loaded through a fetcher: a single warm Playwright browser with a bounded pool of
+# reusable pages when Playwright is installed, or plain HTTP otherwise. asyncio, urllib.request
+# and Playwright are imported by the fetcher that needs them, when it first loads a page.
+#
+# Prefetches (see prefetch.py) can be aborted while they run: the run stops before loading
+# or extracting the page, and a browser page that is still loading is closed. Fetchers take
+# an optional `cancel` (an execution_engine.TaskContext) for this.
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 2
+DEFAULT_MAX_PAGES = 4
+DEFAULT_FETCH_TIMEOUT = 30  # Seconds
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+MAX_SCRAPED_ITEMS = 50  # Per list in SmartScrapeAI's extracted_data
+USER_AGENT = "Mozilla/5.0 (compatible; DogmaAgent/0.1)"
+
+Page = namedtuple("Page", ["url", "status", "html", "headers"])
+ToolResult = namedtuple("ToolResult", ["tool", "url", "ok", "text", "data", "error", "elapsed"])
+
+
+class ToolError(Exception):
+    """
+    Raised when a tool cannot load or process its target.
+    """
+
+
+class HttpPageFetcher:
+    """
+    Loads pages with plain HTTP requests (no JavaScript rendering).
+    """
+    def __init__(self, timeout: float = DEFAULT_FETCH_TIMEOUT):
+        self.timeout = timeout
+
+    def fetch(self, url: str, headers: dict = None, cancel=None) -> Page:
+        """
+        GETs `url`. Extra `headers` may carry validators; a 304 answer is returned as a Page with an empty body.
+        A cancelled `cancel` stops the fetch before the body is read.
+        """
+        import urllib.error
+        import urllib.request
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT, "Accept": "text/html,*/*;q=0.8", **(headers or {})})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                _check_cancelled(cancel, f"Cancelled while loading {url}")
+                body = response.read(MAX_PAGE_BYTES)
+                charset = response.headers.get_content_charset() or "utf-8"
+                return Page(response.geturl(), response.status, body.decode(charset, "replace"), dict(response.headers))
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return Page(url, 304, "", dict(e.headers))
+            raise ToolError(f"{url} returned HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise ToolError(f"Could not load {url}: {getattr(e, 'reason', e)}") from e
+
+    def is_unchanged(self, url: str, validators: dict, cancel=None) -> bool:
+        """
+        Sends a conditional GET with `validators` and returns True if `url` answered 304.
+        The body of a changed page is not downloaded.
+        """
+        import urllib.error
+        import urllib.request
+        _check_cancelled(cancel, f"Cancelled while revalidating {url}")
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT, "Accept": "text/html,*/*;q=0.8", **validators})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status == 304
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return True
+            raise ToolError(f"{url} returned HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise ToolError(f"Could not load {url}: {getattr(e, 'reason', e)}") from e
+
+    def close(self):
+        pass
+
+
+class PlaywrightBrowserPool:
+    """
+    One long-lived headless Chromium shared by all tool calls.
+
+    Playwright's async API runs on a private event loop thread; pages are created lazily,
+    at most `max_pages` at a time, and returned to an idle pool after each fetch so
+    later calls skip both the browser launch and the page setup.
+    """
+    def __init__(self, max_pages: int = DEFAULT_MAX_PAGES, timeout: float = DEFAULT_FETCH_TIMEOUT, headless: bool = True):
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.headless = headless
+        self._loop = None
+        self._start_lock = threading.Lock()
+        self._playwright = None
+        self._browser = None
+        self._idle_pages = None
+        self._slots = None
+
+    def _ensure_started(self):
+        import asyncio
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="dogma-browser", daemon=True).start()
+            try:
+                asyncio.run_coroutine_threadsafe(self._launch(), loop).result()
+            except Exception as e:
+                loop.call_soon_threadsafe(loop.stop)
+                if isinstance(e, ToolError):
+                    raise
+                # Typically Chromium missing after `pip install playwright` ("Executable doesn't exist")
+                raise ToolError(f"Could not start the browser (run `playwright install chromium` if it is missing): {e}") from e
+            self._loop = loop
+
+    async def _launch(self):
+        import asyncio
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError as e:
+            raise ToolError("Playwright is not installed (pip install playwright && playwright install chromium).") from e
+        self._playwright = await async_playwright().start()
+        try:
+            self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        except Exception:
+            await self._playwright.stop()
+            self._playwright = None
+            raise
+        self._idle_pages = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pages)
+
+    async def _fetch(self, url: str, cancel=None) -> Page:
+        import asyncio
+        async with self._slots:
+            if self._idle_pages.empty():
+                context = await self._browser.new_context(user_agent=USER_AGENT)
+                page = await context.new_page()
+            else:
+                page = self._idle_pages.get_nowait()
+            loading = True
+
+            def abort():
+                # Runs on the browser loop; closing the page makes a pending goto() fail at once
+                if loading:
+                    asyncio.ensure_future(page.close())
+
+            loop = asyncio.get_running_loop()
+            remove_cancel_hook = cancel.add_cancel_callback(lambda: loop.call_soon_threadsafe(abort)) if cancel is not None else (lambda: None)
+            try:
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=self.timeout * 1000)
+                html = await page.content()
+                await page.context.clear_cookies()
+            except Exception as e:
+                loading = False
+                remove_cancel_hook()
+                await page.context.close()
+                _check_cancelled(cancel, f"Cancelled while loading {url}")
+                raise ToolError(f"Could not load {url}: {e}") from e
+            loading = False
+            remove_cancel_hook()
+            self._idle_pages.put_nowait(page)
+            status = response.status if response is not None else None
+            if status is not None and status >= 400:
+                raise ToolError(f"{url} returned HTTP {status}")
+            headers = await response.all_headers() if response is not None else {}
+            return Page(page.url, status, html, headers)
+
+    def fetch(self, url: str, cancel=None) -> Page:
+        """
+        Loads `url` in a pooled page. A cancelled `cancel` closes the page if it is still loading.
+        """
+        import asyncio
+        self._ensure_started()
+        try:
+            return asyncio.run_coroutine_threadsafe(self._fetch(url, cancel), self._loop).result()
+        except ToolError:
+            raise
+        except Exception as e:
+            # E.g. the browser crashed while a page was being set up
+            raise ToolError(f"Could not load {url}: {e}") from e
+
+    async def _shutdown(self):
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+    def close(self):
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        import asyncio
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(self.timeout)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+
+
+def _check_cancelled(cancel, message: str):
+    if cancel is not None and cancel.cancelled:
+        raise ToolError(message)
+
+
+def default_fetcher():
+    """
+    The Playwright browser pool when Playwright is installed, plain HTTP otherwise.
+    """
+    if importlib.util.find_spec("playwright") is not None:
+        return PlaywrightBrowserPool()
+    return HttpPageFetcher()
+
+
+class _PageExtractor(HTMLParser):
+    """
+    Collects the title, meta description, headings and links of an HTML page.
+    """
+    _SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg"}
+    _HEADING_TAGS = {"h1", "h2", "h3"}
+
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.title = ""
+        self.description = ""
+        self.headings = []
+        self.links = []
+        self._skip_depth = 0
+        self._capture = None  # "title", a heading tag, or a link href
+        self._captured = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth += 1
+            return
+        attrs = dict(attrs)
+        if tag == "meta" and (attrs.get("name") or "").lower() == "description":
+            self.description = (attrs.get("content") or "").strip()
+        elif tag == "title" or tag in self._HEADING_TAGS:
+            self._capture, self._captured = tag, []
+        elif tag == "a" and attrs.get("href") and self._capture is None:
+            self._capture, self._captured = urllib.parse.urljoin(self.base_url, attrs["href"]), []
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._capture is None:
+            return
+        captured = " ".join("".join(self._captured).split())
+        if tag == "title" and self._capture == "title":
+            self.title = captured
+        elif tag in self._HEADING_TAGS and self._capture == tag:
+            if captured:
+                self.headings.append(captured)
+        elif tag == "a" and self._capture not in self._HEADING_TAGS and self._capture != "title":
+            self.links.append({"text": captured, "href": self._capture})
+        else:
+            return
+        self._capture = None
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._capture is not None:
+            self._captured.append(data)
+
+
+def extract_page(page: Page) -> _PageExtractor:
+    extractor = _PageExtractor(page.url)
+    extractor.feed(page.html)
+    extractor.close()
+    return extractor
+
+
+def _browser_use(page: Page):
+    # Returns the page's textual content (the title is its first line), without boilerplate
+    return html_to_text(page.html), None
+
+
+def _smart_scrape(page: Page):
+    # Returns the page text plus structured data points
+    extractor = extract_page(page)
+    data = {
+        "title": extractor.title,
+        "description": extractor.description,
+        "headings": extractor.headings[:MAX_SCRAPED_ITEMS],
+        "links": extractor.links[:MAX_SCRAPED_ITEMS],
+    }
+    return html_to_text(page.html), data
+
+
+class PrefetchFuture(Future):
+    """
+    Future of a prefetched ToolResult (see ToolExecutor.prefetch) that can also be aborted while it runs.
+    """
+    def __init__(self):
+        super().__init__()
+        self.cancel_request = TaskContext(0, None)  # Observed by the run in progress
+
+    def abort(self) -> bool:
+        """
+        Cancels the prefetch if it has not started, or stops it before its next step if it has
+        (closing a browser page that is still loading). Returns False if it had already finished.
+        """
+        if self.cancel():
+            return True
+        if self.done():
+            return False
+        self.cancel_request.cancel()
+        return True
+
+
+class ToolExecutor:
+    """
+    Runs tool calls concurrently: up to `max_workers` at once and `per_host_limit` per host.
+    Tool calls are any objects with `tool` and `url` attributes (e.g. core_logic.ToolCall).
+    """
+    def __init__(self, fetcher=None, max_workers: int = DEFAULT_MAX_WORKERS, per_host_limit: int = DEFAULT_PER_HOST_LIMIT, cache=None):
+        self.fetcher = fetcher if fetcher is not None else default_fetcher()
+        self.cache = cache  # Optional page_cache.PageCache shared across calls
+        self.per_host_limit = per_host_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dogma-tool")
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return slot
+
+    def submit(self, tool_call, allowed_tools: list[str] = None):
+        """
+        Schedules `tool_call` and returns a Future of its ToolResult. Failures are reported
+        in the result rather than raised. `allowed_tools`, if given, restricts which tools may run.
+        """
+        return self._executor.submit(self._run_one, tool_call.tool, tool_call.url, allowed_tools)
+
+    def prefetch(self, url: str, tools: list[str], allowed_tools: list[str] = None) -> dict:
+        """
+        Schedules `url` for each of `tools` in one background job and returns {tool: PrefetchFuture}.
+        The tools run one after the other, so with a page cache the page is loaded once; an
+        aborted Future is skipped, or stopped if its tool is running. If the job never runs
+        (the executor was closed), its Futures are cancelled.
+        """
+        futures = {tool: PrefetchFuture() for tool in tools}
+        job = self._executor.submit(self._prefetch, url, futures, allowed_tools)
+        job.add_done_callback(lambda job: _settle_prefetches(job, futures))
+        return futures
+
+    def _prefetch(self, url: str, futures: dict, allowed_tools: list[str]):
+        for tool, future in futures.items():
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run_one(tool, url, allowed_tools, future.cancel_request))
+            except Exception as e:
+                future.set_exception(e)
+
+    def run(self, tool_calls, allowed_tools: list[str] = None) -> list[ToolResult]:
+        """
+        Runs all `tool_calls` concurrently and returns their results in the same order.
+        """
+        futures = [self.submit(tool_call, allowed_tools) for tool_call in tool_calls]
+        return [future.result() for future in futures]
+
+    def _run_one(self, tool: str, url: str, allowed_tools: list[str], cancel=None) -> ToolResult:
+        started = time.perf_counter()
+        try:
+            text, data = self._execute(tool, url, allowed_tools, cancel)
+        except ToolError as e:
+            return ToolResult(tool, url, False, "", None, str(e), time.perf_counter() - started)
+        return ToolResult(tool, url, True, text, data, None, time.perf_counter() - started)
+
+    def _execute(self, tool: str, url: str, allowed_tools: list[str], cancel=None):
+        if tool_registry.get_tool(tool) is None:
+            raise ToolError(f"Unknown tool: {tool}")
+        if allowed_tools is not None and tool not in allowed_tools:
+            raise ToolError(f"Tool is not enabled: {tool}")
+        parsed = urllib.parse.urlsplit(url or "")
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ToolError(f"Invalid URL for {tool}: {url!r}")
+        fetch_options = {"cancel": cancel} if cancel is not None else {}
+        if self.cache is None:
+            with self._host_slot(parsed.hostname.lower()):
+                _check_cancelled(cancel, f"Cancelled before loading {url}")
+                page = self.fetcher.fetch(url, **fetch_options)
+            _check_cancelled(cancel, f"Cancelled before extracting {url}")
+            return tool_registry.load_handler(tool)(page)
+
+        with self._host_slot(parsed.hostname.lower()):
+            _check_cancelled(cancel, f"Cancelled before loading {url}")
+            page = self.cache.get_page(url, self.fetcher, **fetch_options)
+        # An unchanged page also skips the extraction step
+        extracted = self.cache.get_extract(url, tool)
+        if extracted is None:
+            _check_cancelled(cancel, f"Cancelled before extracting {url}")
+            extracted = tool_registry.load_handler(tool)(page)
+            self.cache.put_extract(url, tool, *extracted)
+        return extracted
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.fetcher.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _settle_prefetches(job, futures: dict):
+    # Cancels the Futures a cancelled or failed prefetch job left unresolved, so no claim waits forever
+    error = None if job.cancelled() else job.exception()
+    for future in futures.values():
+        if future.done() or future.cancel():
+            continue
+        future.set_exception(error or ToolError("The prefetch stopped before this tool ran."))
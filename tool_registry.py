@@ -0,0 +1,80 @@
+import importlib
+import threading
+from collections import namedtuple
+
+# Registry of the tools the agent can call.
+#
+# A tool is described by the text the system prompts show the model and by the function
+# that runs it. The function is named as "module:attribute" and only imported when the
+# tool is first executed, so building prompts does not load the fetchers, the browser
+# backend or the parsers behind them. Tools are listed in registration order.
+
+ToolSpec = namedtuple("ToolSpec", ["name", "description", "usage", "summary", "handler"])
+# description: prose for the fenced-block system prompt
+# usage: the `[TOOL_CALL: ...]` directive that invokes the tool
+# summary: one clause for the structured-output system prompt
+# handler: "module:attribute" of a function taking a tool_executor.Page and returning (text, data)
+
+_tools = {}
+_handlers = {}  # name -> imported handler function
+_lock = threading.Lock()
+
+
+def register_tool(name: str, description: str, summary: str, handler: str, url_placeholder: str = "url"):
+    """
+    Adds (or replaces) the tool `name`; `handler` is imported on first use.
+    """
+    usage = f"[TOOL_CALL: {name}, URL: <{url_placeholder}>]"
+    with _lock:
+        _tools[name] = ToolSpec(name, description, usage, summary, handler)
+        _handlers.pop(name, None)
+
+
+def get_tool(name: str) -> ToolSpec:
+    """
+    The ToolSpec registered as `name`, or None.
+    """
+    return _tools.get(name)
+
+
+def tool_names() -> list[str]:
+    return list(_tools)
+
+
+def known_tools(names: list[str]) -> list[ToolSpec]:
+    """
+    The specs of the registered tools among `names`, in the order given; unknown names are skipped.
+    """
+    return [_tools[name] for name in names or [] if name in _tools]
+
+
+def load_handler(name: str):
+    """
+    Returns the function that runs tool `name`, importing its module on the first call.
+    Raises KeyError for an unregistered tool.
+    """
+    handler = _handlers.get(name)
+    if handler is not None:
+        return handler
+    module_name, _, attribute = _tools[name].handler.partition(":")
+    handler = getattr(importlib.import_module(module_name), attribute)
+    with _lock:
+        _handlers[name] = handler
+    return handler
+
+
+register_tool(
+    "Browser Use",
+    "Accesses a given URL and returns its textual content. Useful for fetching information from web pages.",
+    "returns the text content of a web page",
+    "tool_executor:_browser_use",
+    url_placeholder="url_to_visit",
+)
+register_tool(
+    "SmartScrapeAI",
+    "Extracts structured information from a webpage based on a user's query. "
+    "Use this when the user asks for specific data points from a URL.",
+    "extracts structured data points from a web page",
+    "tool_executor:_smart_scrape",
+    url_placeholder="url_for_scraping",
+)
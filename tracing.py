@@ -0,0 +1,223 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+# Per-request tracing spans and metrics export.
+#
+# Tracing is off until configure() is called; span() then returns a shared no-op span, so
+# instrumented code costs one global lookup per span. When enabled, every finished span is
+# appended to a JSONL trace log and aggregated into per-span duration histograms and totals
+# of its numeric attributes (token counts, byte sizes), which are written as a Prometheus
+# textfile (for node_exporter's textfile collector) whenever a root span finishes.
+#
+# Spans are linked explicitly through `parent` rather than through thread-local state,
+# because one request hops between the UI thread, engine workers and tool workers.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Seconds
+METRIC_PREFIX = "dogma"
+TOTALED_ATTRIBUTE_SUFFIXES = ("tokens", "bytes")  # Numeric attributes summed into the metrics
+TRACE_LOG_ENV = "DOGMA_TRACE_LOG"
+METRICS_FILE_ENV = "DOGMA_METRICS_FILE"
+
+_EPOCH_OFFSET = time.time() - time.perf_counter()  # Converts perf_counter readings to wall-clock time
+
+
+class Span:
+    """
+    A timed operation. End it with end() or use it as a context manager; attributes set
+    before the end are exported with it.
+    """
+    def __init__(self, tracer, name: str, parent=None, start: float = None, attributes: dict = None):
+        self._tracer = tracer
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter() if start is None else start
+        self.duration = None
+        self.attributes = dict(attributes or {})
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name: str, amount=1):
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def end(self, end: float = None, **attributes):
+        if self.duration is not None:
+            return # Already ended
+        self.attributes.update(attributes)
+        self.duration = max(0.0, (time.perf_counter() if end is None else end) - self.start)
+        self._tracer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.end()
+
+
+class _NoopSpan:
+    # Returned while tracing is disabled; falsy so callers can skip computing attributes
+    name = trace_id = span_id = parent_id = start = duration = None
+    attributes = {}
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, name: str, amount=1):
+        pass
+
+    def end(self, end: float = None, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _SpanMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.duration_sum = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.attribute_totals = {}
+
+
+class Tracer:
+    """
+    Collects finished spans into a JSONL trace log (`trace_log`) and Prometheus metrics
+    (`metrics_file`); either may be None.
+    """
+    def __init__(self, trace_log: str = None, metrics_file: str = None):
+        self.trace_log = trace_log
+        self.metrics_file = metrics_file
+        self._metrics = {}  # span name -> _SpanMetrics
+        self._lock = threading.Lock()
+        self._log_file = open(trace_log, "a", encoding="utf-8") if trace_log else None
+
+    def span(self, name: str, parent=None, start: float = None, **attributes) -> Span:
+        return Span(self, name, parent or None, start, attributes)
+
+    def _finish(self, span: Span):
+        line = None
+        if self._log_file is not None:
+            line = json.dumps({
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "start": round(_EPOCH_OFFSET + span.start, 6),
+                "duration_ms": round(span.duration * 1000, 3),
+                "attributes": span.attributes,
+            }, default=str) + "\n"
+        with self._lock:
+            metrics = self._metrics.get(span.name)
+            if metrics is None:
+                metrics = self._metrics[span.name] = _SpanMetrics()
+            metrics.count += 1
+            metrics.duration_sum += span.duration
+            if "error" in span.attributes:
+                metrics.errors += 1
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    metrics.buckets[index] += 1
+            for key, value in span.attributes.items():
+                if key.endswith(TOTALED_ATTRIBUTE_SUFFIXES) and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics.attribute_totals[key] = metrics.attribute_totals.get(key, 0) + value
+            if line is not None:
+                self._log_file.write(line)
+                self._log_file.flush()
+        if span.parent_id is None:
+            self.write_metrics()
+
+    def metrics_text(self) -> str:
+        """
+        The aggregated span metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            snapshot = sorted(self._metrics.items())
+            lines = [
+                f"# HELP {METRIC_PREFIX}_span_duration_seconds Duration of traced operations.",
+                f"# TYPE {METRIC_PREFIX}_span_duration_seconds histogram",
+            ]
+            for name, metrics in snapshot:
+                for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                    lines.append(f'{METRIC_PREFIX}_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'{METRIC_PREFIX}_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {metrics.count}')
+                lines.append(f'{METRIC_PREFIX}_span_duration_seconds_sum{{span="{name}"}} {metrics.duration_sum:.6f}')
+                lines.append(f'{METRIC_PREFIX}_span_duration_seconds_count{{span="{name}"}} {metrics.count}')
+            lines.append(f"# HELP {METRIC_PREFIX}_span_errors_total Traced operations that failed.")
+            lines.append(f"# TYPE {METRIC_PREFIX}_span_errors_total counter")
+            for name, metrics in snapshot:
+                lines.append(f'{METRIC_PREFIX}_span_errors_total{{span="{name}"}} {metrics.errors}')
+            lines.append(f"# HELP {METRIC_PREFIX}_span_attribute_total Sum of numeric span attributes such as token counts and byte sizes.")
+            lines.append(f"# TYPE {METRIC_PREFIX}_span_attribute_total counter")
+            for name, metrics in snapshot:
+                for key, total in sorted(metrics.attribute_totals.items()):
+                    lines.append(f'{METRIC_PREFIX}_span_attribute_total{{span="{name}",attribute="{key}"}} {total:g}')
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        if not self.metrics_file:
+            return
+        # Written to a temporary file and renamed so the collector never reads a partial file
+        temp_path = f"{self.metrics_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.metrics_text())
+        os.replace(temp_path, self.metrics_file)
+
+    def close(self):
+        self.write_metrics()
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+
+_tracer = None
+
+
+def configure(trace_log: str = None, metrics_file: str = None) -> Tracer:
+    """
+    Enables tracing to the given outputs, replacing any previous configuration.
+    With neither output, tracing is disabled.
+    """
+    global _tracer
+    previous, _tracer = _tracer, None
+    if previous is not None:
+        previous.close()
+    if trace_log or metrics_file:
+        _tracer = Tracer(trace_log, metrics_file)
+    return _tracer
+
+
+def configure_from_env() -> Tracer:
+    return configure(os.environ.get(TRACE_LOG_ENV), os.environ.get(METRICS_FILE_ENV))
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, parent=None, start: float = None, **attributes):
+    """
+    Starts a span, or returns NOOP_SPAN when tracing is disabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return tracer.span(name, parent, start, **attributes)